@@ -0,0 +1,6 @@
+-- AlterTable
+ALTER TABLE "chat_messages" ADD COLUMN     "token_count" INTEGER,
+ADD COLUMN     "token_encoding" TEXT;
+
+-- Existing rows are backfilled by `python -m server.scripts.backfill_token_counts` because the
+-- token counts must be computed with tiktoken.
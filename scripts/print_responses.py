@@ -2,10 +2,10 @@ import asyncio
 import os
 
 from openai import AsyncOpenAI
-import tiktoken
 
 from scripts.utils import fetch_response
 from dotenv import load_dotenv
+from server.api.tokenizers import fetch_encoding
 
 load_dotenv()
 
@@ -23,7 +23,7 @@ async def main() -> None:
     llm = AsyncOpenAI(
         api_key=os.environ.get("OPENAI_API_KEY"),
     )
-    encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = fetch_encoding(model)
 
     # Generate responses asynchronously
     num_responses = 25
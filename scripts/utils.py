@@ -7,6 +7,7 @@ from openai import AsyncOpenAI, AsyncStream, Stream
 from openai.types.chat import ChatCompletionChunk
 
 from server.api.utils import (
+    TurnContext,
     add_memories,
     add_system_prompts,
     search_memories,
@@ -65,19 +66,14 @@ async def run_dialogue(
 
         # Much of this logic is copied from production. We duplicate it so that we call the Mem0
         # functions one time per iteration instead of `num_responses` times.
-        (relevant_memories_with_preferences, encoding), all_memories = (
-            await asyncio.gather(
-                search_memories(
-                    mem0=mem0,
-                    messages=messages,
-                    user_id=user_id,
-                    model=model,
-                ),
-                mem0.get_all(
-                    filters={"user_id": user_id},
-                    version="v2",
-                ),
-            )
+        turn = TurnContext(messages, model=model)
+        encoding = turn.encoding
+        relevant_memories_with_preferences, all_memories = await asyncio.gather(
+            search_memories(turn=turn, user_id=user_id),
+            mem0.get_all(
+                filters={"user_id": user_id},
+                version="v2",
+            ),
         )
         memories = [
             memory
@@ -99,7 +95,7 @@ async def run_dialogue(
             user_gender="male",
             memories=memories,
             preferences=preferences,
-        )
+        ).to_list()
         json.dump(messages_with_system_prompts, open("output.json", "w"))
 
         # Generate responses asynchronously
@@ -148,9 +144,9 @@ async def run_dialogue(
         json.dump(messages_with_system_prompts, open("output.json", "w"))
 
         await add_memories(
-            messages=messages,
+            turn=TurnContext(messages[:-1], model=model),
+            agent_response=messages[-1]["content"],
             user_id=user_id,
-            model=model,
         )
 
         print("-------------------------------------------------")
@@ -3,42 +3,36 @@ from openai.types.chat import ChatCompletionMessageParam, ChatCompletionChunk
 from openai import AsyncOpenAI
 from typing import List
 
-import tiktoken
 from livekit.plugins.openai.log import logger
-from server.api.mem0 import fetch_all_memories
+from server.api.mem0 import fetch_all_memories_within_budget
 
 from server.api.constants import LLM
 from server.api.utils import (
+    TurnContext,
     add_system_prompts,
-    get_final_messages_by_token_limit,
+    record_memory_selection,
     search_memories,
+    select_memories,
 )
 
 
 async def generate_response(
     llm: AsyncOpenAI,
-    messages: List[ChatCompletionMessageParam],
+    turn: TurnContext,
     user_id: str,
     timezone: str,
     ai_first_name: str,
     user_first_name: str,
     user_gender: str,
 ):
-    encoding = tiktoken.get_encoding("cl100k_base")
     relevant_memories_with_preferences = []
     all_memories = []
     try:
         # The mem0 client may be None if the call to fetch it timed out. In this case, we use defaults for the memories so
         # the chat continues to function.
-        (relevant_memories_with_preferences, encoding), all_memories = (
-            await asyncio.gather(
-                search_memories(
-                    messages=messages,
-                    user_id=user_id,
-                    model=LLM,
-                ),
-                fetch_all_memories(user_id=user_id),
-            )
+        relevant_memories_with_preferences, all_memories = await asyncio.gather(
+            search_memories(turn=turn, user_id=user_id),
+            fetch_all_memories_within_budget(user_id=user_id),
         )
     except Exception as e:
         # Log the exception this will send it to sentry, but we'll still process the response
@@ -59,25 +53,34 @@ async def generate_response(
         and "conversation_preferences" in memory["categories"]
     ]
 
+    # Only the most relevant memories that fit within the memory token budget are added
+    memory_selection = select_memories(memories, preferences, turn.encoding)
+    turn.memory_tokens = memory_selection.num_tokens
+    record_memory_selection(memory_selection)
+    logger.info(
+        f"Selected {len(memory_selection.memories)} of {len(memories)} memories "
+        f"({memory_selection.num_tokens} tokens, {memory_selection.num_duplicates} "
+        f"duplicates, {memory_selection.num_over_budget} over budget)"
+    )
+
     messages_with_system_prompts = add_system_prompts(
-        messages=messages,
+        messages=turn.messages,
         ai_first_name=ai_first_name,
         user_first_name=user_first_name,
         user_gender=user_gender,
         timezone=timezone,
-        memories=memories,
+        memories=memory_selection.memories,
         preferences=preferences,
     )
-    truncated_messages = get_final_messages_by_token_limit(
-        messages=messages_with_system_prompts,
-        model=LLM,
-        encoding=encoding,
-        token_limit=125000,
-    )
+    # The history's token counts were already computed for the memory search query, so only the
+    # system prompts are new here
+    truncated_messages = turn.truncate(messages_with_system_prompts, token_limit=125000)
 
     # Get the last 2048 elements of the array because OpenAI throws an error if the array is larger.
     truncated_messages = truncated_messages[-2048:]
 
-    return llm.chat.completions.create(
-        messages=truncated_messages, model=LLM, stream=True, store=True
+    # The messages are a view over the chat history until this point, so the final list of messages
+    # is only built once.
+    return await llm.chat.completions.create(
+        messages=truncated_messages.to_list(), model=LLM, stream=True, store=True
     )
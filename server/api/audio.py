@@ -0,0 +1,209 @@
+import asyncio
+import os
+import weakref
+from typing import AsyncIterator, Callable, List, Optional, Set, Union
+
+from elevenlabs import VoiceSettings
+from elevenlabs.client import AsyncElevenLabs
+
+from server.api.supabase import upload_audio_stream
+from server.api.tts_cache import tts_cache, tts_cache_key
+from server.livekit_worker import voices
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+# The format of audio messages, ElevenLabs' default
+AUDIO_MESSAGE_FORMAT = "mp3_44100_128"
+# The most sentences of a reply that are synthesized at once, see `synthesize_sentences`
+TTS_MAX_CONCURRENT_SENTENCES = int(os.environ.get("TTS_MAX_CONCURRENT_SENTENCES", 3))
+
+# One ElevenLabs client per event loop, for the same reason as `fetch_openai`
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncElevenLabs]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def fetch_elevenlabs() -> AsyncElevenLabs:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncElevenLabs(
+            api_key=os.environ.get("ELEVEN_LABS_API_KEY"),
+            base_url=os.environ.get("ELEVEN_LABS_BASE_URL"),
+        )
+        _clients[loop] = client
+    return client
+
+
+# Streams the MP3 audio of `text` as ElevenLabs produces it. `previous_text` is the text spoken
+# before it, if it's one part of a longer reply, so the intonation of the parts flows together.
+# Audio of text that was synthesized before, wherever it came in a reply, is served from `tts_cache`
+# without calling ElevenLabs, and new audio is cached once it's complete.
+async def stream_speech(
+    text: str,
+    voice_settings: voices.VoiceSettings,
+    previous_text: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    key = tts_cache_key(voice_settings, text, AUDIO_MESSAGE_FORMAT)
+    try:
+        cached = await tts_cache.get(key)
+    except Exception as e:
+        # The cache is an optimization, so a broken cache must never break an audio message
+        logger.error(e, exc_info=True)
+        cached = None
+    if cached is not None:
+        yield cached
+        return
+
+    options = {"previous_text": previous_text} if previous_text else {}
+    chunks = []
+    async for chunk in fetch_elevenlabs().text_to_speech.convert_as_stream(
+        voice_settings.voice_id,
+        text=text,
+        model_id=voice_settings.model,
+        output_format=AUDIO_MESSAGE_FORMAT,
+        voice_settings=VoiceSettings(
+            stability=voice_settings.stability,
+            similarity_boost=voice_settings.similarity,
+            style=voice_settings.style,
+            use_speaker_boost=voice_settings.speaker_boost,
+        ),
+        **options,
+    ):
+        chunks.append(chunk)
+        yield chunk
+
+    try:
+        await tts_cache.set(key, b"".join(chunks))
+    except Exception as e:
+        logger.error(e, exc_info=True)
+
+
+# Synthesizes each sentence as soon as it's complete instead of waiting for the whole reply, so the
+# first audio is ready after the first sentence is written and synthesized. At most
+# `max_concurrent` sentences are synthesized at once. The audio of the first sentence is streamed
+# as it arrives, and the audio of later sentences is buffered until the ones before them are done,
+# so it's stitched back together in order. MP3 frames are independent, so the parts concatenate
+# into one playable file.
+async def synthesize_sentences(
+    sentences: AsyncIterator[str],
+    synthesize: Callable[[str, Optional[str]], AsyncIterator[bytes]],
+    max_concurrent: int = TTS_MAX_CONCURRENT_SENTENCES,
+) -> AsyncIterator[bytes]:
+    slots = asyncio.Semaphore(max_concurrent)
+    # The chunks of each sentence's audio, in the order of the sentences
+    ordered_chunks: asyncio.Queue = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def synthesize_sentence(
+        text: str, previous_text: Optional[str], chunks: asyncio.Queue
+    ) -> None:
+        try:
+            async with slots:
+                async for chunk in synthesize(text, previous_text):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            chunks.put_nowait(e)
+        else:
+            chunks.put_nowait(None)
+
+    async def schedule() -> None:
+        previous_sentences: List[str] = []
+        try:
+            # Sentences are read as soon as they're ready, even when the window is full, so the
+            # LLM's stream (and the text of the reply) isn't held back by synthesis
+            async for sentence in sentences:
+                chunks: asyncio.Queue = asyncio.Queue()
+                tasks.append(
+                    asyncio.create_task(
+                        synthesize_sentence(
+                            sentence, " ".join(previous_sentences) or None, chunks
+                        )
+                    )
+                )
+                previous_sentences.append(sentence)
+                ordered_chunks.put_nowait(chunks)
+        except Exception as e:
+            ordered_chunks.put_nowait(e)
+        else:
+            ordered_chunks.put_nowait(None)
+
+    scheduler = asyncio.create_task(schedule())
+    try:
+        while True:
+            chunks = await ordered_chunks.get()
+            if chunks is None:
+                return
+            if isinstance(chunks, Exception):
+                raise chunks
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+    finally:
+        scheduler.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+# Splits a stream of chunks into `n` streams that each get every chunk, like `itertools.tee`. The
+# source is read as fast as it produces chunks, so a slow consumer (or one that stopped reading,
+# like the response of a client that disconnected) doesn't hold back the others. An error from the
+# source is raised in every stream.
+def tee_chunks(source: AsyncIterator[bytes], n: int = 2) -> List[AsyncIterator[bytes]]:
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(n)]
+
+    async def pump() -> None:
+        try:
+            async for chunk in source:
+                for queue in queues:
+                    queue.put_nowait(chunk)
+        except Exception as e:
+            for queue in queues:
+                queue.put_nowait(e)
+        else:
+            for queue in queues:
+                queue.put_nowait(None)
+
+    pump_task: Optional[asyncio.Task] = None
+
+    async def consume(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+        nonlocal pump_task
+        if pump_task is None:
+            pump_task = start_background_task(pump())
+        while True:
+            item: Union[bytes, Exception, None] = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return [consume(queue) for queue in queues]
+
+
+# The event loop only keeps weak references to tasks, so tasks that nothing awaits are kept here
+# until they finish
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def log_background_task_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(task.exception(), exc_info=task.exception())
+
+
+def start_background_task(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(log_background_task_error)
+    return task
+
+
+# Uploads an audio message to storage from its chunks as they arrive, in the background
+def start_audio_upload(audio_id: str, chunks: AsyncIterator[bytes]) -> asyncio.Task:
+    return start_background_task(upload_audio_stream(f"{audio_id}.mp3", chunks))
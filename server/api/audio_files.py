@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from server.api.cache import DiskLRUCache, LRUCache
+from server.api.supabase import create_signed_audio_url, download_audio
+
+# Audio messages served by /api/fetchAudio are kept on local disk, so replaying one doesn't
+# download it from storage again. The least recently played are evicted past the size limit.
+AUDIO_CACHE_DIRECTORY = os.environ.get("AUDIO_CACHE_DIRECTORY", "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 1024**3))
+# When enabled, /api/fetchAudio redirects clients to a short-lived signed storage URL instead of
+# serving the audio itself, so the API process doesn't carry the bytes at all
+AUDIO_SIGNED_URL_REDIRECTS_ENABLED = (
+    os.environ.get("AUDIO_SIGNED_URL_REDIRECTS_ENABLED", "false").lower() == "true"
+)
+AUDIO_SIGNED_URL_EXPIRES_SECONDS = int(
+    os.environ.get("AUDIO_SIGNED_URL_EXPIRES_SECONDS", 60)
+)
+# How many (user, audio message) pairs are remembered as allowed, so replays skip the database
+AUDIO_OWNERS_CACHE_SIZE = int(os.environ.get("AUDIO_OWNERS_CACHE_SIZE", 10000))
+
+# An audio message never changes after it's uploaded, so clients can keep it for good and its ID is
+# enough for an ETag
+AUDIO_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+audio_cache = DiskLRUCache(AUDIO_CACHE_DIRECTORY, AUDIO_CACHE_MAX_BYTES, suffix=".mp3")
+audio_owners: LRUCache[Tuple[str, str], bool] = LRUCache(AUDIO_OWNERS_CACHE_SIZE)
+# Signed URLs by audio ID, with the time they were created. A URL is reused for the first half of
+# its lifetime, so replays don't each ask storage to sign one and the client has at least half of
+# it left to start the download.
+signed_urls: LRUCache[str, Tuple[str, float]] = LRUCache(AUDIO_OWNERS_CACHE_SIZE)
+
+# Downloads in progress, so concurrent requests for an audio message that isn't cached yet share
+# one download
+_downloads: Dict[str, asyncio.Task] = {}
+
+
+def audio_etag(audio_id: str) -> str:
+    return f'"{audio_id}"'
+
+
+# Whether an `If-None-Match` header matches the ETag, using the weak comparison RFC 9110 specifies
+# for it
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def download_to_cache(audio_id: str) -> str:
+    try:
+        audio = await download_audio(f"{audio_id}.mp3")
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (400, 404):
+            raise HTTPException(status_code=404, detail="Audio not found")
+        raise
+    return await asyncio.to_thread(audio_cache.set, audio_id, audio)
+
+
+# Returns the path of the audio message in the local cache, downloading it from storage first if
+# it isn't cached
+async def fetch_cached_audio(audio_id: str) -> str:
+    path = await asyncio.to_thread(audio_cache.get, audio_id)
+    if path is not None:
+        return path
+
+    download = _downloads.get(audio_id)
+    if download is None:
+        download = asyncio.create_task(download_to_cache(audio_id))
+        _downloads[audio_id] = download
+        download.add_done_callback(lambda _: _downloads.pop(audio_id, None))
+    # Shielded so a client that disconnects doesn't cancel the download for the others waiting
+    return await asyncio.shield(download)
+
+
+async def fetch_signed_url(audio_id: str) -> str:
+    signed_url = signed_urls.get(audio_id)
+    if (
+        signed_url is not None
+        and time.monotonic() - signed_url[1] < AUDIO_SIGNED_URL_EXPIRES_SECONDS / 2
+    ):
+        return signed_url[0]
+
+    created = time.monotonic()
+    url = await create_signed_audio_url(
+        f"{audio_id}.mp3", AUDIO_SIGNED_URL_EXPIRES_SECONDS
+    )
+    signed_urls.set(audio_id, (url, created))
+    return url
+
+
+# Responds with an audio message the user is allowed to play. Supports `If-None-Match` and `Range`
+# (including `If-Range`) requests, so players can seek and resume without downloading it again.
+async def audio_file_response(
+    audio_id: str, if_none_match: Optional[str] = None
+) -> Response:
+    etag = audio_etag(audio_id)
+    headers = {"ETag": etag, "Cache-Control": AUDIO_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if AUDIO_SIGNED_URL_REDIRECTS_ENABLED:
+        return RedirectResponse(
+            await fetch_signed_url(audio_id),
+            status_code=307,
+            headers={"Cache-Control": "no-store"},
+        )
+
+    return FileResponse(
+        await fetch_cached_audio(audio_id), media_type="audio/mpeg", headers=headers
+    )
@@ -0,0 +1,132 @@
+import asyncio
+import base64
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from server.api.audio import (
+    start_audio_upload,
+    stream_speech,
+    synthesize_sentences,
+    tee_chunks,
+)
+from server.api.multipart import (
+    MULTIPART_MIXED,
+    accepts_media_type,
+    new_boundary,
+    stream_multipart,
+)
+from server.api.sentences import segment_sentences
+from server.livekit_worker.voices import VoiceSettings
+
+
+# Starts synthesizing the audio message of a reply while its text is still streaming from the LLM.
+# Each sentence is synthesized as soon as the LLM has written it, instead of after the whole reply.
+# The audio is uploaded to storage while it's being generated, from the same stream of chunks that's
+# sent to the client, so the reply is read to the end even if the client disconnects.
+#
+# Returns the audio for the client, the upload, and a future of the reply's whole text. The future
+# is cancelled if the reply is cut off before it's complete.
+def start_audio_message(
+    reply: AsyncIterator[str], audio_id: str, voice_settings: VoiceSettings
+) -> Tuple[AsyncIterator[bytes], asyncio.Task, asyncio.Future]:
+    reply_text: List[str] = []
+    reply_done = asyncio.get_running_loop().create_future()
+
+    async def stream_reply() -> AsyncIterator[str]:
+        try:
+            async for content in reply:
+                reply_text.append(content)
+                yield content
+        except Exception as e:
+            reply_done.set_exception(e)
+            raise
+        except BaseException:
+            reply_done.cancel()
+            raise
+        reply_done.set_result("".join(reply_text))
+
+    audio = synthesize_sentences(
+        segment_sentences(stream_reply()),
+        synthesize=lambda text, previous_text: stream_speech(
+            text, voice_settings, previous_text=previous_text
+        ),
+    )
+    speech, upload_chunks = tee_chunks(audio)
+    upload = start_audio_upload(audio_id, upload_chunks)
+    return speech, upload, reply_done
+
+
+async def stream_reply_text(reply_done: asyncio.Future) -> AsyncIterator[bytes]:
+    yield json.dumps({"text": await reply_done}).encode("utf-8")
+
+
+# Streamed audio messages are three parts: the JSON with the message's audio ID, the MP3 audio as
+# raw bytes, streamed as it's generated, then the JSON with the message's text. The response starts
+# as soon as the audio does, without waiting for the rest of the reply; the text is complete before
+# its audio is, so sending it last doesn't delay it. The chunks from ElevenLabs are sent as they
+# are, without the copy and the third more bytes of base64.
+def stream_audio_message_parts(
+    audio_id: str,
+    audio: AsyncIterator[bytes],
+    reply_done: asyncio.Future,
+    boundary: str,
+) -> AsyncIterator[bytes]:
+    return stream_multipart(
+        [
+            (
+                {"Content-Type": "application/json"},
+                json.dumps({"audioId": audio_id}).encode("utf-8"),
+            ),
+            ({"Content-Type": "audio/mpeg", "Content-ID": f"<{audio_id}>"}, audio),
+            ({"Content-Type": "application/json"}, stream_reply_text(reply_done)),
+        ],
+        boundary,
+    )
+
+
+# The JSON body of an audio message for clients that don't accept a binary response. Encoding a
+# few hundred KB of audio takes a few milliseconds, so it's done off the event loop.
+def render_audio_message_json(text: str, audio_id: str, audio: bytes) -> bytes:
+    return json.dumps(
+        {
+            "text": text,
+            "audioId": audio_id,
+            "audioBase64": base64.b64encode(audio).decode("ascii"),
+        }
+    ).encode("utf-8")
+
+
+# Clients that accept `multipart/mixed` (or that set `audio_streaming_enabled`) get the audio
+# message streamed, see `stream_audio_message_parts`. Other clients get the whole message as JSON
+# once the audio is generated and uploaded.
+async def audio_message_response(
+    audio_id: str,
+    speech: AsyncIterator[bytes],
+    upload: asyncio.Task,
+    reply_done: asyncio.Future,
+    accept: Optional[str] = None,
+    streaming_enabled: bool = False,
+) -> Response:
+    if streaming_enabled or accepts_media_type(accept, MULTIPART_MIXED):
+        boundary = new_boundary()
+        return StreamingResponse(
+            stream_audio_message_parts(audio_id, speech, reply_done, boundary),
+            media_type=f"{MULTIPART_MIXED}; boundary={boundary}",
+        )
+
+    audio = b"".join([chunk async for chunk in speech])
+    text = await reply_done
+    try:
+        await asyncio.shield(upload)
+    except Exception as e:
+        raise HTTPException(status_code=405, detail=f"Audio upload failed: {e}")
+
+    return Response(
+        content=await asyncio.to_thread(
+            render_audio_message_json, text, audio_id, audio
+        ),
+        media_type="application/json",
+    )
@@ -0,0 +1,55 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+# An event loop running forever in a daemon thread. The chat routes run most of their async work in
+# `asyncio.run` on short-lived threads, and anything still running on those loops is cancelled when
+# they exit. Work that has to outlive the request (writes queued for later, searches whose results
+# arrive after the turn stopped waiting for them) is submitted here instead. Clients that keep
+# connections per event loop also get to reuse them across requests on this loop.
+class BackgroundEventLoop:
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None
+
+    # Returns the loop, starting it on first use
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name=self.name, daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    # Runs the coroutine on the background loop and waits for it from the current loop. Cancelling
+    # the caller cancels the coroutine.
+    async def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    # Stops the loop after the callbacks that are already scheduled. Work submitted afterwards starts
+    # a new loop.
+    async def stop(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        await asyncio.to_thread(thread.join)
+        loop.close()
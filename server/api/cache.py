@@ -0,0 +1,225 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+# A thread-safe in-process LRU cache with hit and miss counters. The API server handles requests on
+# multiple threads, so every operation takes the lock.
+class LRUCache(Generic[K, V]):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+# A thread-safe in-process LRU cache of byte strings, evicted by their total size rather than their
+# count
+class BytesLRUCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Values larger than the whole cache aren't stored
+    def set(self, key: Hashable, value: bytes) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._total_bytes += len(value)
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "bytes": self._total_bytes,
+        }
+
+
+# A thread-safe LRU cache of files in a directory, evicted by their total size rather than their
+# count. Entries are written to a temporary file and renamed into place, so readers never see a
+# partial file, and the index is rebuilt from the directory (least recently used first, by
+# modification time) when the cache is first used, so entries survive restarts.
+class DiskLRUCache:
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._sizes: "Optional[OrderedDict[str, int]]" = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    # The path of a key's file. Keys are used as file names, so they must not contain separators.
+    def path(self, key: str) -> str:
+        if not key or os.sep in key or key.startswith("."):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _index(self) -> "OrderedDict[str, int]":
+        if self._sizes is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    key = entry.name[: len(entry.name) - len(self.suffix)]
+                    entries.append((stat.st_mtime, key, stat.st_size))
+            self._sizes = OrderedDict((key, size) for _, key, size in sorted(entries))
+            self._total_bytes = sum(self._sizes.values())
+        return self._sizes
+
+    # Returns the path of the key's file if it's cached. The file's modification time is updated,
+    # so the order of use is kept across restarts. Files written by other processes that share the
+    # directory are found too, though each process only evicts the files in its own index.
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        with self._lock:
+            sizes = self._index()
+            indexed = key in sizes
+            if indexed:
+                sizes.move_to_end(key)
+        try:
+            if indexed:
+                os.utime(path)
+            else:
+                size = os.stat(path).st_size
+        except FileNotFoundError:
+            # Removed from outside the cache, or never cached
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if not indexed:
+                self._total_bytes += size - self._sizes.get(key, 0)
+                self._sizes[key] = size
+            self.hits += 1
+        return path
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    # Stores the data, evicting the least recently used entries until the cache fits in
+    # `max_bytes`, and returns the path of its file
+    def set(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        with self._lock:
+            self._index()
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".", delete=False
+        ) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+        with self._lock:
+            sizes = self._index()
+            self._total_bytes += len(data) - sizes.get(key, 0)
+            sizes[key] = len(data)
+            sizes.move_to_end(key)
+            while self._total_bytes > self.max_bytes and len(sizes) > 1:
+                evicted_key = next(iter(sizes))
+                self._forget(evicted_key)
+                try:
+                    os.remove(self.path(evicted_key))
+                except FileNotFoundError:
+                    pass
+        return path
+
+    def _forget(self, key: str) -> None:
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index())
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            sizes = self._index()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(sizes),
+                "bytes": self._total_bytes,
+            }
@@ -0,0 +1,140 @@
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Sequence, Tuple
+
+import tiktoken
+
+from server.api.utils import count_tokens_for_messages
+
+# The most turns written by one statement. Each turn binds 20 parameters, and Postgres allows at
+# most 65535 per statement.
+SAVE_CHAT_TURNS_BATCH_SIZE = int(os.environ.get("SAVE_CHAT_TURNS_BATCH_SIZE", 1000))
+
+CHAT_MESSAGE_COLUMNS = [
+    "id",
+    "chat_id",
+    "content",
+    "role",
+    "created",
+    "modified",
+    "display_type",
+    "audio_id",
+    "token_count",
+    "token_encoding",
+]
+# Raw queries don't know the column types, so enums and timestamps are cast from text
+CHAT_MESSAGE_COLUMN_CASTS = {
+    "role": '::"OpenAIRole"',
+    "created": "::timestamp(3)",
+    "modified": "::timestamp(3)",
+    "display_type": '::"DisplayType"',
+}
+
+
+# A user message and the agent's response to it. The message IDs can be chosen by the caller, so a
+# turn that's saved again (when a write is retried) isn't saved twice.
+@dataclass
+class ChatTurn:
+    chat_id: str
+    user_message: str
+    agent_message: str
+    user_message_timestamp: datetime
+    agent_message_timestamp: datetime
+    audio_messages_enabled: bool = False
+    audio_id: Optional[str] = None
+    user_message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    agent_message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+
+
+# Formats a timestamp the way Prisma stores it in a `timestamp` column: naive datetimes are assumed
+# to be UTC, and aware ones are converted to UTC
+def format_timestamp(timestamp: datetime) -> str:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+
+# Builds one statement that inserts every message of the turns and bumps the last message time of
+# their chats, so saving a turn is a single round trip instead of three statements in a
+# transaction. A single statement is atomic on its own. Returns the query and its parameters.
+def build_save_chat_turns_query(
+    turns: Sequence[ChatTurn],
+    encoding: tiktoken.Encoding,
+    now: Optional[datetime] = None,
+) -> Tuple[str, List[Any]]:
+    if not turns:
+        raise ValueError("At least one turn is required")
+
+    now = format_timestamp(now or datetime.now())
+    # Store the token count of each message so later turns don't need to re-encode the history
+    token_counts = count_tokens_for_messages(
+        [
+            message
+            for turn in turns
+            for message in (
+                {"role": "user", "content": turn.user_message},
+                {"role": "assistant", "content": turn.agent_message},
+            )
+        ],
+        encoding,
+    )
+
+    rows = []
+    for i, turn in enumerate(turns):
+        rows.append(
+            [
+                turn.user_message_id,
+                turn.chat_id,
+                turn.user_message,
+                "user",
+                format_timestamp(turn.user_message_timestamp),
+                now,
+                "text",
+                None,
+                token_counts[2 * i],
+                encoding.name,
+            ]
+        )
+        rows.append(
+            [
+                turn.agent_message_id,
+                turn.chat_id,
+                turn.agent_message,
+                "assistant",
+                format_timestamp(turn.agent_message_timestamp),
+                now,
+                "audio" if turn.audio_messages_enabled else "text",
+                turn.audio_id,
+                token_counts[2 * i + 1],
+                encoding.name,
+            ]
+        )
+
+    parameters: List[Any] = []
+    values = []
+    for row in rows:
+        placeholders = []
+        for column, value in zip(CHAT_MESSAGE_COLUMNS, row):
+            parameters.append(value)
+            placeholders.append(
+                f"${len(parameters)}{CHAT_MESSAGE_COLUMN_CASTS.get(column, '')}"
+            )
+        values.append(f"({', '.join(placeholders)})")
+
+    parameters.append(now)
+    now_placeholder = f"${len(parameters)}::timestamp(3)"
+    columns = ", ".join(f'"{column}"' for column in CHAT_MESSAGE_COLUMNS)
+    query = f"""
+        WITH inserted AS (
+            INSERT INTO "chat_messages" ({columns})
+            VALUES {', '.join(values)}
+            ON CONFLICT ("id") DO NOTHING
+            RETURNING "chat_id"
+        )
+        UPDATE "chats"
+        SET "last_message_time" = {now_placeholder}, "modified" = {now_placeholder}
+        WHERE "id" IN (SELECT "chat_id" FROM inserted)
+    """
+    return query, parameters
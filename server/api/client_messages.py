@@ -0,0 +1,61 @@
+from typing import Any, List
+
+from pydantic import BaseModel
+
+
+class ClientAttachment(BaseModel):
+    name: str
+    contentType: str
+    url: str
+
+
+class ToolInvocation(BaseModel):
+    toolCallId: str
+    toolName: str
+    args: dict
+    result: dict
+
+
+class ClientMessage(BaseModel):
+    id: str
+    role: str
+    content: str
+    created: str
+
+
+def convert_to_openai_messages(
+    messages: List[Any],
+) -> List[dict]:
+    openai_messages = []
+
+    for message in messages:
+        parts = []
+
+        parts.append({"type": "text", "text": message.content})
+
+        openai_messages.append({"role": message.role, "content": parts})
+
+    return openai_messages
+
+
+# Converts an openai message (which may have a content that is a list of parts) to a message with a fixed string content
+def message_to_fixed_string_content(message: dict) -> dict:
+    if isinstance(message["content"], str):
+        return message
+    else:
+        return {
+            "role": message["role"],
+            "content": "".join([part["text"] for part in message["content"]]),
+        }
+
+
+def build_chat_history(messages: List[ClientMessage]) -> List[dict]:
+    new_user_message = messages[-1]
+    openai_messages = convert_to_openai_messages(messages) + convert_to_openai_messages(
+        [new_user_message]
+    )
+
+    # The generate_response_intake_session doesn't handle the case where the content is a list of parts, so we need to
+    # convert the messages to a fixed string content format for now. We should probably update the function to handle this
+    # case nativly.
+    return [message_to_fixed_string_content(element) for element in openai_messages]
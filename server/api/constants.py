@@ -3,4 +3,10 @@ LLM = "gpt-4o-mini-2024-07-18"
 CONTEXT_WINDOWS = {"inflection_3_pi": 8000}
 CONTEXT_WINDOWS[LLM] = 128000
 
+# The tiktoken encoding that each model uses, which is needed to estimate the number of tokens in
+# the chat history. Token counts stored in the `chat_messages` table are tagged with the encoding
+# name so they can be recomputed if it changes.
+TOKEN_ENCODINGS = {"inflection_3_pi": "cl100k_base"}
+TOKEN_ENCODINGS[LLM] = "o200k_base"
+
 SUPABASE_AUDIO_MESSAGES_BUCKET_NAME = "audio-messages"
@@ -0,0 +1,79 @@
+import asyncio
+import os
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from fastapi import HTTPException, Request
+from prisma import Prisma
+
+# The size of the query engine's connection pool, and how long a query waits for a connection from
+# the pool before failing. Prisma reads both from the connection string.
+PRISMA_CONNECTION_LIMIT = int(os.environ.get("PRISMA_CONNECTION_LIMIT", 10))
+PRISMA_POOL_TIMEOUT_SECONDS = int(os.environ.get("PRISMA_POOL_TIMEOUT_SECONDS", 10))
+
+
+# Returns the database URL with the pool settings added to its query string, replacing any that
+# are already there
+def build_database_url(
+    url: str,
+    connection_limit: int = PRISMA_CONNECTION_LIMIT,
+    pool_timeout: int = PRISMA_POOL_TIMEOUT_SECONDS,
+) -> str:
+    parts = urlsplit(url)
+    query = {
+        key: value
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in ("connection_limit", "pool_timeout")
+    }
+    query["connection_limit"] = str(connection_limit)
+    query["pool_timeout"] = str(pool_timeout)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+# Starting the Prisma query engine and opening its connections takes longer than most queries, so
+# the API server connects one client when it starts (see the lifespan handler in `main.py`) and
+# every request shares it, instead of connecting and disconnecting a client per request.
+def create_prisma(url: Optional[str] = None) -> Prisma:
+    url = url or os.environ.get("DATABASE_URL")
+    if not url:
+        raise Exception("DATABASE_URL environment variable not set")
+    return Prisma(datasource={"url": build_database_url(url)})
+
+
+_prisma: Optional[Prisma] = None
+_prisma_lock: Optional[asyncio.Lock] = None
+
+
+# Returns the process's Prisma client, connecting it the first time. The API server connects it
+# when it starts and LiveKit jobs when they start, so turns are saved by calling the database
+# directly from either process.
+async def fetch_prisma() -> Prisma:
+    global _prisma, _prisma_lock
+
+    if _prisma is not None and _prisma.is_connected():
+        return _prisma
+
+    if _prisma_lock is None:
+        _prisma_lock = asyncio.Lock()
+    async with _prisma_lock:
+        if _prisma is None:
+            _prisma = create_prisma()
+        if not _prisma.is_connected():
+            await _prisma.connect()
+    return _prisma
+
+
+async def close_prisma() -> None:
+    global _prisma
+
+    if _prisma is not None and _prisma.is_connected():
+        await _prisma.disconnect()
+    _prisma = None
+
+
+# FastAPI dependency that returns the app's Prisma client
+def get_prisma(request: Request) -> Prisma:
+    prisma: Optional[Prisma] = getattr(request.app.state, "prisma", None)
+    if prisma is None or not prisma.is_connected():
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return prisma
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from server.api.metrics import fetch_latency_histogram
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+# The SQLite file jobs are stored in. Processes on the same machine (the API server and LiveKit job
+# processes) can share it: jobs are claimed with a lease, so each one runs in one process at a time.
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "jobs.sqlite3")
+# The most jobs a process runs at once
+JOB_QUEUE_CONCURRENCY = int(os.environ.get("JOB_QUEUE_CONCURRENCY", 8))
+# A failed job is retried with exponential backoff until it has been attempted this many times
+JOB_QUEUE_MAX_ATTEMPTS = int(os.environ.get("JOB_QUEUE_MAX_ATTEMPTS", 5))
+JOB_QUEUE_RETRY_BACKOFF_SECONDS = float(
+    os.environ.get("JOB_QUEUE_RETRY_BACKOFF_SECONDS", 2)
+)
+# A claimed job that isn't finished within its lease (because its process died) is run again
+JOB_QUEUE_LEASE_SECONDS = float(os.environ.get("JOB_QUEUE_LEASE_SECONDS", 300))
+# How long shutdown waits for queued jobs before leaving them for the next process to start
+JOB_QUEUE_DRAIN_TIMEOUT_SECONDS = float(
+    os.environ.get("JOB_QUEUE_DRAIN_TIMEOUT_SECONDS", 10)
+)
+# How often an idle process checks for retries that are due and jobs enqueued by other processes
+JOB_QUEUE_POLL_SECONDS = float(os.environ.get("JOB_QUEUE_POLL_SECONDS", 1))
+# The most jobs that run together as one batch, see `batch_handlers`
+JOB_QUEUE_MAX_BATCH_SIZE = int(os.environ.get("JOB_QUEUE_MAX_BATCH_SIZE", 16))
+
+# (id, kind, payload, attempts, enqueued_at, batch_key)
+Job = Tuple[int, str, str, int, float, Optional[str]]
+
+
+# A durable queue for work that runs after a reply is sent, like saving the turn and adding it to
+# mem0. Jobs are written to a SQLite file before they run, so they survive restarts, and at most
+# `concurrency` run at once in each process. Failed jobs are retried with backoff.
+#
+# Each job has a kind, which selects its handler, and a JSON payload. A job may run more than once
+# (if it's retried, or its process dies before it's deleted), so handlers must be idempotent.
+#
+# Kinds with a batch handler run their jobs in batches. A job enqueued with a batch key joins the
+# coalescing window of the key's pending jobs, and when one of them is claimed, the key's other due
+# jobs are claimed with it and passed to the batch handler together. They're completed, or retried,
+# together.
+#
+# The SQLite calls run on the event loop. They only touch a local file in WAL mode, so they take
+# well under a millisecond.
+class JobQueue:
+    def __init__(
+        self,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]],
+        batch_handlers: Optional[
+            Dict[str, Callable[[List[Dict[str, Any]]], Awaitable[None]]]
+        ] = None,
+        path: str = JOB_QUEUE_PATH,
+        name: str = "jobs",
+        concurrency: int = JOB_QUEUE_CONCURRENCY,
+        max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS,
+        retry_backoff_seconds: float = JOB_QUEUE_RETRY_BACKOFF_SECONDS,
+        lease_seconds: float = JOB_QUEUE_LEASE_SECONDS,
+        poll_seconds: float = JOB_QUEUE_POLL_SECONDS,
+        max_batch_size: int = JOB_QUEUE_MAX_BATCH_SIZE,
+    ):
+        self._handlers = handlers
+        self._batch_handlers = batch_handlers or {}
+        self.path = path
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_batch_size = max_batch_size
+        # Marks the jobs this queue enqueued, so `drain` doesn't wait for other processes' jobs
+        self._owner = uuid.uuid4().hex
+        self._db: Optional[sqlite3.Connection] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: Set[asyncio.Task] = set()
+        self._stats = {
+            "enqueued": 0,
+            "completed": 0,
+            "retried": 0,
+            "failed": 0,
+            # Jobs that ran in the batch of an earlier job
+            "batched": 0,
+        }
+        self._time_to_completion = fetch_latency_histogram(f"{name}.time_to_completion")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    claimed_until REAL,
+                    enqueued_by TEXT,
+                    batch_key TEXT
+                )
+                """)
+            # Files created before `enqueued_by` and `batch_key` were added
+            columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+            for column in ["enqueued_by", "batch_key"]:
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_available_at ON jobs (available_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_batch_key ON jobs (kind, batch_key)"
+            )
+            self._db = db
+        return self._db
+
+    # Stores the job and wakes the dispatcher. Starts the queue if it's called on an event loop and
+    # the queue isn't running yet.
+    #
+    # The job runs after `delay_seconds`. If it has a batch key and the key already has jobs waiting
+    # to run for the first time, it runs with them instead, so the window starts at the first job.
+    def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        batch_key: Optional[str] = None,
+        delay_seconds: float = 0,
+    ) -> int:
+        if kind not in self._handlers and kind not in self._batch_handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        now = time.time()
+        cursor = self._connection().execute(
+            """
+            INSERT INTO jobs (kind, payload, enqueued_at, available_at, enqueued_by, batch_key)
+            VALUES (?, ?, ?, COALESCE(
+                (
+                    SELECT MIN(available_at) FROM jobs
+                    WHERE kind = ? AND batch_key = ? AND attempts = 0
+                        AND claimed_until IS NULL
+                ),
+                ?
+            ), ?, ?)
+            """,
+            (
+                kind,
+                json.dumps(payload),
+                now,
+                kind,
+                batch_key,
+                now + delay_seconds,
+                self._owner,
+                batch_key,
+            ),
+        )
+        self._stats["enqueued"] += 1
+
+        if self._dispatcher is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return cursor.lastrowid
+            self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    # Starts running jobs on the current event loop, including jobs left by earlier processes
+    def start(self) -> None:
+        if self._dispatcher is not None:
+            return
+        self._connection()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    # Claims the next due job, with the other due jobs of its batch if it has one. Returns the jobs
+    # in the order they were enqueued.
+    def _claim(self) -> Optional[List[Job]]:
+        now = time.time()
+        db = self._connection()
+        job = db.execute(
+            """
+            UPDATE jobs SET claimed_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE available_at <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+                ORDER BY available_at, id
+                LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, enqueued_at, batch_key
+            """,
+            (now + self.lease_seconds, now, now),
+        ).fetchone()
+        if job is None:
+            return None
+
+        kind, batch_key = job[1], job[5]
+        if kind not in self._batch_handlers or batch_key is None:
+            return [job]
+
+        batch = db.execute(
+            """
+            UPDATE jobs SET claimed_until = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE kind = ? AND batch_key = ? AND available_at <= ?
+                    AND (claimed_until IS NULL OR claimed_until < ?)
+                ORDER BY id
+                LIMIT ?
+            )
+            RETURNING id, kind, payload, attempts, enqueued_at, batch_key
+            """,
+            (
+                now + self.lease_seconds,
+                kind,
+                batch_key,
+                now,
+                now,
+                self.max_batch_size - 1,
+            ),
+        ).fetchall()
+        return sorted([job, *batch])
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._slots.acquire()
+            # Cleared before claiming, so a job enqueued after the claim finds nothing still wakes
+            # the dispatcher
+            self._wakeup.clear()
+            try:
+                jobs = self._claim()
+            except Exception as e:
+                # Most likely the file is locked by another process. The dispatcher must keep
+                # running, or jobs enqueued in this process would never run.
+                self._slots.release()
+                logger.error(f"Failed to claim a job: {e}", exc_info=True)
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            if jobs is None:
+                self._slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run(jobs))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, jobs: List[Job]) -> None:
+        kind = jobs[0][1]
+        job_ids = [(job[0],) for job in jobs]
+        db = self._connection()
+        try:
+            payloads = [json.loads(job[2]) for job in jobs]
+            if kind in self._batch_handlers:
+                await self._batch_handlers[kind](payloads)
+            else:
+                await self._handlers[kind](payloads[0])
+        except asyncio.CancelledError:
+            # Cancelled by `drain`, so the jobs are left for the next process without using up an
+            # attempt
+            db.executemany(
+                "UPDATE jobs SET claimed_until = NULL, attempts = attempts - 1 WHERE id = ?",
+                job_ids,
+            )
+            raise
+        except Exception as e:
+            for job_id, _, _, attempts, _, _ in jobs:
+                if attempts >= self.max_attempts:
+                    logger.error(
+                        f"Job {job_id} ({kind}) failed after {attempts} attempts: {e}",
+                        exc_info=True,
+                    )
+                    db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    self._stats["failed"] += 1
+                else:
+                    delay = self.retry_backoff_seconds * 2 ** (attempts - 1)
+                    logger.warning(
+                        f"Job {job_id} ({kind}) failed, retrying in {delay}s: {e}"
+                    )
+                    db.execute(
+                        "UPDATE jobs SET claimed_until = NULL, available_at = ? WHERE id = ?",
+                        (time.time() + delay, job_id),
+                    )
+                    self._stats["retried"] += 1
+        else:
+            db.executemany("DELETE FROM jobs WHERE id = ?", job_ids)
+            now = time.time()
+            for job in jobs:
+                self._time_to_completion.observe(now - job[4])
+            self._stats["completed"] += len(jobs)
+            self._stats["batched"] += len(jobs) - 1
+        finally:
+            self._slots.release()
+
+    # Counts the jobs this queue enqueued that aren't running in any process and are due by
+    # `deadline`. Other processes' jobs, and retries that aren't due until later, are left for the
+    # processes that keep running.
+    def _count_pending(self, deadline: float) -> int:
+        return (
+            self._connection()
+            .execute(
+                """
+                SELECT COUNT(*) FROM jobs
+                WHERE enqueued_by = ? AND available_at <= ?
+                    AND (claimed_until IS NULL OR claimed_until < ?)
+                """,
+                (self._owner, deadline, time.time()),
+            )
+            .fetchone()[0]
+        )
+
+    # Called on shutdown. Waits up to `timeout` for the running jobs and the jobs this queue
+    # enqueued, including retries that are due within the timeout, then stops. Jobs that are still
+    # running are cancelled, and they and any jobs that haven't run stay in the file for the next
+    # process.
+    async def drain(self, timeout: float = JOB_QUEUE_DRAIN_TIMEOUT_SECONDS) -> None:
+        if self._dispatcher is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        # The deadline in the wall-clock time jobs are scheduled with
+        due_by = time.time() + timeout
+
+        def busy() -> bool:
+            if self._running:
+                return True
+            try:
+                return self._count_pending(due_by) > 0
+            except sqlite3.Error as e:
+                logger.error(f"Failed to count pending jobs: {e}", exc_info=True)
+                return True
+
+        while time.monotonic() < deadline and busy():
+            await asyncio.sleep(0.05)
+
+        self._dispatcher.cancel()
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(self._dispatcher, *running, return_exceptions=True)
+        self._dispatcher = None
+        self._wakeup = None
+        self._slots = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        depth, oldest_enqueued_at = (
+            self._connection()
+            .execute("SELECT COUNT(*), MIN(enqueued_at) FROM jobs")
+            .fetchone()
+        )
+        return {
+            **self._stats,
+            "queue_depth": depth,
+            "running": len(self._running),
+            "oldest_job_seconds": (
+                now - oldest_enqueued_at if oldest_enqueued_at is not None else 0.0
+            ),
+            "time_to_completion": self._time_to_completion.snapshot(),
+        }
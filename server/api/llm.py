@@ -0,0 +1,28 @@
+import asyncio
+import os
+import weakref
+
+from openai import AsyncOpenAI
+
+# Keeps one `AsyncOpenAI` client per event loop instead of constructing one per request, so
+# streams reuse the client's connection pool. The client's connections are bound to the event loop
+# that opened them, so a loop's client is dropped when the loop is garbage collected, the same as
+# the mem0 clients (see `Mem0ClientManager`).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def fetch_openai() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        _clients[loop] = client
+    return client
+
+
+async def close_openai() -> None:
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -1,10 +1,17 @@
+import asyncio
 import os
 import sentry_sdk
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from server.api.routes import chat, auth
 from sentry_sdk.integrations.asyncio import AsyncioIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
+from server.api.tokenizers import prewarm_encodings
+from server.api.mem0 import close_mem0, mem0_client_manager
+from server.api.database import close_prisma, fetch_prisma
+from server.api.llm import close_openai
+from server.api.supabase import close_storage_client
 
 sentry_sdk.init(
     dsn=os.getenv("EXPO_PUBLIC_SENTRY_DSN"),
@@ -20,7 +27,27 @@ sentry_sdk.init(
     ],
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect to mem0 in the background and load the tokenizers before serving requests so the first
+    # chat message doesn't pay for it
+    mem0_client_manager.start()
+    # Run the post-turn jobs left by the last process
+    chat.post_turn_jobs.start()
+    _, app.state.prisma = await asyncio.gather(
+        asyncio.to_thread(prewarm_encodings), fetch_prisma()
+    )
+    yield
+    # Finish saving the last turns before disconnecting from the database
+    await chat.post_turn_jobs.drain()
+    await close_prisma()
+    await close_mem0()
+    await close_openai()
+    await close_storage_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Route for the chat service
 app.include_router(chat.router)
@@ -1,12 +1,36 @@
 import asyncio
+import concurrent.futures
+import copy
 import os
-from typing import Union
+import threading
+import time
+import weakref
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+import httpx
 from mem0 import AsyncMemoryClient, MemoryClient
+from server.api.background import BackgroundEventLoop
+from server.api.cache import LRUCache
+from server.api.memory_index import MemoryIndex
+from server.api.metrics import fetch_latency_histogram
 from server.logger.index import fetch_logger
 from functools import partial
 
 logger = fetch_logger()
 
+T = TypeVar("T")
+
 
 async def run_with_timeout(func, *args, timeout=None, timeout_response=None, **kwargs):
     if asyncio.iscoroutinefunction(func):
@@ -41,53 +65,501 @@ def unsafe_fetch_mem0():
         return None
 
 
+# Keeps one mem0 client for the lifetime of the process instead of constructing one per call.
+# Constructing a client validates the API key with a blocking request, so it only happens once, in a
+# background thread, when the process starts. If it fails, it's retried with exponential backoff, and
+# calls made in the meantime get `None` (callers already fall back to no memories in that case)
+# instead of each paying for a new construction attempt.
+#
+# The client's `httpx.AsyncClient` keeps connections alive, but its connections are bound to the
+# event loop that opened them, and the chat routes run some work in `asyncio.run` on other threads.
+# Each event loop therefore gets its own copy of the client with its own connection pool, which is
+# dropped when the loop is garbage collected.
+class Mem0ClientManager:
+    INITIAL_BACKOFF_SECONDS = 1
+    MAX_BACKOFF_SECONDS = 60
+
+    def __init__(self, connect: Callable[[], Optional[AsyncMemoryClient]]):
+        self._connect_fn = connect
+        self._client: Optional[AsyncMemoryClient] = None
+        self._loop_clients: (
+            "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncMemoryClient]"
+        ) = weakref.WeakKeyDictionary()
+        self._connect_future: Optional[concurrent.futures.Future] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="mem0-connect"
+        )
+        self._backoff_seconds = self.INITIAL_BACKOFF_SECONDS
+        self._next_attempt_time = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Optional[AsyncMemoryClient]:
+        client = self._connect_fn()
+        with self._lock:
+            if client is None:
+                logger.warning(
+                    f"Failed to connect to mem0, retrying in {self._backoff_seconds}s"
+                )
+                self._next_attempt_time = time.monotonic() + self._backoff_seconds
+                self._backoff_seconds = min(
+                    self._backoff_seconds * 2, self.MAX_BACKOFF_SECONDS
+                )
+            else:
+                self._client = client
+                self._backoff_seconds = self.INITIAL_BACKOFF_SECONDS
+        return client
+
+    # Starts connecting in the background unless a client exists, a connection attempt is already
+    # in progress, or the last attempt failed too recently. Returns the pending attempt, if any.
+    def start(self) -> Optional[concurrent.futures.Future]:
+        with self._lock:
+            if self._client is not None:
+                return None
+            if self._connect_future is not None and not self._connect_future.done():
+                return self._connect_future
+            if time.monotonic() < self._next_attempt_time:
+                return None
+            self._connect_future = self._executor.submit(self._connect)
+            return self._connect_future
+
+    async def fetch(
+        self, timeout: Optional[float] = None
+    ) -> Optional[AsyncMemoryClient]:
+        if self._client is None:
+            connect_future = self.start()
+            if connect_future is not None:
+                try:
+                    # The attempt keeps running in the background if it times out, so a later call
+                    # can use its client
+                    await asyncio.wait_for(
+                        asyncio.shield(asyncio.wrap_future(connect_future)),
+                        timeout=timeout,
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        f"Timed out after {timeout}s waiting for mem0 client"
+                    )
+            if self._client is None:
+                return None
+
+        loop = asyncio.get_running_loop()
+        client = self._loop_clients.get(loop)
+        if client is None:
+            client = copy.copy(self._client)
+            client.async_client = httpx.AsyncClient(
+                base_url=self._client.sync_client.host,
+                headers=self._client.sync_client.client.headers,
+                timeout=60,
+            )
+            self._loop_clients[loop] = client
+        return client
+
+    # Closes the connections of the current event loop's client
+    async def close(self) -> None:
+        client = self._loop_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.async_client.aclose()
+
+
+mem0_client_manager = Mem0ClientManager(connect=unsafe_fetch_mem0)
+
+# Runs mem0 work that has to outlive the request that started it: queued writes, and searches whose
+# results arrive after the turn stopped waiting for them
+mem0_loop = BackgroundEventLoop(name="mem0")
+
+
+# Closes the mem0 connections and stops the background loop. Called when the process shuts down.
+async def close_mem0() -> None:
+    if mem0_loop.started:
+        await mem0_loop.run(mem0_client_manager.close())
+        await mem0_loop.stop()
+    await mem0_client_manager.close()
+
+
 async def fetch_mem0() -> Union[AsyncMemoryClient, None]:
-    return await run_with_timeout(unsafe_fetch_mem0, timeout=1)
+    return await mem0_client_manager.fetch(timeout=1)
+
+
+# Each user's memories are cached in-process because `generate_response` needs the full list on
+# every turn (to find the user's conversation preferences) even though it rarely changes. Entries
+# are served until they're older than the TTL or a new memory is added for the user. After that, only
+# the memories updated since the last sync are fetched and merged in. Incremental refreshes can't
+# see memories that were deleted by something other than `call_add_memory`, so entries are also
+# fully re-fetched periodically.
+MEMORY_CACHE_TTL_SECONDS = float(os.environ.get("MEMORY_CACHE_TTL_SECONDS", 300))
+MEMORY_CACHE_FULL_REFRESH_SECONDS = float(
+    os.environ.get("MEMORY_CACHE_FULL_REFRESH_SECONDS", 3600)
+)
+MEMORY_CACHE_SIZE = int(os.environ.get("MEMORY_CACHE_SIZE", 1000))
+# Incremental refreshes overlap the previous sync by this much to allow for clock skew between this
+# server and mem0. Memories fetched twice are merged by id.
+MEMORY_CACHE_SYNC_OVERLAP = timedelta(minutes=1)
+
+
+@dataclass
+class CachedMemories:
+    # Memories keyed by id, in the order mem0 returned them
+    memories: Dict[str, Dict[str, Any]]
+    # When the memories were last fetched from mem0 (wall clock, for the `updated_at` filter)
+    synced_at: datetime
+    # When the memories were last fetched, and last fully fetched, from mem0 (monotonic)
+    fetched_at: float
+    fully_fetched_at: float
+    # Set when a memory was added for the user, so the next read refreshes the entry
+    stale: bool = False
+
+
+memory_cache: LRUCache[str, CachedMemories] = LRUCache(MEMORY_CACHE_SIZE)
+
 
+def _memories_by_id(memories: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {memory.get("id") or memory.get("memory"): memory for memory in memories}
 
+
+# Marks the user's cached memories as stale and removes the memories that mem0 reported as deleted
+# in the response to an `add` call
+def invalidate_cached_memories(user_id: str, add_response: Any = None) -> None:
+    entry = memory_cache.get(user_id)
+    if entry is None:
+        return
+
+    deleted_ids = set()
+    if isinstance(add_response, list):
+        deleted_ids = {
+            result.get("id")
+            for result in add_response
+            if isinstance(result, dict) and result.get("event") == "DELETE"
+        }
+    memory_cache.set(
+        user_id,
+        replace(
+            entry,
+            memories={
+                memory_id: memory
+                for memory_id, memory in entry.memories.items()
+                if memory_id not in deleted_ids
+            },
+            stale=True,
+        ),
+    )
+
+
+# Sends a turn to mem0. Errors are logged and dropped unless `raise_errors` is set, for callers
+# that retry (like the post-turn job queue); then a missing client is an error too.
 async def call_add_memory(
-    truncated_messages, user_id: str, includes, custom_categories
+    truncated_messages,
+    user_id: str,
+    includes,
+    custom_categories,
+    raise_errors: bool = False,
 ):
     mem0 = await fetch_mem0()
 
-    if mem0 != None:
-        try:
-            await mem0.add(
-                messages=truncated_messages,
-                user_id=user_id,
-                includes=includes,
-                custom_categories=custom_categories,
-            )
-        except Exception as e:
-            # Log the exception this will send it to sentry, but we'll still process the response
-            # We do this because mem0 isn't always the most stable...
-            logger.error(e, exc_info=True)
+    if mem0 is None:
+        if raise_errors:
+            raise RuntimeError("mem0 isn't connected")
+        return
 
-    return
+    try:
+        response = await mem0.add(
+            messages=truncated_messages,
+            user_id=user_id,
+            includes=includes,
+            custom_categories=custom_categories,
+        )
+        invalidate_cached_memories(user_id, response)
+    except Exception as e:
+        if raise_errors:
+            raise
+        # Log the exception this will send it to sentry, but we'll still process the response
+        # We do this because mem0 isn't always the most stable...
+        logger.error(e, exc_info=True)
 
 
 async def fetch_all_memories(user_id: str):
+    entry = memory_cache.get(user_id)
+    now = time.monotonic()
+    if (
+        entry is not None
+        and not entry.stale
+        and now - entry.fetched_at < MEMORY_CACHE_TTL_SECONDS
+    ):
+        return list(entry.memories.values())
+
     mem0 = await fetch_mem0()
 
-    if mem0 != None:
-        return await mem0.get_all(
-            filters={"user_id": user_id},
-            version="v2",
-        )
+    if mem0 == None:
+        return list(entry.memories.values()) if entry is not None else []
+
+    synced_at = datetime.now(timezone.utc)
+    try:
+        if (
+            entry is None
+            or now - entry.fully_fetched_at >= MEMORY_CACHE_FULL_REFRESH_SECONDS
+        ):
+            memories = await mem0.get_all(
+                filters={"user_id": user_id},
+                version="v2",
+            )
+            entry = CachedMemories(
+                memories=_memories_by_id(memories),
+                synced_at=synced_at,
+                fetched_at=now,
+                fully_fetched_at=now,
+            )
+        else:
+            updated_since = entry.synced_at - MEMORY_CACHE_SYNC_OVERLAP
+            updated_memories = await mem0.get_all(
+                filters={
+                    "AND": [
+                        {"user_id": user_id},
+                        {"updated_at": {"gte": updated_since.isoformat()}},
+                    ]
+                },
+                version="v2",
+            )
+            entry = replace(
+                entry,
+                memories={**entry.memories, **_memories_by_id(updated_memories)},
+                synced_at=synced_at,
+                fetched_at=now,
+                stale=False,
+            )
+    except Exception as e:
+        if entry is None:
+            raise e
+        # Serve the cached memories rather than failing the turn
+        logger.error(e, exc_info=True)
+        return list(entry.memories.values())
 
-    return []
+    memory_cache.set(user_id, entry)
+    return list(entry.memories.values())
 
 
-async def call_search_memories(message_content: str, user_id: str):
+# The latency budget for memory retrieval in each turn. Memories are fetched before the reply
+# starts streaming, so a slow mem0 delays the first token. If a search hasn't returned after
+# `MEMORY_SEARCH_HEDGE_SECONDS`, a second identical search is sent and whichever returns first is
+# used. If neither returns within `MEMORY_RETRIEVAL_BUDGET_SECONDS`, the turn uses the user's last
+# results instead. Slow calls keep running on the background loop and update the cache when they
+# return, so the next turn benefits from them.
+MEMORY_RETRIEVAL_BUDGET_SECONDS = float(
+    os.environ.get("MEMORY_RETRIEVAL_BUDGET_SECONDS", 1.5)
+)
+MEMORY_SEARCH_HEDGE_SECONDS = float(os.environ.get("MEMORY_SEARCH_HEDGE_SECONDS", 0.75))
+
+# The number of memories returned by a search
+MEMORY_SEARCH_TOP_K = 25
+
+# The last search results for each user, used when a search misses the budget
+search_cache: LRUCache[str, List[Dict[str, Any]]] = LRUCache(MEMORY_CACHE_SIZE)
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Marks the exception of an attempt nobody waits for anymore as retrieved. The attempt already
+    # logged it.
+    if not future.cancelled():
+        future.exception()
+
+
+# Runs attempts on the background mem0 loop until one succeeds or the budget runs out. A second
+# attempt is started after `hedge_after` seconds if the first hasn't finished. Raises
+# `asyncio.TimeoutError` if no attempt succeeded within the budget, or the last attempt's exception
+# if they all failed.
+async def run_hedged(
+    start_attempt: Callable[[], Coroutine[Any, Any, T]],
+    budget: float,
+    hedge_after: Optional[float] = None,
+) -> T:
+    start_time = time.monotonic()
+    deadline = start_time + budget
+    hedge_time = start_time + hedge_after if hedge_after is not None else None
+    pending = {asyncio.wrap_future(mem0_loop.submit(start_attempt()))}
+    error: Optional[BaseException] = None
+
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_time = deadline if hedge_time is None else min(hedge_time, deadline)
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=wake_time - now,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+                error = attempt.exception()
+            if pending and hedge_time is not None and time.monotonic() >= hedge_time:
+                hedge_time = None
+                pending.add(asyncio.wrap_future(mem0_loop.submit(start_attempt())))
+    finally:
+        # Attempts that are still running aren't cancelled, so their results reach the cache
+        for attempt in pending:
+            attempt.add_done_callback(_retrieve_exception)
+
+    if error is not None and not pending:
+        raise error
+    raise asyncio.TimeoutError()
+
+
+async def _search_and_cache(message_content: str, user_id: str):
     mem0 = await fetch_mem0()
 
-    if mem0 != None:
-        return await mem0.search(
+    if mem0 == None:
+        return []
+
+    start_time = time.monotonic()
+    try:
+        memories = await mem0.search(
             query=message_content,
-            top_k=25,
+            top_k=MEMORY_SEARCH_TOP_K,
             rerank=True,
             filters={"user_id": user_id},
             version="v2",
         )
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        raise e
+    finally:
+        fetch_latency_histogram("mem0.search").observe(time.monotonic() - start_time)
+
+    search_cache.set(user_id, memories)
+    return memories
+
+
+# Search queries are answered from an in-process BM25 index over the user's cached memories when
+# the index is confident, which saves a remote `search` round trip on most turns. The index is
+# confident if the user has no more memories than a search returns (so every memory is returned,
+# ranked), or if the best match scores at least `LOCAL_MEMORY_SEARCH_MIN_SCORE`. Otherwise, or if
+# the user's cached memories are missing, stale or older than `MEMORY_CACHE_TTL_SECONDS`, mem0 is
+# searched. The threshold can be tuned with `server/scripts/compare_local_memory_search.py`.
+LOCAL_MEMORY_SEARCH_ENABLED = (
+    os.environ.get("LOCAL_MEMORY_SEARCH_ENABLED", "true").lower() == "true"
+)
+LOCAL_MEMORY_SEARCH_MIN_SCORE = float(
+    os.environ.get("LOCAL_MEMORY_SEARCH_MIN_SCORE", 4.0)
+)
+
+# Each user's index, with the memories it was built from. Cache entries replace their memories dict
+# whenever the memories change, so an index is current if it was built from the entry's dict.
+memory_index_cache: LRUCache[str, Tuple[Dict[str, Any], MemoryIndex]] = LRUCache(
+    MEMORY_CACHE_SIZE
+)
+_local_search_stats = {"local": 0, "remote": 0}
+
+
+def fetch_local_search_stats() -> Dict[str, Any]:
+    local = _local_search_stats["local"]
+    remote = _local_search_stats["remote"]
+    total = local + remote
+    return {
+        "local": local,
+        "remote": remote,
+        "local_ratio": local / total if total else 0.0,
+    }
+
+
+def fetch_memory_index(user_id: str) -> Optional[MemoryIndex]:
+    entry = memory_cache.get(user_id)
+    if (
+        entry is None
+        or entry.stale
+        or time.monotonic() - entry.fetched_at >= MEMORY_CACHE_TTL_SECONDS
+    ):
+        return None
 
-    return []
+    cached_index = memory_index_cache.get(user_id)
+    if cached_index is not None and cached_index[0] is entry.memories:
+        return cached_index[1]
+
+    index = MemoryIndex(list(entry.memories.values()))
+    memory_index_cache.set(user_id, (entry.memories, index))
+    return index
+
+
+# Returns the local search results in the format of mem0's `search`, with the BM25 score as the
+# score, or None if the index isn't confident
+def search_local_memories(
+    index: MemoryIndex,
+    message_content: str,
+    top_k: int = MEMORY_SEARCH_TOP_K,
+    min_score: float = LOCAL_MEMORY_SEARCH_MIN_SCORE,
+) -> Optional[List[Dict[str, Any]]]:
+    results = index.search(message_content, top_k=top_k)
+    if len(index) <= top_k:
+        # Every memory is returned, so nothing mem0 would return can be missed
+        matched = {id(memory) for memory, _ in results}
+        results += [
+            (memory, 0.0) for memory in index.memories if id(memory) not in matched
+        ]
+    elif not results or results[0][1] < min_score:
+        return None
+
+    return [{**memory, "score": score} for memory, score in results]
+
+
+async def call_search_memories(message_content: str, user_id: str):
+    start_time = time.monotonic()
+
+    index = fetch_memory_index(user_id) if LOCAL_MEMORY_SEARCH_ENABLED else None
+    if index is not None:
+        memories = search_local_memories(index, message_content)
+        fetch_latency_histogram("memory_search.local").observe(
+            time.monotonic() - start_time
+        )
+        if memories is not None:
+            _local_search_stats["local"] += 1
+            return memories
+    _local_search_stats["remote"] += 1
+
+    try:
+        return await run_hedged(
+            partial(_search_and_cache, message_content, user_id),
+            budget=MEMORY_RETRIEVAL_BUDGET_SECONDS,
+            hedge_after=MEMORY_SEARCH_HEDGE_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"mem0 search missed the {MEMORY_RETRIEVAL_BUDGET_SECONDS}s budget, using the last results"
+        )
+        return search_cache.get(user_id) or []
+    except Exception:
+        # The attempts already logged the error
+        return search_cache.get(user_id) or []
+    finally:
+        fetch_latency_histogram("memory_search").observe(time.monotonic() - start_time)
+
+
+async def _timed_fetch_all_memories(user_id: str):
+    start_time = time.monotonic()
+    try:
+        return await fetch_all_memories(user_id)
+    finally:
+        fetch_latency_histogram("mem0.get_all").observe(time.monotonic() - start_time)
+
+
+# `fetch_all_memories` under the memory retrieval budget. Fresh cache entries are returned without
+# a round trip. Otherwise, if mem0 misses the budget, the user's cached memories are used even if
+# they're stale.
+async def fetch_all_memories_within_budget(user_id: str):
+    entry = memory_cache.get(user_id)
+    if (
+        entry is not None
+        and not entry.stale
+        and time.monotonic() - entry.fetched_at < MEMORY_CACHE_TTL_SECONDS
+    ):
+        return list(entry.memories.values())
+
+    try:
+        return await run_hedged(
+            partial(_timed_fetch_all_memories, user_id),
+            budget=MEMORY_RETRIEVAL_BUDGET_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"mem0 get_all missed the {MEMORY_RETRIEVAL_BUDGET_SECONDS}s budget, using cached memories"
+        )
+        entry = memory_cache.get(user_id)
+        return list(entry.memories.values()) if entry is not None else []
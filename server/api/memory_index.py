@@ -0,0 +1,91 @@
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+# BM25 parameters. These are the usual defaults; memories are short, single-sentence facts, so
+# length normalization matters little.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+    a about after again all also am an and any are as at be because been before being but by can
+    could did do does doing don't for from had has have having he her here hers him his how i i'm
+    if in into is it it's its just me more most my no not now of on once only or other our out over
+    own really same she should so some such than that that's the their them then there these they
+    this those through to too under until up very was we were what when where which while who why
+    will with would you you're your yours user user's
+    """.split())
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+# Reduces plurals to their singular so "dogs" matches "dog". Anything smarter would need a stemmer
+# dependency, and memories and queries are short enough that this covers most misses.
+def _normalize_word(word: str) -> str:
+    word = word.strip("'")
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        term = _normalize_word(word)
+        if term and term not in STOPWORDS:
+            terms.append(term)
+    return terms
+
+
+# An in-memory BM25 index over one user's memories. Built from the memories returned by
+# `fetch_all_memories`, so search queries can usually be answered without a round trip to mem0.
+class MemoryIndex:
+    def __init__(self, memories: Sequence[Dict[str, Any]]):
+        self.memories = list(memories)
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for position, memory in enumerate(self.memories):
+            term_counts = Counter(tokenize(memory.get("memory") or ""))
+            self._lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self._postings.setdefault(term, []).append((position, count))
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        )
+
+    def __len__(self) -> int:
+        return len(self.memories)
+
+    def _idf(self, term: str) -> float:
+        num_matches = len(self._postings.get(term, ()))
+        return math.log(
+            1 + (len(self.memories) - num_matches + 0.5) / (num_matches + 0.5)
+        )
+
+    # Returns up to `top_k` (memory, score) pairs with a positive score, best first
+    def search(self, query: str, top_k: int) -> List[Tuple[Dict[str, Any], float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for position, count in postings:
+                length_norm = (
+                    1
+                    - BM25_B
+                    + BM25_B * (self._lengths[position] / self._average_length)
+                )
+                scores[position] = scores.get(position, 0.0) + idf * (
+                    count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self.memories[position], score) for position, score in ranked[:top_k]]
@@ -0,0 +1,133 @@
+import asyncio
+import concurrent.futures
+import difflib
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from server.api.cache import LRUCache
+from server.api.mem0 import MEMORY_CACHE_SIZE, call_search_memories, mem0_loop
+from server.api.memory_index import tokenize
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+# A prefetched search is reused for the final message if the message is at least this similar to
+# the text the prefetch was started with (by the words that matter for search, see `tokenize`)
+MEMORY_PREFETCH_MIN_SIMILARITY = float(
+    os.environ.get("MEMORY_PREFETCH_MIN_SIMILARITY", 0.8)
+)
+# Prefetches older than this are ignored, in case the user stopped typing or speaking
+MEMORY_PREFETCH_TTL_SECONDS = float(os.environ.get("MEMORY_PREFETCH_TTL_SECONDS", 30))
+
+
+# Splits the contents of a search query into its context and the message being written. The chat
+# API's history (see `build_chat_history`) ends with the new user message twice, so a copy of the
+# message at the end of the context is dropped. Otherwise the context would change with every
+# draft, and no prefetch would be reused unless the draft was already the final message.
+def split_query_contents(contents: List[str]) -> Tuple[List[str], str]:
+    context = contents[:-1]
+    if context and context[-1] == contents[-1]:
+        context = context[:-1]
+    return context, contents[-1]
+
+
+# A memory search started before the user finished their message. The search query is the content
+# of the last few messages (see `search_memories`). The earlier messages (the context) are already
+# known, so only the last one, the message being typed or spoken, can change.
+@dataclass
+class MemoryPrefetch:
+    context: List[str]
+    terms: List[str]
+    future: concurrent.futures.Future
+    started_at: float
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.started_at > MEMORY_PREFETCH_TTL_SECONDS
+
+    def matches(self, contents: List[str]) -> bool:
+        context, message = split_query_contents(contents)
+        if self.expired() or self.context != context:
+            return False
+        terms = tokenize(message)
+        if not self.terms and not terms:
+            return True
+        similarity = difflib.SequenceMatcher(None, self.terms, terms).ratio()
+        return similarity >= MEMORY_PREFETCH_MIN_SIMILARITY
+
+
+_prefetches: LRUCache[str, MemoryPrefetch] = LRUCache(MEMORY_CACHE_SIZE)
+_prefetch_stats = {"started": 0, "reused": 0, "missed": 0, "cancelled": 0}
+
+
+def fetch_prefetch_stats() -> Dict[str, Any]:
+    return dict(_prefetch_stats)
+
+
+def _cancel(prefetch: MemoryPrefetch) -> None:
+    if prefetch.future.cancel():
+        _prefetch_stats["cancelled"] += 1
+
+
+# Starts searching the user's memories for the query made of `contents`, the contents of the
+# messages in the search query with the message still being written last. Called on every
+# keystroke batch or interim transcript, so the running prefetch is kept if it still matches, and
+# replaced (and cancelled) otherwise.
+def start_prefetch(user_id: str, contents: List[str]) -> None:
+    if not contents:
+        return
+
+    prefetch = _prefetches.get(user_id)
+    if prefetch is not None:
+        if prefetch.matches(contents):
+            return
+        _cancel(prefetch)
+
+    context, message = split_query_contents(contents)
+    _prefetches.set(
+        user_id,
+        MemoryPrefetch(
+            context=context,
+            terms=tokenize(message),
+            future=mem0_loop.submit(
+                call_search_memories(
+                    message_content="\n".join(contents), user_id=user_id
+                )
+            ),
+            started_at=time.monotonic(),
+        ),
+    )
+    _prefetch_stats["started"] += 1
+
+
+# Returns the user's prefetched search if it's close enough to the final query. A prefetch is only
+# used for one turn; one that doesn't match is cancelled.
+def take_prefetch(
+    user_id: str, contents: List[str]
+) -> Optional[concurrent.futures.Future]:
+    prefetch = _prefetches.get(user_id)
+    if prefetch is None:
+        return None
+    _prefetches.delete(user_id)
+
+    if not prefetch.matches(contents):
+        _prefetch_stats["missed"] += 1
+        _cancel(prefetch)
+        return None
+
+    _prefetch_stats["reused"] += 1
+    return prefetch.future
+
+
+async def fetch_prefetched_memories(
+    user_id: str, contents: List[str]
+) -> Optional[List[Dict[str, Any]]]:
+    future = take_prefetch(user_id, contents)
+    if future is None or future.cancelled():
+        return None
+    try:
+        return await asyncio.wrap_future(future)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return None
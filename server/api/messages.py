@@ -0,0 +1,104 @@
+from itertools import chain, islice
+from typing import Iterator, List, Sequence, Tuple, Union, overload
+
+from openai.types.chat import ChatCompletionMessageParam
+
+
+# A read-only view over a chat history with system prompts overlaid at fixed positions. The chat
+# history can contain thousands of messages, so copying it (or deep-copying it) every time a system
+# prompt is inserted or the history is truncated adds a lot of allocations to every turn. Instead,
+# the view is stored as a list of (messages, start, stop) segments that reference the original
+# lists, and the final list of messages is only built once by `to_list`, right before it's sent to
+# OpenAI.
+#
+# The messages themselves are shared with the original list, so they must not be mutated.
+class MessageView(Sequence[ChatCompletionMessageParam]):
+    def __init__(
+        self,
+        messages: Union["MessageView", Sequence[ChatCompletionMessageParam]] = (),
+    ):
+        if isinstance(messages, MessageView):
+            self._segments = messages._segments
+            self._length = messages._length
+        else:
+            self._segments = [(messages, 0, len(messages))] if messages else []
+            self._length = len(messages)
+
+    @classmethod
+    def _from_segments(
+        cls,
+        segments: List[Tuple[Sequence[ChatCompletionMessageParam], int, int]],
+    ) -> "MessageView":
+        view = cls()
+        view._segments = [segment for segment in segments if segment[1] < segment[2]]
+        view._length = sum(stop - start for _, start, stop in view._segments)
+        return view
+
+    def __len__(self) -> int:
+        return self._length
+
+    @overload
+    def __getitem__(self, index: int) -> ChatCompletionMessageParam: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "MessageView": ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return MessageView(self.to_list()[index])
+            return self._window(start, stop)
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("MessageView index out of range")
+
+        for messages, start, stop in self._segments:
+            if index < stop - start:
+                return messages[start + index]
+            index -= stop - start
+
+    def __iter__(self) -> Iterator[ChatCompletionMessageParam]:
+        return chain.from_iterable(
+            islice(messages, start, stop) for messages, start, stop in self._segments
+        )
+
+    def __repr__(self) -> str:
+        return f"MessageView({self.to_list()!r})"
+
+    def _window(self, window_start: int, window_stop: int) -> "MessageView":
+        segments = []
+        offset = 0
+        for messages, start, stop in self._segments:
+            length = stop - start
+            # Clip the segment to the part that overlaps [window_start, window_stop)
+            clipped_start = max(window_start - offset, 0)
+            clipped_stop = min(window_stop - offset, length)
+            if clipped_start < clipped_stop:
+                segments.append((messages, start + clipped_start, start + clipped_stop))
+            offset += length
+            if offset >= window_stop:
+                break
+        return MessageView._from_segments(segments)
+
+    # Returns a new view with `message` inserted before `index`, like `list.insert`. The current
+    # view isn't modified.
+    def with_inserted(
+        self, index: int, message: ChatCompletionMessageParam
+    ) -> "MessageView":
+        if index < 0:
+            index = max(index + self._length, 0)
+        index = min(index, self._length)
+        return MessageView._from_segments(
+            self._window(0, index)._segments
+            + [([message], 0, 1)]
+            + self._window(index, self._length)._segments
+        )
+
+    def with_appended(self, message: ChatCompletionMessageParam) -> "MessageView":
+        return MessageView._from_segments(self._segments + [([message], 0, 1)])
+
+    def to_list(self) -> List[ChatCompletionMessageParam]:
+        return list(self)
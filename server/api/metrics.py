@@ -0,0 +1,69 @@
+import bisect
+import threading
+from typing import Dict, List, Sequence
+
+# Upper bounds of the latency buckets, in seconds. The last bucket holds everything slower.
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+
+
+# A cumulative latency histogram with fixed buckets, like a Prometheus histogram, so latency
+# budgets can be tuned from the distribution instead of the mean
+class LatencyHistogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._sum += seconds
+
+    # Estimates the quantile as the upper bound of the bucket it falls in
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            rank = q * self._count
+            seen = 0
+            for upper_bound, count in zip(self.buckets, self._counts):
+                seen += count
+                if seen >= rank and seen > 0:
+                    return upper_bound
+            return float("inf") if self._count else 0.0
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            cumulative: List[int] = []
+            total = 0
+            for count in self._counts:
+                total += count
+                cumulative.append(total)
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "buckets": {
+                    **dict(zip(self.buckets, cumulative)),
+                    float("inf"): cumulative[-1],
+                },
+            }
+
+
+_latency_histograms: Dict[str, LatencyHistogram] = {}
+_latency_histograms_lock = threading.Lock()
+
+
+def fetch_latency_histogram(name: str) -> LatencyHistogram:
+    with _latency_histograms_lock:
+        histogram = _latency_histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            _latency_histograms[name] = histogram
+        return histogram
+
+
+def fetch_latency_stats() -> Dict[str, Dict[str, object]]:
+    with _latency_histograms_lock:
+        histograms = dict(_latency_histograms)
+    return {name: histogram.snapshot() for name, histogram in histograms.items()}
@@ -0,0 +1,55 @@
+import uuid
+from typing import AsyncIterator, Dict, Optional, Sequence, Tuple, Union
+
+MULTIPART_MIXED = "multipart/mixed"
+
+# A part of a multipart body: its headers, and its content, either whole or as a stream of chunks
+Part = Tuple[Dict[str, str], Union[bytes, AsyncIterator[bytes]]]
+
+
+# Whether an `Accept` header lists `media_type` (or its `type/*` range) with a non-zero quality.
+# `*/*` doesn't count, so clients that accept anything (the default of most HTTP clients) keep
+# getting the response they always got.
+def accepts_media_type(accept: Optional[str], media_type: str) -> bool:
+    if not accept:
+        return False
+    main_type = media_type.split("/")[0]
+    for media_range in accept.split(","):
+        name, *parameters = [value.strip() for value in media_range.split(";")]
+        if name.lower() not in (media_type, f"{main_type}/*"):
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return True
+    return False
+
+
+def new_boundary() -> str:
+    return uuid.uuid4().hex
+
+
+# Streams a multipart body (RFC 2046). The content chunks are yielded as they are, without being
+# copied into a larger buffer, so a part can be streamed as it's produced. If a stream raises, the
+# body ends without its closing boundary, so clients can tell it was cut short.
+async def stream_multipart(
+    parts: Sequence[Part], boundary: str
+) -> AsyncIterator[bytes]:
+    for headers, content in parts:
+        header_lines = "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        yield f"--{boundary}\r\n{header_lines}\r\n".encode("utf-8")
+        if isinstance(content, bytes):
+            yield content
+        else:
+            async for chunk in content:
+                yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
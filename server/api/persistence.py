@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Optional, Sequence
+
+from prisma import Prisma
+
+from server.api.chat_turns import (
+    SAVE_CHAT_TURNS_BATCH_SIZE,
+    ChatTurn,
+    build_save_chat_turns_query,
+)
+from server.api.constants import LLM
+from server.api.tokenizers import fetch_encoding
+
+
+# Saves turns of chats: their messages, and the last message time of each chat. A batch of up to
+# `SAVE_CHAT_TURNS_BATCH_SIZE` turns is written with one statement, so voice sessions and backfills
+# can save many turns in one round trip. The API server and the LiveKit worker both call this
+# directly with their process's Prisma client (see `fetch_prisma`), instead of going through
+# `/api/updateChat`.
+async def save_chat_turns(prisma: Prisma, turns: Sequence[ChatTurn]) -> None:
+    encoding = fetch_encoding(LLM)
+    for start in range(0, len(turns), SAVE_CHAT_TURNS_BATCH_SIZE):
+        query, parameters = build_save_chat_turns_query(
+            turns[start : start + SAVE_CHAT_TURNS_BATCH_SIZE], encoding
+        )
+        await prisma.execute_raw(query, *parameters)
+
+
+async def save_chat_turn(
+    prisma: Prisma,
+    chat_id: str,
+    new_user_message: str,
+    new_agent_message: str,
+    user_message_timestamp: datetime,
+    agent_message_timestamp: datetime,
+    audio_messages_enabled: bool,
+    audio_id: Optional[str] = None,
+) -> None:
+    await save_chat_turns(
+        prisma,
+        [
+            ChatTurn(
+                chat_id=chat_id,
+                user_message=new_user_message,
+                agent_message=new_agent_message,
+                user_message_timestamp=user_message_timestamp,
+                agent_message_timestamp=agent_message_timestamp,
+                audio_messages_enabled=audio_messages_enabled,
+                audio_id=audio_id,
+            )
+        ],
+    )
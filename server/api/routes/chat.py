@@ -1,21 +1,35 @@
-import base64
 import os
-import threading
 import uuid
-import json
 import asyncio
-from typing import Any, List, Optional
-from elevenlabs import ElevenLabs, VoiceSettings
-import httpx
+from typing import Any, AsyncIterator, Dict, List, Optional
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse, StreamingResponse, Response
-from openai import AsyncStream, OpenAI
 from openai.types.chat import ChatCompletionChunk
-from fastapi import APIRouter, Depends, HTTPException
-from server.api.supabase import fetch_supabase
-from server.api.constants import SUPABASE_AUDIO_MESSAGES_BUCKET_NAME, LLM
-from server.api.utils import add_memories, authorize_user, get_stream_content
-from prisma import Prisma, enums, types
+from fastapi import APIRouter, Depends, Header, HTTPException
+from server.api.audio_files import audio_file_response, audio_owners
+from server.api.audio import start_background_task
+from server.api.audio_messages import audio_message_response, start_audio_message
+from server.api.database import fetch_prisma, get_prisma
+from server.api.llm import fetch_openai
+from server.api.chat_turns import ChatTurn
+from server.api.client_messages import (
+    ClientMessage,
+    build_chat_history,
+    message_to_fixed_string_content,
+)
+from server.api.jobs import JobQueue
+from server.api.persistence import save_chat_turn, save_chat_turns
+from server.api.constants import LLM
+from server.api.tokenizers import fetch_encoding
+from server.api.utils import (
+    add_memory_windows,
+    authorize_user,
+    TurnContext,
+    iterate_stream_content,
+    prefetch_memories,
+    seed_message_token_count,
+)
+from prisma import Prisma
 from datetime import datetime
 from server.api.analytics import track_sent_message
 from server.agent.index import generate_response
@@ -25,26 +39,6 @@ from server.livekit_worker.voices import VoiceSettingMapping
 logger = fetch_logger()
 
 
-class ClientAttachment(BaseModel):
-    name: str
-    contentType: str
-    url: str
-
-
-class ToolInvocation(BaseModel):
-    toolCallId: str
-    toolName: str
-    args: dict
-    result: dict
-
-
-class ClientMessage(BaseModel):
-    id: str
-    role: str
-    content: str
-    created: str
-
-
 class Request(BaseModel):
     messages: List[ClientMessage]
     chat_id: str
@@ -52,75 +46,85 @@ class Request(BaseModel):
     # Audio messages are disabled by default to be backwards compatible with clients that don't
     # specify the field
     audio_messages_enabled: Optional[bool] = False
+    # Clients that set this (or that accept `multipart/mixed`) get audio messages as a stream (see
+    # `stream_audio_message_parts`) instead of a JSON body with the whole audio base64 encoded
+    audio_streaming_enabled: Optional[bool] = False
 
 
 router = APIRouter()
 
+# How long a user's turns are collected before they're sent to mem0 in one `add` call
+MEMORY_WRITE_COALESCE_SECONDS = float(
+    os.environ.get("MEMORY_WRITE_COALESCE_SECONDS", 5)
+)
+
+
+# The work done after a reply is sent runs on a durable job queue, so it's bounded, retried when it
+# fails, and picked up again after a restart. Each step is its own job, so a failed step is retried
+# without repeating the others.
+async def run_save_chat_turn_job(payload: Dict[str, Any]) -> None:
+    # Saved in-process instead of through `/api/updateChat`, which is served by this same service.
+    # The message IDs are chosen when the job is enqueued, so a retry doesn't save the turn twice.
+    await save_chat_turns(
+        await fetch_prisma(),
+        [
+            ChatTurn(
+                chat_id=payload["chat_id"],
+                user_message=payload["user_message"],
+                agent_message=payload["agent_message"],
+                user_message_timestamp=datetime.fromtimestamp(
+                    payload["user_message_timestamp"]
+                ),
+                agent_message_timestamp=datetime.fromtimestamp(
+                    payload["agent_message_timestamp"]
+                ),
+                audio_messages_enabled=payload["audio_messages_enabled"],
+                audio_id=payload["audio_id"],
+                user_message_id=payload["user_message_id"],
+                agent_message_id=payload["agent_message_id"],
+            )
+        ],
+    )
 
-def convert_to_openai_messages(
-    messages: List[Any],
-) -> List[dict]:
-    openai_messages = []
-
-    for message in messages:
-        parts = []
-
-        parts.append({"type": "text", "text": message.content})
-
-        openai_messages.append({"role": message.role, "content": parts})
 
-    return openai_messages
+# A user's turns are added to mem0 in batches (the jobs' batch key is the user ID), so a fast
+# back-and-forth conversation sends mem0 one call for several turns instead of one per turn with
+# mostly the same messages. The jobs are only deleted once mem0 has their turns, and mem0 errors are
+# retried.
+async def run_add_memories_jobs(payloads: List[Dict[str, Any]]) -> None:
+    # Each payload only has the recent messages that are sent to mem0, see
+    # `TurnContext.memory_window`
+    await add_memory_windows(
+        [
+            TurnContext(payload["messages"], model=LLM).memory_window(
+                payload["agent_response"]
+            )
+            for payload in payloads
+        ],
+        user_id=payloads[0]["user_id"],
+    )
 
 
-# Converts an openai message (which may have a content that is a list of parts) to a message with a fixed string content
-def message_to_fixed_string_content(message: dict) -> dict:
-    if isinstance(message["content"], str):
-        return message
-    else:
-        return {
-            "role": message["role"],
-            "content": "".join([part["text"] for part in message["content"]]),
-        }
+async def run_track_sent_message_job(payload: Dict[str, Any]) -> None:
+    await track_sent_message(
+        user_id=payload["user_id"],
+        chat_id=payload["chat_id"],
+        chat_type=payload["chat_type"],
+    )
 
 
-async def call_update_chat(
-    messages: List[dict],
-    agent_response: str,
-    user_message_timestamp: datetime,
-    agent_message_timestamp: datetime,
-    chat_id: str,
-    audio_messages_enabled: bool,
-    audio_id: Optional[str],
-):
-    new_user_message = next(msg for msg in reversed(messages) if msg["role"] == "user")
-    new_user_message = message_to_fixed_string_content(new_user_message)["content"]
-
-    data = {
-        "new_user_message": new_user_message,
-        "new_agent_message": agent_response,
-        "user_message_timestamp": user_message_timestamp.timestamp(),
-        "agent_message_timestamp": agent_message_timestamp.timestamp(),
-        "chat_id": chat_id,
-        "audio_messages_enabled": audio_messages_enabled,
-        "audio_id": audio_id,
-    }
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {os.environ.get('CRON_SECRET')}",
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"https://{os.environ.get('EXPO_PUBLIC_API_URL')}/api/updateChat",
-            json=data,
-            headers=headers,
-        )
-        response.raise_for_status()
+post_turn_jobs = JobQueue(
+    name="post_turn_jobs",
+    handlers={
+        "save_chat_turn": run_save_chat_turn_job,
+        "track_sent_message": run_track_sent_message_job,
+    },
+    batch_handlers={"add_memories": run_add_memories_jobs},
+)
 
 
-def stream_and_update_chat(
-    messages: List[dict],
+async def stream_and_update_chat(
+    turn: TurnContext,
     chat_id: str,
     user_id: str,
     chat_type: str,
@@ -131,11 +135,8 @@ def stream_and_update_chat(
     audio_messages_enabled: bool,
     audio_id: Optional[str] = None,
     skip_final_processing: Optional[bool] = False,
-):
+) -> AsyncIterator[ChatCompletionChunk]:
     user_message_timestamp = datetime.now()
-    client = OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY"),
-    )
 
     ai_first_name = ai_first_name.strip()
     user_first_name = user_first_name.strip()
@@ -148,59 +149,45 @@ def stream_and_update_chat(
     # https://sdk.vercel.ai/docs/ai-sdk-ui/stream-protocol#data-stream-protocol
     # Here is an example of implementing it:
     # https://github.com/vercel/ai/blob/main/examples/next-fastapi/api/index.py#L72
-    stream = None
-    agent_response = ""
-    stream = asyncio.run(
-        generate_response(
-            llm=client,
-            messages=messages,
-            user_id=user_id,
-            timezone=timezone,
-            ai_first_name=ai_first_name,
-            user_first_name=user_first_name,
-            user_gender=user_gender,
-        )
+    #
+    # The whole pipeline runs on the caller's event loop, so a stream doesn't hold a thread from
+    # Starlette's threadpool while it waits on the LLM, and concurrent streams aren't capped by its
+    # size.
+    stream = await generate_response(
+        llm=fetch_openai(),
+        turn=turn,
+        user_id=user_id,
+        timezone=timezone,
+        ai_first_name=ai_first_name,
+        user_first_name=user_first_name,
+        user_gender=user_gender,
     )
 
-    if stream is not None:
-        agent_response = ""
-        for chunk in stream:
-            yield chunk
-            for choice in chunk.choices:
-                if choice.finish_reason != "stop":
-                    content = choice.delta.content
-                    agent_response += content
-
-    # Run asynchronous operations in a separate thread, which is necessary to prevent the main
-    # thread from getting blocked during synchronous tasks with high latency, like network requests.
-    # This is important when streaming voice responses because the voice will pause in the middle of
-    # its response if a synchronous task is running. The voice can pause midway in the following
-    # scenario:
-    # 1. The conversational LLM's response finishes streaming very quickly, causing the stream
-    #    processing logic to also finish quickly. (I.e. all of the chunks are yielded).
-    # 2. While the voice is speaking, synchronous tasks such as analytics calls execute, causing the
-    #    voice response to halt until the synchronous task ends.
+    agent_response = ""
+    async for chunk in stream:
+        yield chunk
+        for choice in chunk.choices:
+            if choice.finish_reason != "stop":
+                content = choice.delta.content
+                agent_response += content
+
+    # Final processing runs on the job queue, so the stream ends without waiting for it, and it can't
+    # pause a voice response that's still being spoken.
     if not skip_final_processing:
-        thread = threading.Thread(
-            target=lambda: asyncio.run(
-                final_processing_coroutine(
-                    messages=messages,
-                    agent_response=agent_response,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    chat_type=chat_type,
-                    user_message_timestamp=user_message_timestamp,
-                    audio_messages_enabled=audio_messages_enabled,
-                    audio_id=audio_id,
-                )
-            ),
-            daemon=True,
+        enqueue_final_processing(
+            turn=turn,
+            agent_response=agent_response,
+            chat_id=chat_id,
+            user_id=user_id,
+            chat_type=chat_type,
+            user_message_timestamp=user_message_timestamp,
+            audio_messages_enabled=audio_messages_enabled,
+            audio_id=audio_id,
         )
-        thread.start()
 
 
-async def final_processing_coroutine(
-    messages: List[dict],
+def enqueue_final_processing(
+    turn: TurnContext,
     agent_response: str,
     chat_id: str,
     user_id: str,
@@ -210,32 +197,47 @@ async def final_processing_coroutine(
     audio_id: Optional[str],
 ) -> None:
     agent_message_timestamp = datetime.now()
-
-    await call_update_chat(
-        messages=messages,
-        agent_response=agent_response,
-        chat_id=chat_id,
-        user_message_timestamp=user_message_timestamp,
-        agent_message_timestamp=agent_message_timestamp,
-        audio_messages_enabled=audio_messages_enabled,
-        audio_id=audio_id,
+    new_user_message = next(
+        message for message in reversed(turn.messages) if message["role"] == "user"
     )
 
-    await add_memories(
-        messages=messages + [{"role": "assistant", "content": agent_response}],
-        user_id=user_id,
-        model=LLM,
+    post_turn_jobs.enqueue(
+        "save_chat_turn",
+        {
+            "chat_id": chat_id,
+            "user_message": message_to_fixed_string_content(new_user_message)[
+                "content"
+            ],
+            "agent_message": agent_response,
+            "user_message_timestamp": user_message_timestamp.timestamp(),
+            "agent_message_timestamp": agent_message_timestamp.timestamp(),
+            "audio_messages_enabled": audio_messages_enabled,
+            "audio_id": audio_id,
+            "user_message_id": str(uuid.uuid4()),
+            "agent_message_id": str(uuid.uuid4()),
+        },
     )
-
-    await track_sent_message(
-        user_id=user_id,
-        chat_id=chat_id,
-        chat_type=chat_type,
+    post_turn_jobs.enqueue(
+        "add_memories",
+        {
+            # The window without the agent's response, which `add_memories` appends again
+            "messages": [
+                dict(message) for message in turn.memory_window(agent_response)[:-1]
+            ],
+            "agent_response": agent_response,
+            "user_id": user_id,
+        },
+        batch_key=user_id,
+        delay_seconds=MEMORY_WRITE_COALESCE_SECONDS,
+    )
+    post_turn_jobs.enqueue(
+        "track_sent_message",
+        {"user_id": user_id, "chat_id": chat_id, "chat_type": chat_type},
     )
 
 
-def stream_text(
-    messages: List[dict],
+async def stream_text(
+    turn: TurnContext,
     chat_id: str,
     user_id: str,
     timezone: str,
@@ -246,7 +248,7 @@ def stream_text(
     audio_id: Optional[str],
 ):
     stream = stream_and_update_chat(
-        messages=messages,
+        turn=turn,
         chat_id=chat_id,
         user_id=user_id,
         chat_type="text",
@@ -257,7 +259,7 @@ def stream_text(
         audio_messages_enabled=audio_messages_enabled,
         audio_id=audio_id,
     )
-    for chunk in stream:
+    async for chunk in stream:
         for choice in chunk.choices:
             if choice.finish_reason == "stop":
                 break
@@ -267,16 +269,17 @@ def stream_text(
 
 
 @router.post("/api/chat")
-async def handle_chat_data(request: Request, user=Depends(authorize_user)):
-    new_user_message = request.messages[-1]
+async def handle_chat_data(
+    request: Request,
+    user=Depends(authorize_user),
+    prisma: Prisma = Depends(get_prisma),
+    accept: Optional[str] = Header(None),
+):
     user_id = user["sub"]
     chat_id = request.chat_id
     timezone = request.timezone
     audio_messages_enabled = request.audio_messages_enabled
 
-    prisma = Prisma()
-    await prisma.connect()
-
     chat, settings = await asyncio.gather(
         prisma.chats.find_unique(
             where={"id": chat_id},
@@ -288,63 +291,62 @@ async def handle_chat_data(request: Request, user=Depends(authorize_user)):
     )
 
     if chat.userId != user_id:
-        await prisma.disconnect()
         raise HTTPException(status_code=403, detail="Unauthorized")
 
     if chat is None:
-        await prisma.disconnect()
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    openai_messages = convert_to_openai_messages(
-        request.messages
-    ) + convert_to_openai_messages([new_user_message])
+    # Use the token counts that were stored when the messages were written so that truncating the
+    # chat history doesn't need to re-encode it.
+    encoding = fetch_encoding(LLM)
+    for message in chat.messages or []:
+        seed_message_token_count(
+            role=message.role,
+            content=message.content,
+            token_count=message.tokenCount,
+            token_encoding=message.tokenEncoding,
+            encoding=encoding,
+        )
 
     ai_first_name = settings.agentName
     user_first_name = settings.name
     user_gender = settings.gender
 
-    # The generate_response_intake_session doesn't handle the case where the content is a list of parts, so we need to
-    # convert the messages to a fixed string content format for now. We should probably update the function to handle this
-    # case nativly.
-    chat_history = [
-        message_to_fixed_string_content(element) for element in openai_messages
-    ]
+    # Built once per request, so the chat history is normalized and counted once per turn
+    turn = TurnContext(build_chat_history(request.messages), model=LLM)
     audio_id = str(uuid.uuid4()) if audio_messages_enabled else None
 
     response = None
     if audio_messages_enabled:
         user_message_timestamp = datetime.now()
 
-        # Define a synchronous function to run in a separate thread. Necessary because
-        # `stream_and_update_chat` contains an `asyncio.run` call, which causes an error if executed
-        # in the current thread.
-        def sync_function():
-            stream = stream_and_update_chat(
-                messages=chat_history,
-                chat_id=chat_id,
-                user_id=user_id,
-                chat_type="text",
-                timezone=timezone,
-                ai_first_name=ai_first_name,
-                user_first_name=user_first_name,
-                user_gender=user_gender,
-                audio_messages_enabled=audio_messages_enabled,
-                audio_id=audio_id,
-                skip_final_processing=True,
-            )
-            agent_response_text = get_stream_content(stream)
-            return agent_response_text
-
-        # Run the synchronous function in a separate thread
-        agent_response = await asyncio.to_thread(sync_function)
-
-        # Run the final processing logic outside of `stream_and_update_chat` because including it in
-        # `sync_function` will cause `final_processing_coroutine` to fully execute before we can
-        # continue with this logic, which adds significant latency to this call.
-        asyncio.create_task(
-            final_processing_coroutine(
-                messages=chat_history,
-                agent_response=agent_response,
+        speech, upload, reply_done = start_audio_message(
+            iterate_stream_content(
+                stream_and_update_chat(
+                    turn=turn,
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    chat_type="text",
+                    timezone=timezone,
+                    ai_first_name=ai_first_name,
+                    user_first_name=user_first_name,
+                    user_gender=user_gender,
+                    audio_messages_enabled=audio_messages_enabled,
+                    audio_id=audio_id,
+                    skip_final_processing=True,
+                )
+            ),
+            audio_id,
+            VoiceSettingMapping[settings.voice],
+        )
+
+        # Run the final processing logic outside of `stream_and_update_chat` so it runs while the
+        # audio is generated instead of delaying the response. It's enqueued once the whole reply
+        # is written, whether or not the client is still reading the response.
+        async def enqueue_final_processing_when_done():
+            enqueue_final_processing(
+                turn=turn,
+                agent_response=await reply_done,
                 chat_id=chat_id,
                 user_id=user_id,
                 chat_type="type",
@@ -352,49 +354,21 @@ async def handle_chat_data(request: Request, user=Depends(authorize_user)):
                 audio_messages_enabled=audio_messages_enabled,
                 audio_id=audio_id,
             )
-        )
 
-        voice_settings = VoiceSettingMapping[settings.voice]
-
-        elevenlabs = ElevenLabs(api_key=os.environ.get("ELEVEN_LABS_API_KEY"))
-        audio = elevenlabs.generate(
-            text=agent_response,
-            model=voice_settings.model,
-            voice=voice_settings.voice_id,
-            voice_settings=VoiceSettings(
-                stability=voice_settings.stability,
-                similarity_boost=voice_settings.similarity,
-                style=voice_settings.style,
-                use_speaker_boost=voice_settings.speaker_boost,
-            ),
-        )
-        file_name = f"{audio_id}.mp3"
-        audio_bytes = b"".join(audio)
-
-        supabase = fetch_supabase()
-        response = supabase.storage.from_(SUPABASE_AUDIO_MESSAGES_BUCKET_NAME).upload(
-            file=audio_bytes,
-            path=file_name,
-            file_options={"content-type": "audio/mpeg"},
-        )
-        if response.is_error:
-            raise HTTPException(
-                status_code=405, detail=f"Audio upload failed: {response.content}"
-            )
-
-        audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+        start_background_task(enqueue_final_processing_when_done())
 
-        # Create JSON response
-        response_data = {
-            "text": agent_response,
-            "audioId": audio_id,
-            "audioBase64": audio_base64,
-        }
-        response = JSONResponse(content=response_data)
+        response = await audio_message_response(
+            audio_id,
+            speech,
+            upload,
+            reply_done,
+            accept=accept,
+            streaming_enabled=request.audio_streaming_enabled,
+        )
     else:
         response = StreamingResponse(
             stream_text(
-                chat_history,
+                turn,
                 chat_id,
                 user_id,
                 timezone,
@@ -407,11 +381,30 @@ async def handle_chat_data(request: Request, user=Depends(authorize_user)):
             media_type="text/event-stream",
         )
 
-    await prisma.disconnect()
-
     return response
 
 
+class TypingRequest(BaseModel):
+    # The chat's messages, ending with the message the user is typing
+    messages: List[ClientMessage]
+
+
+# Called by clients while the user is typing, so the memory search for the message can start
+# before it's sent. Optional: clients that don't call it get a normal search when they send the
+# message.
+@router.post("/api/chat/typing")
+async def handle_typing(request: TypingRequest, user=Depends(authorize_user)):
+    if not request.messages or request.messages[-1].role != "user":
+        raise HTTPException(
+            status_code=400, detail="The last message must be a user message"
+        )
+
+    prefetch_memories(
+        messages=build_chat_history(request.messages), user_id=user["sub"], model=LLM
+    )
+    return Response(status_code=202)
+
+
 class UpdateChatRequest(BaseModel):
     new_user_message: str
     user_message_timestamp: float
@@ -423,75 +416,46 @@ class UpdateChatRequest(BaseModel):
 
 
 @router.post("/api/updateChat")
-async def handle_update_chat(request: UpdateChatRequest):
-    prisma = Prisma()
-    await prisma.connect()
-
-    async with prisma.tx():
-        new_user_message = request.new_user_message
-        agent_response = request.new_agent_message
-        chat_id = request.chat_id
-        audio_id = request.audio_id
-        audio_messages_enabled = request.audio_messages_enabled
-
-        # Create new user chat message
-        await prisma.chatmessages.create(
-            data=types.ChatMessagesCreateInput(
-                chatId=chat_id,
-                role=enums.OpenAIRole.user,
-                content=new_user_message,
-                created=datetime.fromtimestamp(request.user_message_timestamp),
-                displayType="text",
-            )
-        )
-
-        display_type = "audio" if audio_messages_enabled else "text"
-
-        await prisma.chatmessages.create(
-            data=types.ChatMessagesCreateInput(
-                chatId=chat_id,
-                role=enums.OpenAIRole.assistant,
-                content=agent_response,
-                created=datetime.fromtimestamp(request.agent_message_timestamp),
-                displayType=display_type,
-                audioId=audio_id,
-            )
-        )
-
-        await prisma.chats.update(
-            where={"id": chat_id},
-            data=types.ChatsUpdateInput(lastMessageTime=datetime.now()),
-        )
-
-    await prisma.disconnect()
+async def handle_update_chat(
+    request: UpdateChatRequest, prisma: Prisma = Depends(get_prisma)
+):
+    # Kept for compatibility with callers that still save turns over HTTP
+    await save_chat_turn(
+        prisma,
+        chat_id=request.chat_id,
+        new_user_message=request.new_user_message,
+        new_agent_message=request.new_agent_message,
+        user_message_timestamp=datetime.fromtimestamp(request.user_message_timestamp),
+        agent_message_timestamp=datetime.fromtimestamp(request.agent_message_timestamp),
+        audio_messages_enabled=request.audio_messages_enabled,
+        audio_id=request.audio_id,
+    )
 
 
 @router.get("/api/fetchAudio")
-async def fetch_audio(audioId: str, user=Depends(authorize_user)):
+async def fetch_audio(
+    audioId: str,
+    user=Depends(authorize_user),
+    prisma: Prisma = Depends(get_prisma),
+    if_none_match: Optional[str] = Header(None),
+):
     user_id = user["sub"]
-    prisma = Prisma()
-    await prisma.connect()
 
-    # Find the chat message with the given audioId and ensure it belongs to the authorized user
-    message = await prisma.chatmessages.find_first(
-        where={"audioId": audioId, "chat": {"is": {"userId": user_id}}}
-    )
-
-    if not message:
-        await prisma.disconnect()
-        raise HTTPException(status_code=404, detail="Audio not found or unauthorized")
-
-    await prisma.disconnect()
+    # Find the chat message with the given audioId and ensure it belongs to the authorized user. A
+    # message never changes owner, so replays are allowed without asking the database again.
+    if not audio_owners.get((user_id, audioId)):
+        message = await prisma.chatmessages.find_first(
+            where={"audioId": audioId, "chat": {"is": {"userId": user_id}}}
+        )
 
-    audio_path = f"{audioId}.mp3"
+        if not message:
+            raise HTTPException(
+                status_code=404, detail="Audio not found or unauthorized"
+            )
 
-    supabase = fetch_supabase()
-    audio = supabase.storage.from_(SUPABASE_AUDIO_MESSAGES_BUCKET_NAME).download(
-        audio_path
-    )
+        audio_owners.set((user_id, audioId), True)
 
-    # Return the audio as a streaming response
-    return Response(content=audio, media_type="audio/mpeg")
+    return await audio_file_response(audioId, if_none_match)
 
 
 @router.get("/api/health")
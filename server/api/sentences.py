@@ -0,0 +1,62 @@
+import os
+import re
+from typing import AsyncIterator, List
+
+# Sentences shorter than this are joined with the next one, so a reply that starts with "Hi!" doesn't
+# spend a synthesis call on one word
+MIN_SENTENCE_CHARACTERS = int(os.environ.get("MIN_SENTENCE_CHARACTERS", 20))
+
+# The end of a sentence: closing punctuation (and any closing quotes or brackets) followed by
+# whitespace, or a line break. The whitespace is required so "3.5" and a "." at the end of the text
+# received so far aren't taken as the end of a sentence.
+SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\n+")
+# Words whose trailing "." doesn't end a sentence
+ABBREVIATIONS = frozenset(
+    ["mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e", "jr", "sr"]
+)
+
+
+def ends_with_abbreviation(text: str) -> bool:
+    words = text.rstrip().rstrip(".").rsplit(None, 1)
+    return bool(words) and words[-1].lower() in ABBREVIATIONS
+
+
+# Splits text that arrives in pieces (like the deltas of an LLM stream) into sentences as soon as
+# each one is complete
+class SentenceSegmenter:
+    def __init__(self, min_characters: int = MIN_SENTENCE_CHARACTERS):
+        self.min_characters = min_characters
+        self._buffer = ""
+
+    # Adds text and returns the sentences it completed
+    def push(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start : match.end()].strip()
+            if len(sentence) < self.min_characters or ends_with_abbreviation(
+                self._buffer[start : match.start() + 1]
+            ):
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    # Returns the rest of the text, once there's no more
+    def flush(self) -> List[str]:
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+async def segment_sentences(
+    text: AsyncIterator[str], min_characters: int = MIN_SENTENCE_CHARACTERS
+) -> AsyncIterator[str]:
+    segmenter = SentenceSegmenter(min_characters)
+    async for piece in text:
+        for sentence in segmenter.push(piece):
+            yield sentence
+    for sentence in segmenter.flush():
+        yield sentence
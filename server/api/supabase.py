@@ -1,8 +1,12 @@
+import asyncio
 import os
-from typing import Union
+import weakref
+from typing import AsyncIterator, Union
 import cuid
+import httpx
 from datetime import datetime
 from supabase import create_client, Client
+from server.api.constants import SUPABASE_AUDIO_MESSAGES_BUCKET_NAME
 
 supabase: Union[Client, None] = None
 
@@ -38,3 +42,62 @@ def fetch_settings(user_id: str):
     fetch_supabase()
 
     return supabase.table("settings").select("*").eq("id", user_id).execute()
+
+
+# One HTTP client per event loop for the storage API, for the same reason as `fetch_openai`
+_storage_clients: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+) = weakref.WeakKeyDictionary()
+
+
+def fetch_storage_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _storage_clients.get(loop)
+    if client is None:
+        key = os.environ.get("SUPABASE_SECRET_KEY")
+        client = httpx.AsyncClient(
+            base_url=f"{os.environ.get('EXPO_PUBLIC_SUPABASE_URL')}/storage/v1",
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+        )
+        _storage_clients[loop] = client
+    return client
+
+
+async def close_storage_client() -> None:
+    client = _storage_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+# Uploads an audio message to storage while its chunks are still being produced. The Supabase
+# client's `upload` needs the whole file, so this sends the chunks as the request body of the
+# storage API's upload endpoint instead.
+async def upload_audio_stream(path: str, chunks: AsyncIterator[bytes]) -> None:
+    response = await fetch_storage_client().post(
+        f"/object/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{path}",
+        content=chunks,
+        headers={"Content-Type": "audio/mpeg"},
+    )
+    response.raise_for_status()
+
+
+# Downloads an audio message from storage without blocking the event loop, unlike the Supabase
+# client's `download`
+async def download_audio(path: str) -> bytes:
+    response = await fetch_storage_client().get(
+        f"/object/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{path}"
+    )
+    response.raise_for_status()
+    return response.content
+
+
+# Creates a URL that anyone can download an audio message from for the next `expires_in` seconds
+async def create_signed_audio_url(path: str, expires_in: int) -> str:
+    response = await fetch_storage_client().post(
+        f"/object/sign/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{path}",
+        json={"expiresIn": expires_in},
+    )
+    response.raise_for_status()
+    # The signed URL is relative to the storage API
+    signed_path = response.json()["signedURL"]
+    return f"{os.environ.get('EXPO_PUBLIC_SUPABASE_URL')}/storage/v1{signed_path}"
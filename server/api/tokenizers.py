@@ -0,0 +1,65 @@
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import tiktoken
+
+from server.api.constants import LLM, TOKEN_ENCODINGS
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+# Below this many texts, encoding them one at a time is faster than `encode_ordinary_batch`, which
+# starts a new thread pool on every call.
+MIN_BATCH_SIZE = 32
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+
+# Returns the tiktoken encoding for the model. Encodings are loaded once per process and shared,
+# since loading one reads (and on first use, downloads) a large BPE file.
+def fetch_encoding(model: str) -> tiktoken.Encoding:
+    encoding_name = TOKEN_ENCODINGS.get(model)
+    if encoding_name is None:
+        raise ValueError(f"No tokenizer is registered for model: {model}")
+
+    encoding = _encodings.get(encoding_name)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(encoding_name)
+            if encoding is None:
+                encoding = tiktoken.get_encoding(encoding_name)
+                _encodings[encoding_name] = encoding
+    return encoding
+
+
+# Loads the encodings ahead of time so the first turn doesn't pay for it. Called when the API server
+# starts and when the LiveKit worker process is prewarmed.
+def prewarm_encodings(models: Optional[Iterable[str]] = None) -> None:
+    for model in models or [LLM]:
+        encoding = fetch_encoding(model)
+        # Encoding once builds tiktoken's internal state for the current thread
+        encoding.encode_ordinary("Hello")
+        logger.info(f"Loaded tokenizer {encoding.name} for model {model}")
+
+
+# Returns an upper bound on the number of tokens in the text without encoding it. tiktoken's
+# encodings are byte-level BPE, so every token covers at least one byte of the UTF-8 encoded text and
+# the worst case is one token per byte (e.g. random punctuation). Natural language averages around
+# four bytes per token, so the bound is loose, but it's exact enough to tell that a chat is far below
+# the token limit.
+MAX_TOKENS_PER_BYTE = 1
+
+
+def upper_bound_tokens(text: str) -> int:
+    # `isascii` doesn't need to scan the string, and ASCII text has one byte per character
+    if text.isascii():
+        return len(text) * MAX_TOKENS_PER_BYTE
+    return len(text.encode("utf-8")) * MAX_TOKENS_PER_BYTE
+
+
+# Returns the number of tokens in each text, encoding them in parallel when there are many of them
+def count_tokens_batch(texts: List[str], encoding: tiktoken.Encoding) -> List[int]:
+    if len(texts) < MIN_BATCH_SIZE:
+        return [len(encoding.encode_ordinary(text)) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
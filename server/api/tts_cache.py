@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, Optional
+
+from server.api.cache import BytesLRUCache, DiskLRUCache
+from server.livekit_worker.voices import VoiceSettings
+
+# Synthesized speech is cached by what determines it, so text that's said again with the same voice
+# (like the first message of every voice session, or short stock replies) is served without calling
+# ElevenLabs. The memory tier holds the most recently used audio of this process, and the disk tier
+# is shared by the processes on the machine (the API server and LiveKit job processes).
+TTS_CACHE_DIRECTORY = os.environ.get("TTS_CACHE_DIRECTORY", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 512 * 1024**2))
+TTS_CACHE_MEMORY_MAX_BYTES = int(
+    os.environ.get("TTS_CACHE_MEMORY_MAX_BYTES", 32 * 1024**2)
+)
+
+WHITESPACE = re.compile(r"\s+")
+
+
+# Text that's spoken the same way gets the same key: Unicode is normalized and runs of whitespace are
+# collapsed. Case and punctuation change how text is spoken, so they're kept.
+def normalize_text(text: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+# The key of a piece of synthesized speech. It covers every voice setting (including the model),
+# the normalized text and the audio format. The text is always a complete utterance (a whole
+# message, or a sentence of a reply), so the text spoken before it isn't part of the key: a stock
+# sentence is reused wherever it comes in a reply, at the cost of the slightly different intonation
+# ElevenLabs would give it after other text.
+def tts_cache_key(voice_settings: VoiceSettings, text: str, audio_format: str) -> str:
+    fields = {
+        "voice_settings": voice_settings.model_dump(),
+        "text": normalize_text(text),
+        "audio_format": audio_format,
+    }
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class TTSCache:
+    def __init__(
+        self,
+        directory: str = TTS_CACHE_DIRECTORY,
+        max_bytes: int = TTS_CACHE_MAX_BYTES,
+        memory_max_bytes: int = TTS_CACHE_MEMORY_MAX_BYTES,
+    ):
+        self.memory = BytesLRUCache(memory_max_bytes)
+        self.disk = DiskLRUCache(directory, max_bytes, suffix=".audio")
+
+    # Returns the cached audio, reading it from disk (off the event loop) if it isn't in memory
+    async def get(self, key: str) -> Optional[bytes]:
+        audio = self.memory.get(key)
+        if audio is None:
+            audio = await asyncio.to_thread(self.disk.read, key)
+            if audio is not None:
+                self.memory.set(key, audio)
+        return audio
+
+    async def set(self, key: str, audio: bytes) -> None:
+        self.memory.set(key, audio)
+        await asyncio.to_thread(self.disk.set, key, audio)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {"memory": self.memory.stats(), "disk": self.disk.stats()}
+
+
+tts_cache = TTSCache()
@@ -1,5 +1,5 @@
 # Standard library imports
-import copy
+import bisect
 import os
 import zoneinfo
 import jwt
@@ -10,19 +10,39 @@ from openai.types.chat import ChatCompletionChunk
 import asyncio
 import tiktoken
 
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
-from functools import partial
+from datetime import date, datetime, timedelta
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from functools import lru_cache, partial
 from openai.types.chat import ChatCompletionMessageParam
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from server.api.constants import CONTEXT_WINDOWS
+from server.api.tokenizers import (
+    count_tokens_batch,
+    fetch_encoding,
+    upper_bound_tokens,
+)
 from supabase import create_client, Client
 from openai.types.completion_usage import CompletionUsage
 from mem0 import AsyncMemoryClient, MemoryClient
 from server.logger.index import fetch_logger
+from server.api.memory_index import tokenize
+from server.api.messages import MessageView
+from server.api.cache import LRUCache
 from server.api.mem0 import call_add_memory
 from server.api.mem0 import call_search_memories
+from server.api.memory_prefetch import fetch_prefetched_memories, start_prefetch
 
 logger = fetch_logger()
 
@@ -82,7 +102,123 @@ def create_supabase_client():
     return supabase
 
 
+# Every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+
+# Per-message token counts keyed by (encoding name, message items). The same chat history is sent on
+# every turn and truncated several times per turn, so caching the count of each message means that
+# it's only encoded with tiktoken once instead of on every call. The cache is also seeded with the
+# counts stored in the `chat_messages` table when a chat is loaded, so persisted messages usually
+# aren't encoded at all.
+MESSAGE_TOKEN_CACHE_SIZE = 16384
+_message_token_cache: LRUCache[Tuple[str, FrozenSet[Tuple[str, Any]]], int] = LRUCache(
+    MESSAGE_TOKEN_CACHE_SIZE
+)
+
+
+def _message_token_cache_key(
+    message: ChatCompletionMessageParam, encoding: tiktoken.Encoding
+) -> Tuple[str, FrozenSet[Tuple[str, Any]]]:
+    return (encoding.name, frozenset(message.items()))
+
+
+# Returns the number of tokens in each message. Messages that aren't in the cache are encoded
+# together with `count_tokens_batch`, which encodes large batches in parallel.
+#
 # Taken from: https://cookbook.openai.com/examples/how_to_count_tokens_with_tiktoken
+def count_tokens_for_messages(
+    messages: Sequence[ChatCompletionMessageParam], encoding: tiktoken.Encoding
+) -> List[int]:
+    tokens_per_message = 3
+    tokens_per_name = 1
+
+    keys = [_message_token_cache_key(message, encoding) for message in messages]
+    counts: List[Optional[int]] = [_message_token_cache.get(key) for key in keys]
+
+    uncached_indices = [i for i, num_tokens in enumerate(counts) if num_tokens is None]
+    if not uncached_indices:
+        return counts
+
+    texts = [value for i in uncached_indices for value in messages[i].values()]
+    text_counts = iter(count_tokens_batch(texts, encoding))
+    for i in uncached_indices:
+        num_tokens = tokens_per_message
+        for key_name in messages[i].keys():
+            num_tokens += next(text_counts)
+            if key_name == "name":
+                num_tokens += tokens_per_name
+        counts[i] = num_tokens
+        _message_token_cache.set(keys[i], num_tokens)
+
+    return counts
+
+
+def count_tokens_for_message(
+    message: ChatCompletionMessageParam, encoding: tiktoken.Encoding
+) -> int:
+    return count_tokens_for_messages([message], encoding)[0]
+
+
+# Seeds the token count cache with a count that was stored in the `chat_messages` table. Counts that
+# were computed with a different encoding than the one used for truncation are ignored. Returns
+# whether the count was used.
+def seed_message_token_count(
+    role: str,
+    content: str,
+    token_count: Optional[int],
+    token_encoding: Optional[str],
+    encoding: tiktoken.Encoding,
+) -> bool:
+    if token_count is None or token_encoding != encoding.name:
+        return False
+
+    message = {"role": str(role), "content": content}
+    _message_token_cache.set(_message_token_cache_key(message, encoding), token_count)
+    return True
+
+
+# Returns an upper bound on the number of tokens in the message without encoding it
+def upper_bound_tokens_for_message(message: ChatCompletionMessageParam) -> int:
+    tokens_per_message = 3
+    tokens_per_name = 1
+
+    num_tokens = tokens_per_message
+    for key_name, value in message.items():
+        num_tokens += upper_bound_tokens(value)
+        if key_name == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+# How often the token limit check was decided from the upper bound alone (the fast path), versus
+# needing exact token counts. Logged every `TOKEN_ESTIMATE_LOG_INTERVAL` checks.
+TOKEN_ESTIMATE_LOG_INTERVAL = 1000
+_token_estimate_stats = {"fast_path": 0, "exact_path": 0}
+
+
+def record_token_estimate(fast_path: bool) -> None:
+    _token_estimate_stats["fast_path" if fast_path else "exact_path"] += 1
+
+    stats = fetch_token_estimate_stats()
+    if stats["total"] % TOKEN_ESTIMATE_LOG_INTERVAL == 0:
+        logger.info(
+            f"Token limit checks took the fast path in {stats['fast_path']} of "
+            f"{stats['total']} calls"
+        )
+
+
+def fetch_token_estimate_stats() -> Dict[str, Any]:
+    fast_path = _token_estimate_stats["fast_path"]
+    exact_path = _token_estimate_stats["exact_path"]
+    total = fast_path + exact_path
+    return {
+        "fast_path": fast_path,
+        "exact_path": exact_path,
+        "total": total,
+        "fast_path_ratio": fast_path / total if total else 0.0,
+    }
+
+
 def estimate_tokens_for_messages(
     messages: List[ChatCompletionMessageParam], encoding: tiktoken.Encoding
 ) -> int:
@@ -92,19 +228,237 @@ def estimate_tokens_for_messages(
     if not all(is_chat_completion_message_param(message) for message in messages):
         raise ValueError("All messages must be of type ChatCompletionMessageParam")
 
-    tokens_per_message = 3
-    tokens_per_name = 1
-    num_tokens = 0
+    num_tokens = sum(count_tokens_for_messages(messages, encoding))
+    num_tokens += REPLY_PRIMING_TOKENS
+    return num_tokens
 
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
 
-    num_tokens += 3  # Every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+class MessageTokenIndex:
+    # Suffix sums of the per-message token counts, built lazily from the end of the messages array.
+    # `_suffix_sums[k]` is the number of tokens in the last `k + 1` messages (excluding the reply
+    # priming tokens). Since the sums only grow as we move towards the start of the array, the
+    # number of messages that fit within a token limit can be found with a bisect. Messages are
+    # counted in chunks that double in size, so only a bounded number of messages before the cut
+    # point are counted.
+    #
+    # Before counting exactly, the index sums a cheap upper bound of each message's tokens (see
+    # `upper_bound_tokens`). If the upper bound of every message fits within the limit, which is the
+    # case for most chats, no message is encoded. Otherwise, the messages that fit by their upper
+    # bound are counted in one batch and the rest are counted in chunks until the cut point.
+    MIN_CHUNK_SIZE = 8
+    MAX_CHUNK_SIZE = 512
+
+    def __init__(
+        self,
+        messages: Sequence[ChatCompletionMessageParam],
+        encoding: tiktoken.Encoding,
+        count_tokens: Optional[
+            Callable[[Sequence[ChatCompletionMessageParam]], List[int]]
+        ] = None,
+    ):
+        self.messages = messages
+        self.encoding = encoding
+        self._count_tokens = count_tokens or partial(
+            count_tokens_for_messages, encoding=encoding
+        )
+        self._suffix_sums: List[int] = []
+        self._upper_bound_suffix_sums: List[int] = []
+
+    def _extend(self, min_chunk_size: int = 0) -> bool:
+        num_counted = len(self._suffix_sums)
+        if num_counted == len(self.messages):
+            return False
+
+        chunk_size = min(
+            max(
+                min(max(num_counted, self.MIN_CHUNK_SIZE), self.MAX_CHUNK_SIZE),
+                min_chunk_size,
+            ),
+            len(self.messages) - num_counted,
+        )
+        # The chunk, in order from the end of the array towards the start
+        chunk = [self.messages[-(num_counted + i + 1)] for i in range(chunk_size)]
+        if not all(is_chat_completion_message_param(message) for message in chunk):
+            raise ValueError("All messages must be of type ChatCompletionMessageParam")
+
+        previous_sum = self._suffix_sums[-1] if self._suffix_sums else 0
+        for num_tokens in self._count_tokens(chunk):
+            previous_sum += num_tokens
+            self._suffix_sums.append(previous_sum)
+        return True
+
+    # Returns the number of messages at the end of the array whose upper bounds fit within the
+    # budget. Stops summing at the first message that doesn't fit.
+    def _num_messages_within_upper_bound(self, budget: int) -> int:
+        sums = self._upper_bound_suffix_sums
+        while len(sums) < len(self.messages) and (not sums or sums[-1] <= budget):
+            message = self.messages[-(len(sums) + 1)]
+            if not is_chat_completion_message_param(message):
+                raise ValueError(
+                    "All messages must be of type ChatCompletionMessageParam"
+                )
+            previous_sum = sums[-1] if sums else 0
+            sums.append(previous_sum + upper_bound_tokens_for_message(message))
+        return bisect.bisect_right(sums, budget)
+
+    def tokens_for_last(self, num_messages: int) -> int:
+        num_messages = min(num_messages, len(self.messages))
+        if num_messages <= 0:
+            return REPLY_PRIMING_TOKENS
+        while len(self._suffix_sums) < num_messages and self._extend():
+            pass
+        return self._suffix_sums[num_messages - 1] + REPLY_PRIMING_TOKENS
+
+    def num_messages_within_limit(self, token_limit: int) -> int:
+        budget = token_limit - REPLY_PRIMING_TOKENS
+        if budget < 0:
+            return 0
+
+        num_messages_within_upper_bound = self._num_messages_within_upper_bound(budget)
+        if num_messages_within_upper_bound == len(self.messages):
+            record_token_estimate(fast_path=True)
+            return len(self.messages)
+        record_token_estimate(fast_path=False)
+
+        # The messages that fit by their upper bound also fit by their exact count, so they're
+        # counted in one batch
+        if len(self._suffix_sums) < num_messages_within_upper_bound:
+            self._extend(
+                min_chunk_size=num_messages_within_upper_bound - len(self._suffix_sums)
+            )
+        while (
+            not self._suffix_sums or self._suffix_sums[-1] <= budget
+        ) and self._extend():
+            pass
+        return bisect.bisect_right(self._suffix_sums, budget)
+
+    def start_index_for_limit(self, token_limit: int) -> int:
+        return len(self.messages) - self.num_messages_within_limit(token_limit)
+
+
+# Converts a message whose content is a list of parts to one with a string content, and drops keys
+# that aren't part of the message params (they'd be counted as tokens). Messages that are already
+# normalized are returned as is, so normalizing doesn't copy the chat history.
+def normalize_message(message: Dict[str, Any]) -> ChatCompletionMessageParam:
+    content = message["content"]
+    if isinstance(content, str) and message.keys() <= NORMALIZED_MESSAGE_KEYS:
+        return message
+
+    normalized = {
+        "role": message["role"],
+        "content": (
+            content
+            if isinstance(content, str)
+            else "".join(part.get("text", "") for part in content or [])
+        ),
+    }
+    if message.get("name"):
+        normalized["name"] = message["name"]
+    return normalized
+
+
+NORMALIZED_MESSAGE_KEYS = {"role", "content", "name"}
+
+# The number of tokens of recent messages used to build the memory search query and the memory
+# window sent to mem0, and the minimum number of messages in each
+RECENT_MESSAGES_TOKEN_LIMIT = 150
+MIN_RECENT_MESSAGES = 4
+
+
+# Everything about a turn's chat history that's needed more than once per turn, built once per
+# request. A turn used to truncate the history by tokens three times (for the memory search query,
+# for the context window and for the messages sent to mem0), each time with its own token index.
+# The context shares one per-message token count memo across all of them, so each message is counted
+# at most once per turn, and the windows are only computed once.
+class TurnContext:
+    def __init__(self, messages: Sequence[Dict[str, Any]], model: str):
+        self.model = model
+        self.encoding = fetch_encoding(model)
+        self.messages: List[ChatCompletionMessageParam] = [
+            normalize_message(message) for message in messages
+        ]
+        # Token counts keyed by message identity. The message is kept with its count so that an id
+        # reused by a new object after the original was garbage collected doesn't match.
+        self._token_counts: Dict[int, Tuple[ChatCompletionMessageParam, int]] = {}
+        self._token_index = self.token_index(self.messages)
+        self._search_query_window: Optional[Sequence[ChatCompletionMessageParam]] = None
+        # The number of tokens of memories in the memories prompt, set once they're selected
+        self.memory_tokens = 0
+
+    def count_tokens(self, messages: Sequence[ChatCompletionMessageParam]) -> List[int]:
+        uncounted = [
+            message
+            for message in messages
+            if self._token_counts.get(id(message), (None,))[0] is not message
+        ]
+        if uncounted:
+            for message, num_tokens in zip(
+                uncounted, count_tokens_for_messages(uncounted, self.encoding)
+            ):
+                self._token_counts[id(message)] = (message, num_tokens)
+        return [self._token_counts[id(message)][1] for message in messages]
+
+    def token_index(
+        self, messages: Sequence[ChatCompletionMessageParam]
+    ) -> MessageTokenIndex:
+        return MessageTokenIndex(
+            messages, self.encoding, count_tokens=self.count_tokens
+        )
+
+    # Like `get_final_messages_by_token_limit`, for messages built from this turn's messages (e.g.
+    # with the system prompts added)
+    def truncate(
+        self, messages: Sequence[ChatCompletionMessageParam], token_limit: int
+    ) -> Sequence[ChatCompletionMessageParam]:
+        if token_limit > CONTEXT_WINDOWS[self.model]:
+            raise ValueError(
+                "Token limit exceeds the maximum context window for the model."
+            )
+        token_index = (
+            self._token_index
+            if messages is self.messages
+            else self.token_index(messages)
+        )
+        return messages[token_index.start_index_for_limit(token_limit) :]
+
+    # The final messages that contain up to `RECENT_MESSAGES_TOKEN_LIMIT` tokens, but at least
+    # `MIN_RECENT_MESSAGES` messages
+    def _recent_window(
+        self, messages: Sequence[ChatCompletionMessageParam], token_index
+    ) -> Sequence[ChatCompletionMessageParam]:
+        num_messages = max(
+            MIN_RECENT_MESSAGES,
+            token_index.num_messages_within_limit(RECENT_MESSAGES_TOKEN_LIMIT),
+        )
+        return messages[-num_messages:]
+
+    # The messages that give the memory search its context
+    @property
+    def search_query_window(self) -> Sequence[ChatCompletionMessageParam]:
+        if self._search_query_window is None:
+            self._search_query_window = self._recent_window(
+                self.messages, self._token_index
+            )
+        return self._search_query_window
+
+    # The content of the messages in the memory search query, oldest first
+    @property
+    def search_query_contents(self) -> List[str]:
+        return [
+            message["content"]
+            for message in self.search_query_window[-MIN_RECENT_MESSAGES:]
+        ]
+
+    # The messages sent to mem0 to create memories once the reply is done. We include some messages
+    # immediately before the latest user and assistant message to give Mem0 more conversational
+    # context, which it wouldn't get if we just submitted the latest user and assistant message.
+    def memory_window(
+        self, agent_response: str
+    ) -> Sequence[ChatCompletionMessageParam]:
+        messages = MessageView(self.messages).with_appended(
+            {"role": "assistant", "content": agent_response}
+        )
+        return self._recent_window(messages, self.token_index(messages))
 
 
 def find_last_agent_message(conversation: List[ChatCompletionMessageParam]) -> str:
@@ -182,82 +536,45 @@ def is_chat_completion_message_param(obj: Any) -> bool:
     )
 
 
+# Returns the final messages that fit within the token limit. The messages aren't copied: slicing a
+# list returns a shallow copy, and slicing a `MessageView` returns another view over the same
+# messages. The returned messages must not be mutated.
 def get_final_messages_by_token_limit(
-    messages: List[ChatCompletionMessageParam],
+    messages: Sequence[ChatCompletionMessageParam],
     model: str,
     encoding: tiktoken.Encoding,
     token_limit: int,
-) -> List[ChatCompletionMessageParam]:
+) -> Sequence[ChatCompletionMessageParam]:
     max_context_window = CONTEXT_WINDOWS[model]
     if token_limit > max_context_window:
         raise ValueError(
             "Token limit exceeds the maximum context window for the model."
         )
 
-    messages_copy = copy.deepcopy(messages)
-
     # Estimating tokens using tiktoken is slow if the messages array is large (e.g. tens of
-    # thousands of tokens), so the following code has performance optimizations. If the token limit
-    # is small, it's fastest to loop through the array, starting from the smallest possible array of
-    # messages. Otherwise, we use binary search.
-    if token_limit <= 1000:
-        # Start with the smallest current_messages length
-        for num_messages in range(1, len(messages_copy) + 1):
-            current_messages = messages_copy[-num_messages:]
-            tokens_count = estimate_tokens_for_messages(current_messages, encoding)
-            if tokens_count > token_limit:
-                # Return the previous set of messages that fit within the token limit
-                if num_messages == 1:
-                    return []
-                else:
-                    return messages_copy[-(num_messages - 1) :]
-        # All messages fit within the token limit
-        return messages_copy
-    else:
-        # Use binary search as before
-        low = 0
-        high = len(messages_copy)
-        ans = len(messages_copy)
+    # thousands of tokens), so each message is counted at most once, starting from the end of the
+    # array, and the cut point is found with a bisect over the running totals.
+    token_index = MessageTokenIndex(messages, encoding)
+    return messages[token_index.start_index_for_limit(token_limit) :]
 
-        def is_valid(start_index: int) -> bool:
-            current_messages = messages_copy[start_index:]
-            tokens_count = estimate_tokens_for_messages(current_messages, encoding)
-            return tokens_count <= token_limit
 
-        while low <= high:
-            mid = (low + high) // 2
+# Starts searching memories for a message that's still being typed or spoken, so the search is
+# done (or nearly done) by the time the message is sent. `messages` ends with the partial message.
+def prefetch_memories(
+    messages: Sequence[Dict[str, Any]], user_id: str, model: str
+) -> None:
+    start_prefetch(user_id, TurnContext(messages, model).search_query_contents)
 
-            if is_valid(mid):
-                ans = mid
-                high = mid - 1  # Try to find a smaller starting index
-            else:
-                low = mid + 1  # Need to remove more messages from the start
 
-        return messages_copy[ans:]
-
-
-async def search_memories(
-    messages: List[ChatCompletionMessageParam],
-    user_id: str,
-    model: str,
-) -> Tuple[List[Dict[str, Any]], tiktoken.Encoding]:
-    encoding = tiktoken.get_encoding("cl100k_base")
-
-    # Get the number of messages to use in the search query. We use the final messages in the array.
-    # If these final messages don't contain many words, we include more messages, up until 150
-    # tokens, to provide more context for the search query. We always use at least 4 messages in the
-    # query.
-    num_messages = max(
-        4,
-        len(
-            get_final_messages_by_token_limit(
-                messages=messages, model=model, encoding=encoding, token_limit=150
-            )
-        ),
-    )
+async def search_memories(turn: TurnContext, user_id: str) -> List[Dict[str, Any]]:
+    query_contents = turn.search_query_contents
+    message_content = "\n".join(query_contents)
 
-    truncated_messages = messages[-num_messages:]
-    message_content = "\n".join(msg["content"] for msg in truncated_messages[-4:])
+    # Use the search that was prefetched while the message was being written, if it was for nearly
+    # the same message
+    memories = await fetch_prefetched_memories(user_id, query_contents)
+    if memories is not None:
+        return memories
 
     # Search for the most relevant memories.
     #
@@ -291,115 +608,304 @@ async def search_memories(
         message_content=message_content, user_id=user_id
     )
 
-    return memories, encoding
+    return memories
 
 
+# Appends the messages of `window` that aren't already at the end of `messages`. Consecutive turns
+# send overlapping windows of the same conversation (each window ends with the newest user and
+# assistant messages and starts a few messages earlier), so the overlap is only sent once.
+def merge_message_windows(
+    messages: List[ChatCompletionMessageParam],
+    window: Sequence[ChatCompletionMessageParam],
+) -> List[ChatCompletionMessageParam]:
+    for overlap in range(min(len(messages), len(window)), 0, -1):
+        if messages[-overlap:] == list(window[:overlap]):
+            return messages + list(window[overlap:])
+    return messages + list(window)
+
+
+MEMORY_CUSTOM_CATEGORIES = [
+    {
+        "conversation_preferences": "The user's preferences for how the AI should respond."
+    },
+]
+# A string mentioning an additional rule for Mem0 to use when creating facts. These instructions say
+# that the resulting facts should mention the assistant explicitly because this is important for the
+# preferences to get categorized as a "conversation_preferences".
+MEMORY_INCLUDES = "The user's preferences for how the AI should respond. These facts must mention the assistant explicitly; for example, say 'User prefers the assistant to respond with emojis', not 'User prefers responses with emojis'."
+
+
+# Sends a turn to mem0. Errors are raised, so the caller can retry.
 async def add_memories(
-    messages: List[ChatCompletionMessageParam], user_id: str, model: str
+    turn: TurnContext,
+    agent_response: str,
+    user_id: str,
 ):
-    encoding = tiktoken.get_encoding("cl100k_base")
-
-    # Get the number of messages to include when creating the latest memories. We include some
-    # messages immediately before the latest user and assistant message to give Mem0 more
-    # conversational context, which it wouldn't get if we just submitted the latest user and
-    # assistant message. We always include at least four messages total. If the messages don't
-    # contain many tokens, we include more messages, up until 150 tokens.
-    num_messages = max(
-        4,
-        len(
-            get_final_messages_by_token_limit(
-                messages=messages, model=model, encoding=encoding, token_limit=150
-            )
-        ),
-    )
+    # The latest user and assistant messages, with a few earlier messages for context. We always
+    # include at least four messages total. If the messages don't contain many tokens, we include
+    # more messages, up until 150 tokens.
+    await add_memory_windows([turn.memory_window(agent_response)], user_id)
 
-    custom_categories = [
-        {
-            "conversation_preferences": "The user's preferences for how the AI should respond."
-        },
-    ]
-    # A string mentioning an additional rule for Mem0 to use when creating facts. These instructions
-    # say that the resulting facts should mention the assistant explicitly because this is important
-    # for the preferences to get categorized as a "conversation_preferences".
-    includes = "The user's preferences for how the AI should respond. These facts must mention the assistant explicitly; for example, say 'User prefers the assistant to respond with emojis', not 'User prefers responses with emojis'."
 
-    truncated_messages = messages[-num_messages:]
+# Sends several turns of a user's conversation to mem0 in one `add` call, given the window of
+# messages of each turn (see `TurnContext.memory_window`). The messages the windows share are sent
+# once. Errors are raised, so the caller can retry.
+async def add_memory_windows(
+    windows: List[Sequence[ChatCompletionMessageParam]], user_id: str
+):
+    messages: List[ChatCompletionMessageParam] = []
+    for window in windows:
+        messages = merge_message_windows(messages, window)
 
     logger.info(
         "Adding memory to mem0",
         {
-            "messages": truncated_messages,
+            "messages": messages,
             "user_id": user_id,
-            "includes": includes,
-            "custom_categories": custom_categories,
+            "includes": MEMORY_INCLUDES,
+            "custom_categories": MEMORY_CUSTOM_CATEGORIES,
+            "num_turns": len(windows),
         },
     )
 
-    await call_add_memory(truncated_messages, user_id, includes, custom_categories)
+    await call_add_memory(
+        messages, user_id, MEMORY_INCLUDES, MEMORY_CUSTOM_CATEGORIES, raise_errors=True
+    )
 
 
-def add_system_prompts(
-    messages: List[ChatCompletionMessageParam],
-    ai_first_name: str,
-    user_first_name: str,
-    user_gender: str,
-    timezone: str,
+# The memories prompt used to include every search result, however long and however irrelevant.
+# Memories are now added in order of their search score until they'd exceed the token budget, and
+# memories that nearly repeat a preference or a higher-scored memory are dropped.
+MEMORY_PROMPT_TOKEN_BUDGET = int(os.environ.get("MEMORY_PROMPT_TOKEN_BUDGET", 800))
+# Memories whose search terms overlap by at least this much (Jaccard similarity) are duplicates
+MEMORY_DUPLICATE_SIMILARITY = float(os.environ.get("MEMORY_DUPLICATE_SIMILARITY", 0.8))
+# The tokens each memory adds to the prompt besides its text: the <MEMORY> tags, the labels and the
+# formatted time
+MEMORY_PROMPT_OVERHEAD_TOKENS = 16
+
+
+class MemorySelection(NamedTuple):
+    memories: List[Dict[str, Any]]
+    num_tokens: int
+    num_duplicates: int
+    num_over_budget: int
+
+
+def _is_near_duplicate(terms: FrozenSet[str], other_terms: FrozenSet[str]) -> bool:
+    if not terms or not other_terms:
+        return False
+    return len(terms & other_terms) / len(terms | other_terms) >= (
+        MEMORY_DUPLICATE_SIMILARITY
+    )
+
+
+def select_memories(
     memories: List[Dict[str, Any]],
     preferences: List[Dict[str, Any]],
-) -> List[ChatCompletionMessageParam]:
-    current_time = datetime.now()
+    encoding: tiktoken.Encoding,
+    token_budget: int = MEMORY_PROMPT_TOKEN_BUDGET,
+) -> MemorySelection:
+    candidates = sorted(
+        (memory for memory in memories if memory["memory"]),
+        key=lambda memory: memory.get("score") or 0,
+        reverse=True,
+    )
+    token_counts = count_tokens_batch(
+        [memory["memory"] for memory in candidates], encoding
+    )
+    # Preferences are already in the instructions prompt
+    preference_texts = [
+        preference["memory"].strip().lower()
+        for preference in preferences
+        if preference["memory"]
+    ]
+    seen_texts = set(preference_texts)
+    seen_terms = [frozenset(tokenize(text)) for text in preference_texts]
+
+    selected = []
+    num_tokens = num_duplicates = num_over_budget = 0
+    for memory, memory_tokens in zip(candidates, token_counts):
+        text = memory["memory"].strip().lower()
+        terms = frozenset(tokenize(text))
+        if text in seen_texts or any(
+            _is_near_duplicate(terms, other_terms) for other_terms in seen_terms
+        ):
+            num_duplicates += 1
+            continue
+
+        memory_tokens += MEMORY_PROMPT_OVERHEAD_TOKENS
+        if num_tokens + memory_tokens > token_budget:
+            # A shorter, lower-scored memory may still fit
+            num_over_budget += 1
+            continue
+
+        selected.append(memory)
+        num_tokens += memory_tokens
+        seen_terms.append(terms)
+        seen_texts.add(text)
+
+    return MemorySelection(
+        memories=selected,
+        num_tokens=num_tokens,
+        num_duplicates=num_duplicates,
+        num_over_budget=num_over_budget,
+    )
 
-    memories_system_prompt = ""
-    if memories:
-        memories_with_time = []
-        for fact in memories:
-            memory = fact["memory"]
-            if not memory:
-                continue
-
-            if fact["updated_at"]:
-                time_ago_formatted = time_ago(
-                    current_time, datetime.fromisoformat(fact["updated_at"]), timezone
-                )
-            elif fact["created_at"]:
-                time_ago_formatted = time_ago(
-                    current_time, datetime.fromisoformat(fact["created_at"]), timezone
-                )
-            else:
-                time_ago_formatted = "Unknown"
 
-            memories_with_time.append(
-                f"<MEMORY>\nMemory: {memory}\nTime: {time_ago_formatted}\n</MEMORY>"
-            )
+_memory_selection_stats = {
+    "turns": 0,
+    "memory_tokens": 0,
+    "duplicates": 0,
+    "over_budget": 0,
+}
 
-        formatted_memories = "\n".join(memories_with_time)
-        memories_system_prompt = f"""This system prompt contains a list of memories from your previous conversations with {user_first_name}. You must only incorporate a memory if it is relevant to the user's latest message; for example, if the user's latest message says that they're looking for a gift for their mom, and a memory mentions that their mom loves Ottolenghi, you can incorporate this memory into your response by suggesting a gift such as an Ottolenghi cookbook. Each memory is enclosed within <MEMORY> tags and includes a relative time reference (e.g., 'One week ago') indicating when the memory was created.\n{formatted_memories}"""
 
-    preferences_str = ""
-    if preferences:
-        preferences_with_tags = []
-        for preference in preferences:
-            preference_memory = preference["memory"]
-            if not preference_memory:
-                continue
-            preferences_with_tags.append(
-                f"<PREFERENCE>\n{preference_memory}\n</PREFERENCE>"
-            )
+def record_memory_selection(selection: MemorySelection) -> None:
+    _memory_selection_stats["turns"] += 1
+    _memory_selection_stats["memory_tokens"] += selection.num_tokens
+    _memory_selection_stats["duplicates"] += selection.num_duplicates
+    _memory_selection_stats["over_budget"] += selection.num_over_budget
+
+
+def fetch_memory_selection_stats() -> Dict[str, Any]:
+    turns = _memory_selection_stats["turns"]
+    return {
+        **_memory_selection_stats,
+        "memory_tokens_per_turn": (
+            _memory_selection_stats["memory_tokens"] / turns if turns else 0.0
+        ),
+    }
+
+
+# System prompt messages keyed by everything they're built from. The prompts are rebuilt on every
+# turn otherwise, even though the user's settings and memories rarely change between turns. Cached
+# prompts are reused as the same string objects, so their token counts are also cache hits.
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", 1024))
+_prompt_cache: LRUCache[Tuple[Any, ...], ChatCompletionMessageParam] = LRUCache(
+    PROMPT_CACHE_SIZE
+)
+
+
+def fetch_prompt_cache_stats() -> Dict[str, float]:
+    return _prompt_cache.stats()
+
 
-        formatted_preferences = "\n".join(preferences_with_tags)
+def _build_memories_system_prompt(
+    user_first_name: str, memories_with_time: List[Tuple[str, str]]
+) -> str:
+    formatted_memories = "\n".join(
+        f"<MEMORY>\nMemory: {memory}\nTime: {time_ago_formatted}\n</MEMORY>"
+        for memory, time_ago_formatted in memories_with_time
+    )
+    memories_system_prompt = f"""This system prompt contains a list of memories from your previous conversations with {user_first_name}. You must only incorporate a memory if it is relevant to the user's latest message; for example, if the user's latest message says that they're looking for a gift for their mom, and a memory mentions that their mom loves Ottolenghi, you can incorporate this memory into your response by suggesting a gift such as an Ottolenghi cookbook. Each memory is enclosed within <MEMORY> tags and includes a relative time reference (e.g., 'One week ago') indicating when the memory was created.\n{formatted_memories}"""
+    return memories_system_prompt
+
+
+def _build_instructions_system_prompt(
+    ai_first_name: str,
+    user_first_name: str,
+    user_gender: str,
+    preference_memories: Optional[List[str]],
+) -> str:
+    preferences_str = ""
+    if preference_memories is not None:
+        formatted_preferences = "\n".join(
+            f"<PREFERENCE>\n{preference_memory}\n</PREFERENCE>"
+            for preference_memory in preference_memories
+        )
         preferences_str = f"""\n\nBelow is a list of preferences for how {user_first_name} prefers you to respond. Each preference is enclosed within <PREFERENCE> tags.\n{formatted_preferences}"""
 
     # The instructions that say "Do not hallucinate content" and "Don't repeat yourself across
     # consecutive messages" may not have any effect.
     instructions_and_preferences_system_prompt = f"""You are an AI whose name is {ai_first_name}. You are talking to {user_first_name}, whose gender is {user_gender}. Match the user's energy and tone: if the user is relaxed, respond casually; if excited, mirror their enthusiasm; if they're talking about something personal, be empathetic; if they're being goofy and making jokes, do the same, etc. Always leave the user with something to respond to. Avoid asking multiple separate questions at once, since this can overwhelm the user and disrupt the natural flow of conversation. Avoid combining multiple questions into one; for example, instead of asking, 'Do you have a favorite sports team or player?', ask 'Do you have a favorite sports team?' or 'Do you have a favorite player?'. Do not ask the user a question that they answered earlier in the conversation; for example, if the user already mentioned their favorite sports team, don't ask something like, "Which sports team do you like the most?". Do not hallucinate content; for example, if the user says 'Good morning', do not hallucinate that they are asking for the current time. Don't repeat yourself across consecutive messages because this feels redundant; for example, if you say, \"Hey, how's it going?\" and the user replies \"Hey\", your response should not start with "Hey" because you already said this in the previous message. Unless you're stating an absolute fact, like "the sky is blue", you must express your responses as your own opinions using phrases like "I think", "In my opinion", "I feel like", etc; for example, instead of saying, "Dogs are the best pets", or, "people think dogs are the best pets" you should say something like, "I think dogs are the best pets"... it's not enough to say phrases like "it's understandable" or "it's fascinating" that only imply your perspective; you need to explicitly express it as your own opinion. Accordingly, if the user asks for your opinion by saying something like, "What's an interesting fact", your response must be expressed as your opinion, like "I think an interesting fact is...", and not something like, "An interesting fact is..." or "People think an interesting fact is...". Continue the conversation based on the user's latest response; for example, if the user asked you a question, answer their question.{preferences_str}"""
-    message_copy = copy.deepcopy(messages)
+    return instructions_and_preferences_system_prompt
 
-    message_copy.append(
-        {
+
+# Returns a `MessageView` over `messages` with the system prompts overlaid, so the chat history isn't
+# copied. Call `to_list` on the result to get a list of messages.
+def add_system_prompts(
+    messages: Sequence[ChatCompletionMessageParam],
+    ai_first_name: str,
+    user_first_name: str,
+    user_gender: str,
+    timezone: str,
+    memories: List[Dict[str, Any]],
+    preferences: List[Dict[str, Any]],
+) -> MessageView:
+    current_time = datetime.now()
+
+    memories_message = None
+    if memories:
+        memories_with_content = [fact for fact in memories if fact["memory"]]
+        memory_times = [
+            fact["updated_at"] or fact["created_at"] for fact in memories_with_content
+        ]
+        formatted_times = iter(
+            time_ago_batch(
+                current_time,
+                [datetime.fromisoformat(time) for time in memory_times if time],
+                timezone,
+            )
+        )
+        memories_with_time = [
+            (fact["memory"], next(formatted_times) if memory_time else "Unknown")
+            for fact, memory_time in zip(memories_with_content, memory_times)
+        ]
+
+        # The formatted times are part of the key (rather than the current time) because they only
+        # change a few times per day
+        cache_key = (
+            "memories",
+            user_first_name,
+            tuple(
+                (fact.get("id"), memory_time, memory, time_ago_formatted)
+                for fact, memory_time, (memory, time_ago_formatted) in zip(
+                    memories_with_content, memory_times, memories_with_time
+                )
+            ),
+        )
+        memories_message = _prompt_cache.get(cache_key)
+        if memories_message is None:
+            memories_message = {
+                "role": "system",
+                "content": _build_memories_system_prompt(
+                    user_first_name, memories_with_time
+                ),
+            }
+            _prompt_cache.set(cache_key, memories_message)
+
+    preferences_with_content = [
+        preference for preference in preferences if preference["memory"]
+    ]
+    cache_key = (
+        "instructions",
+        ai_first_name,
+        user_first_name,
+        user_gender,
+        bool(preferences),
+        tuple(
+            (preference.get("id"), preference.get("updated_at"), preference["memory"])
+            for preference in preferences_with_content
+        ),
+    )
+    instructions_message = _prompt_cache.get(cache_key)
+    if instructions_message is None:
+        instructions_message = {
             "role": "system",
-            "content": instructions_and_preferences_system_prompt,
+            "content": _build_instructions_system_prompt(
+                ai_first_name,
+                user_first_name,
+                user_gender,
+                (
+                    [preference["memory"] for preference in preferences_with_content]
+                    if preferences
+                    else None
+                ),
+            ),
         }
-    )
+        _prompt_cache.set(cache_key, instructions_message)
+
+    messages_view = MessageView(messages).with_appended(instructions_message)
 
     # Include the system prompt for the long-term memories. We put this prompt a few messages before
     # the end of the array because putting it at the end of the array causes the model to
@@ -417,86 +923,127 @@ def add_system_prompts(
     # inputs to an LLM: https://gist.github.com/sam-goldman/34a08da2792e57c8c21543bb48544cdd. You'll
     # notice that every response from the LLM mentions Mediterranean food or Ottolenghi, which is
     # information stored as a memory.
-    if memories_system_prompt:
-        memories_message = {
-            "role": "system",
-            "content": memories_system_prompt,
-        }
-
+    if memories_message is not None:
         # If array is too small, insert the memories system prompt at the beginning. Otherwise,
         # insert it three elements behind the last message.
-        insert_index = 0 if len(message_copy) < 4 else len(message_copy) - 3
-        message_copy.insert(insert_index, memories_message)
-
-    return message_copy
-
+        insert_index = 0 if len(messages_view) < 4 else len(messages_view) - 3
+        messages_view = messages_view.with_inserted(insert_index, memories_message)
+
+    return messages_view
+
+
+# Cached because `add_system_prompts` formats the time of every memory on every turn
+@lru_cache(maxsize=None)
+def fetch_zone_info(time_zone: str) -> zoneinfo.ZoneInfo:
+    return zoneinfo.ZoneInfo(time_zone)
+
+
+class DayBoundaries(NamedTuple):
+    # Start of the current day (midnight)
+    current_date: datetime
+    five_am_today: datetime
+    twelve_pm_today: datetime
+    five_pm_today: datetime
+    eight_pm_today: datetime
+    midnight_tonight: datetime
+    five_am_yesterday: datetime
+    twelve_pm_yesterday: datetime
+    five_pm_yesterday: datetime
+    eight_pm_yesterday: datetime
+    midnight_last_night: datetime
+
+
+# The boundaries only depend on the timezone and the current day, so they're computed once per day
+# instead of once per memory. `fold` is part of the key because it's carried over from the current
+# time, which matters for timezones whose DST transitions happen at midnight.
+@lru_cache(maxsize=1024)
+def fetch_day_boundaries(time_zone: str, current_day: date, fold: int) -> DayBoundaries:
+    # Get the start of the current day (midnight)
+    current_date = datetime(
+        current_day.year,
+        current_day.month,
+        current_day.day,
+        tzinfo=fetch_zone_info(time_zone),
+        fold=fold,
+    )
 
-def time_ago(current_time: datetime, previous_time: datetime, time_zone: str) -> str:
-    # Convert times to the specified timezone
-    current_time_tz = current_time.astimezone(zoneinfo.ZoneInfo(time_zone))
-    previous_time_tz = previous_time.astimezone(zoneinfo.ZoneInfo(time_zone))
+    # Define time ranges for yesterday in the specified timezone
+    yesterday_date = current_date - timedelta(days=1)
 
-    # Get the start of the current day (midnight)
-    current_date = current_time_tz.replace(hour=0, minute=0, second=0, microsecond=0)
+    return DayBoundaries(
+        current_date=current_date,
+        # Define time ranges for today in the specified timezone
+        five_am_today=current_date.replace(hour=5),
+        twelve_pm_today=current_date.replace(hour=12),
+        five_pm_today=current_date.replace(hour=17),
+        eight_pm_today=current_date.replace(hour=20),
+        midnight_tonight=current_date + timedelta(days=1),
+        five_am_yesterday=yesterday_date.replace(hour=5),
+        twelve_pm_yesterday=yesterday_date.replace(hour=12),
+        five_pm_yesterday=yesterday_date.replace(hour=17),
+        eight_pm_yesterday=yesterday_date.replace(hour=20),
+        midnight_last_night=yesterday_date + timedelta(days=1),
+    )
 
-    # Calculate the difference in calendar days
-    diff_days = (current_time_tz.date() - previous_time_tz.date()).days
 
-    # Define time ranges for today in the specified timezone
-    five_am_today = current_date.replace(hour=5)
-    twelve_pm_today = current_date.replace(hour=12)
-    five_pm_today = current_date.replace(hour=17)
-    eight_pm_today = current_date.replace(hour=20)
-    midnight_tonight = current_date + timedelta(days=1)
+MONTHS_AGO = {
+    2: "Two months ago",
+    3: "Three months ago",
+    4: "Four months ago",
+    5: "Five months ago",
+    6: "Six months ago",
+    7: "Seven months ago",
+    8: "Eight months ago",
+    9: "Nine months ago",
+    10: "Ten months ago",
+    11: "Eleven months ago",
+}
 
-    # Define time ranges for yesterday in the specified timezone
-    yesterday_date = current_date - timedelta(days=1)
 
-    five_am_yesterday = yesterday_date.replace(hour=5)
-    twelve_pm_yesterday = yesterday_date.replace(hour=12)
-    five_pm_yesterday = yesterday_date.replace(hour=17)
-    eight_pm_yesterday = yesterday_date.replace(hour=20)
-    midnight_last_night = yesterday_date + timedelta(days=1)
+def _time_ago_from_boundaries(
+    current_time_tz: datetime, previous_time_tz: datetime, boundaries: DayBoundaries
+) -> str:
+    b = boundaries
 
-    # Define last night range (8pm yesterday to 5am today)
-    last_night_start = eight_pm_yesterday
-    last_night_end = five_am_today
+    # Calculate the difference in calendar days
+    diff_days = (current_time_tz.date() - previous_time_tz.date()).days
 
-    # Check "Last night"
-    if last_night_start <= previous_time_tz < last_night_end:
+    # Check "Last night" (8pm yesterday to 5am today)
+    if b.eight_pm_yesterday <= previous_time_tz < b.five_am_today:
         return "Last night"
 
     # Check "Tonight"
-    if eight_pm_today <= previous_time_tz < midnight_tonight:
+    if b.eight_pm_today <= previous_time_tz < b.midnight_tonight:
         return "Tonight"
 
     # Check if previous_time is today
     if diff_days == 0:
-        if five_am_today <= previous_time_tz < twelve_pm_today:
+        if b.five_am_today <= previous_time_tz < b.twelve_pm_today:
             return "This morning"
-        elif twelve_pm_today <= previous_time_tz < five_pm_today:
+        elif b.twelve_pm_today <= previous_time_tz < b.five_pm_today:
             return "This afternoon"
-        elif five_pm_today <= previous_time_tz < eight_pm_today:
+        elif b.five_pm_today <= previous_time_tz < b.eight_pm_today:
             return "This evening"
-        elif eight_pm_today <= previous_time_tz < midnight_tonight:
+        elif b.eight_pm_today <= previous_time_tz < b.midnight_tonight:
             return "Tonight"
-        elif current_date <= previous_time_tz < five_am_today:
+        elif b.current_date <= previous_time_tz < b.five_am_today:
             return "Last night"
     elif diff_days == 1:
-        if five_am_yesterday <= previous_time_tz < twelve_pm_yesterday:
+        if b.five_am_yesterday <= previous_time_tz < b.twelve_pm_yesterday:
             return "Yesterday morning"
-        elif twelve_pm_yesterday <= previous_time_tz < five_pm_yesterday:
+        elif b.twelve_pm_yesterday <= previous_time_tz < b.five_pm_yesterday:
             return "Yesterday afternoon"
-        elif five_pm_yesterday <= previous_time_tz < eight_pm_yesterday:
+        elif b.five_pm_yesterday <= previous_time_tz < b.eight_pm_yesterday:
             return "Yesterday evening"
-        elif eight_pm_yesterday <= previous_time_tz < midnight_last_night:
+        elif b.eight_pm_yesterday <= previous_time_tz < b.midnight_last_night:
             return "Last night"
         else:
             return "Yesterday"
 
-    # Calculate the exact time differences in milliseconds
-    diff_ms = (current_time_tz - previous_time_tz).total_seconds() * 1000
-    diff_days_exact = diff_ms / (1000 * 60 * 60 * 24)
+    # Calculate the exact time difference in days
+    diff_days_exact = (current_time_tz - previous_time_tz).total_seconds() / (
+        60 * 60 * 24
+    )
 
     # Check days ago
     if diff_days == 2:
@@ -515,47 +1062,53 @@ def time_ago(current_time: datetime, previous_time: datetime, time_zone: str) ->
         return "A month ago"
     elif 45 <= diff_days_exact < 60:
         return "A month and a half ago"
-    else:
-        # Calculate months difference more precisely
-        months_difference_exact = diff_days_exact / 30.44  # Average days in a month
-        months_difference = int(months_difference_exact)
-
-        if 2 <= months_difference < 3:
-            return "Two months ago"
-        elif 3 <= months_difference < 4:
-            return "Three months ago"
-        elif 4 <= months_difference < 5:
-            return "Four months ago"
-        elif 5 <= months_difference < 6:
-            return "Five months ago"
-        elif 6 <= months_difference < 7:
-            return "Six months ago"
-        elif 7 <= months_difference < 8:
-            return "Seven months ago"
-        elif 8 <= months_difference < 9:
-            return "Eight months ago"
-        elif 9 <= months_difference < 10:
-            return "Nine months ago"
-        elif 10 <= months_difference < 11:
-            return "Ten months ago"
-        elif 11 <= months_difference < 12:
-            return "Eleven months ago"
-        else:
-            years_difference_exact = diff_days_exact / 365.25  # Average days in a year
-            years_difference = int(years_difference_exact)
-            if years_difference == 1:
-                return "A year ago"
-            elif years_difference >= 2:
-                return f"{years_difference} years ago"
+
+    # Calculate months difference more precisely
+    months_difference = int(diff_days_exact / 30.44)  # Average days in a month
+    if months_difference in MONTHS_AGO:
+        return MONTHS_AGO[months_difference]
+    elif months_difference >= 12:
+        years_difference = int(diff_days_exact / 365.25)  # Average days in a year
+        if years_difference == 1:
+            return "A year ago"
+        elif years_difference >= 2:
+            return f"{years_difference} years ago"
 
     return ""
 
 
-def get_stream_content(stream: Stream[ChatCompletionChunk]) -> str:
-    agent_response = ""
-    for chunk in stream:
+# Formats each previous time relative to the current time, e.g. "Yesterday evening". The timezone
+# and the boundaries of the current day are only computed once for all of the times.
+def time_ago_batch(
+    current_time: datetime, previous_times: List[datetime], time_zone: str
+) -> List[str]:
+    zone_info = fetch_zone_info(time_zone)
+    # Convert times to the specified timezone
+    current_time_tz = current_time.astimezone(zone_info)
+    boundaries = fetch_day_boundaries(
+        time_zone, current_time_tz.date(), current_time_tz.fold
+    )
+    return [
+        _time_ago_from_boundaries(
+            current_time_tz, previous_time.astimezone(zone_info), boundaries
+        )
+        for previous_time in previous_times
+    ]
+
+
+def time_ago(current_time: datetime, previous_time: datetime, time_zone: str) -> str:
+    return time_ago_batch(current_time, [previous_time], time_zone)[0]
+
+
+# Yields the text of each chunk of a chat completion stream
+async def iterate_stream_content(
+    stream: AsyncIterator[ChatCompletionChunk],
+) -> AsyncIterator[str]:
+    async for chunk in stream:
         for choice in chunk.choices:
-            if choice.finish_reason != "stop":
-                content = choice.delta.content
-                agent_response += content
-    return agent_response
+            if choice.finish_reason != "stop" and choice.delta.content:
+                yield choice.delta.content
+
+
+async def get_stream_content(stream: AsyncIterator[ChatCompletionChunk]) -> str:
+    return "".join([content async for content in iterate_stream_content(stream)])
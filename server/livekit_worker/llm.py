@@ -14,7 +14,9 @@ from livekit.plugins.openai.llm import _build_oai_context, LLMStream, ChatModels
 from livekit.agents import llm
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from server.agent.index import generate_response
-from server.api.routes.chat import final_processing_coroutine, stream_and_update_chat
+from server.api.constants import LLM as CONVERSATION_LLM
+from server.api.utils import TurnContext
+from server.api.routes.chat import stream_and_update_chat
 from typing import Any, Coroutine
 from dataclasses import dataclass
 from server.logger.index import fetch_logger
@@ -33,13 +35,6 @@ class AsyncStream:
         await self._async_gen.aclose()
 
 
-def get_next_item(it):
-    try:
-        return next(it)
-    except StopIteration:
-        return None
-
-
 def convert_stream_to_coroutine(
     messages,
     chat_id,
@@ -51,31 +46,22 @@ def convert_stream_to_coroutine(
     audio_messages_enabled: bool,
 ) -> Coroutine[Any, Any, "AsyncStream[ChatCompletionChunk]"]:
     async def wrapper():
-        sync_gen = stream_and_update_chat(
-            messages=messages,
-            chat_id=chat_id,
-            user_id=user_id,
-            chat_type="voice",
-            timezone=timezone,
-            ai_first_name=ai_first_name,
-            user_first_name=user_first_name,
-            user_gender=user_gender,
-            audio_messages_enabled=audio_messages_enabled,
-            audio_id=None,
+        # `stream_and_update_chat` is an async generator, so it's consumed on the worker's event
+        # loop directly instead of pulling each chunk through a thread
+        return AsyncStream(
+            stream_and_update_chat(
+                turn=TurnContext(messages, model=CONVERSATION_LLM),
+                chat_id=chat_id,
+                user_id=user_id,
+                chat_type="voice",
+                timezone=timezone,
+                ai_first_name=ai_first_name,
+                user_first_name=user_first_name,
+                user_gender=user_gender,
+                audio_messages_enabled=audio_messages_enabled,
+                audio_id=None,
+            )
         )
-        it = iter(sync_gen)
-
-        async def async_gen():
-            while True:
-                # Use a helper function to handle StopIteration
-                s = await asyncio.get_event_loop().run_in_executor(
-                    None, get_next_item, it
-                )
-                if s is None:
-                    break
-                yield s
-
-        return AsyncStream(async_gen())
 
     return wrapper()
 
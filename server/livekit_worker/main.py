@@ -18,12 +18,24 @@ from livekit.plugins import openai, deepgram, silero, elevenlabs
 from pydub import AudioSegment
 from livekit import rtc
 from server.livekit_worker.llm import LLM
+from server.api.routes.chat import post_turn_jobs
+from server.api.constants import LLM as CONVERSATION_LLM
+from server.api.tokenizers import fetch_encoding, prewarm_encodings
+from server.api.database import close_prisma, fetch_prisma
+from server.api.mem0 import mem0_client_manager
+from server.api.utils import (
+    count_tokens_for_message,
+    prefetch_memories,
+    seed_message_token_count,
+)
 import sys
 from pathlib import Path
 from fastapi import HTTPException, status
 from datetime import datetime
 from sentry_sdk.integrations.asyncio import AsyncioIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
+from .stt import PrefetchingSTT
+from .tts import CachingTTS
 from .voices import VoiceSettingMapping
 from server.logger.index import fetch_logger
 from dotenv import load_dotenv
@@ -50,9 +62,15 @@ sys.path.insert(0, str(parent_dir))
 
 logger = fetch_logger()
 
+# The number of recent messages used to build memory search queries from interim transcripts. Search
+# queries only use the last few messages, see `TurnContext.search_query_window`.
+MEMORY_PREFETCH_HISTORY_SIZE = 16
+
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    prewarm_encodings()
+    mem0_client_manager.start()
 
 
 def fetch_initial_chat_message(user_name: str):
@@ -102,16 +120,31 @@ async def get_chat(user_id: str, user_name: str, agent_name: str, display_type:
             chat_id,
         )
 
+        # Use the token counts that were stored when the messages were written so that truncating
+        # the chat history doesn't need to re-encode it.
+        encoding = fetch_encoding(CONVERSATION_LLM)
+        for message in messages:
+            seed_message_token_count(
+                role=message["role"],
+                content=message["content"],
+                token_count=message["token_count"],
+                token_encoding=message["token_encoding"],
+                encoding=encoding,
+            )
+
         if len(messages) == 0:
             message_id = str(uuid.uuid4())
             first_chat_message = fetch_initial_chat_message(user_name=user_name)
             message_role = "assistant"
             created = datetime.now()
             modified = datetime.now()
+            token_count = count_tokens_for_message(
+                {"role": message_role, "content": first_chat_message}, encoding
+            )
             await conn.fetch(
                 """
-                INSERT INTO chat_messages (id, chat_id, content, role, created, modified, display_type)
-                VALUES ($1, $2, $3, $4, $5, $6, $7);
+                INSERT INTO chat_messages (id, chat_id, content, role, created, modified, display_type, token_count, token_encoding)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9);
                 """,
                 message_id,
                 chat_id,
@@ -120,6 +153,8 @@ async def get_chat(user_id: str, user_name: str, agent_name: str, display_type:
                 created,
                 modified,
                 display_type,
+                token_count,
+                encoding.name,
             )
             send_first_chat_message = True
 
@@ -139,6 +174,10 @@ async def get_chat(user_id: str, user_name: str, agent_name: str, display_type:
 
 
 async def entrypoint(ctx: JobContext):
+    # Run the post-turn jobs left by earlier jobs. When the job ends, finish this session's jobs.
+    post_turn_jobs.start()
+    ctx.add_shutdown_callback(post_turn_jobs.drain)
+    ctx.add_shutdown_callback(close_prisma)
 
     logger.info(f"Connecting to room {ctx.room.name}")
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
@@ -158,9 +197,13 @@ async def entrypoint(ctx: JobContext):
     # Fetch the detailed voice settings
     voice_settings = VoiceSettingMapping[voice]
 
-    # Fetch chat data asynchronously
-    chat, send_first_chat_message, first_chat_message = await get_chat(
-        user_id=user_id, agent_name=agent_name, user_name=name, display_type="text"
+    # Fetch chat data asynchronously, and connect the database client the session's turns are saved
+    # with so the first turn doesn't wait for it
+    (chat, send_first_chat_message, first_chat_message), _ = await asyncio.gather(
+        get_chat(
+            user_id=user_id, agent_name=agent_name, user_name=name, display_type="text"
+        ),
+        fetch_prisma(),
     )
 
     chat_messages = [
@@ -173,9 +216,24 @@ async def entrypoint(ctx: JobContext):
 
     initial_ctx = llm.ChatContext(messages=chat_messages)
 
+    # Start searching memories from the interim transcripts, while the user is still speaking
+    def prefetch_memories_for_transcript(transcript: str):
+        history = [
+            {"role": message.role, "content": message.content}
+            for message in assistant.chat_ctx.messages[-MEMORY_PREFETCH_HISTORY_SIZE:]
+            if isinstance(message.content, str)
+        ]
+        prefetch_memories(
+            messages=history + [{"role": "user", "content": transcript}],
+            user_id=user_id,
+            model=CONVERSATION_LLM,
+        )
+
+    stt = PrefetchingSTT(deepgram.STT(), on_transcript=prefetch_memories_for_transcript)
+
     assistant = VoicePipelineAgent(
         vad=ctx.proc.userdata["vad"],
-        stt=deepgram.STT(),
+        stt=stt,
         llm=LLM(
             user_id=participant.identity,
             chat_id=chat_id,
@@ -185,25 +243,31 @@ async def entrypoint(ctx: JobContext):
             timezone=timezone,
         ),
         preemptive_synthesis=True,
-        tts=elevenlabs.TTS(
-            model_id=voice_settings.model,
-            voice=elevenlabs.Voice(
-                id=voice_settings.voice_id,
-                name=agent_name,
-                category="premade",
-                settings=elevenlabs.VoiceSettings(
-                    stability=voice_settings.stability,
-                    similarity_boost=voice_settings.similarity,
-                    style=voice_settings.style,
-                    use_speaker_boost=voice_settings.speaker_boost,
+        # Text the agent has said before, like the first message of a session, is served from the TTS
+        # cache
+        tts=CachingTTS(
+            elevenlabs.TTS(
+                model_id=voice_settings.model,
+                voice=elevenlabs.Voice(
+                    id=voice_settings.voice_id,
+                    name=agent_name,
+                    category="premade",
+                    settings=elevenlabs.VoiceSettings(
+                        stability=voice_settings.stability,
+                        similarity_boost=voice_settings.similarity,
+                        style=voice_settings.style,
+                        use_speaker_boost=voice_settings.speaker_boost,
+                    ),
                 ),
+                api_key=os.environ.get("ELEVEN_LABS_API_KEY"),
             ),
-            api_key=os.environ.get("ELEVEN_LABS_API_KEY"),
+            voice_settings,
         ),
         min_endpointing_delay=1,
         chat_ctx=initial_ctx,
     )
 
+    assistant.on("user_speech_committed", lambda _: stt.reset())
     assistant.start(ctx.room, participant)
 
     if send_first_chat_message:
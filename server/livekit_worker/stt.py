@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from typing import Callable, List
+
+from livekit.agents import stt
+from livekit.agents.utils import AudioBuffer
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+
+# Wraps an STT to report the user's transcript as it's being recognized, including interim
+# transcripts. `VoicePipelineAgent` only calls the LLM once a final transcript arrives, and doesn't
+# expose interim transcripts, so this is where memory searches can start while the user is still
+# speaking.
+#
+# The transcript passed to `on_transcript` is every final transcript since the last `reset`, plus
+# the current interim transcript, which is what the agent will commit as the user's message.
+class PrefetchingSTT(stt.STT):
+    def __init__(self, wrapped: stt.STT, on_transcript: Callable[[str], None]):
+        super().__init__(capabilities=wrapped.capabilities)
+        self._wrapped = wrapped
+        self._on_transcript = on_transcript
+        self._final_transcripts: List[str] = []
+
+    async def recognize(
+        self, buffer: AudioBuffer, *, language: str | None = None
+    ) -> stt.SpeechEvent:
+        return await self._wrapped.recognize(buffer, language=language)
+
+    def stream(self, *, language: str | None = None) -> "PrefetchingSpeechStream":
+        return PrefetchingSpeechStream(self, self._wrapped.stream(language=language))
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+    # Called when the agent commits the user's message, so the next transcript starts empty
+    def reset(self) -> None:
+        self._final_transcripts = []
+
+    def _on_event(self, event: stt.SpeechEvent) -> None:
+        if not event.alternatives or not event.alternatives[0].text:
+            return
+
+        text = event.alternatives[0].text
+        if event.type == stt.SpeechEventType.FINAL_TRANSCRIPT:
+            self._final_transcripts.append(text)
+            transcript = " ".join(self._final_transcripts)
+        elif event.type == stt.SpeechEventType.INTERIM_TRANSCRIPT:
+            transcript = " ".join(self._final_transcripts + [text])
+        else:
+            return
+
+        try:
+            self._on_transcript(transcript)
+        except Exception as e:
+            # Prefetching is an optimization, so it must never interrupt recognition
+            logger.error(e, exc_info=True)
+
+
+# Forwards everything to the wrapped stream and reports each event to the `PrefetchingSTT`
+class PrefetchingSpeechStream:
+    def __init__(self, owner: PrefetchingSTT, wrapped: stt.SpeechStream):
+        self._owner = owner
+        self._wrapped = wrapped
+
+    def push_frame(self, frame) -> None:
+        self._wrapped.push_frame(frame)
+
+    def flush(self) -> None:
+        self._wrapped.flush()
+
+    def end_input(self) -> None:
+        self._wrapped.end_input()
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+    def __aiter__(self) -> "PrefetchingSpeechStream":
+        return self
+
+    async def __anext__(self) -> stt.SpeechEvent:
+        event = await self._wrapped.__anext__()
+        self._owner._on_event(event)
+        return event
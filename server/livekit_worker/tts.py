@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import List
+
+from livekit import rtc
+from livekit.agents import tts, utils
+from server.api.tts_cache import TTSCache, tts_cache, tts_cache_key
+from server.livekit_worker.voices import VoiceSettings
+from server.logger.index import fetch_logger
+
+logger = fetch_logger()
+
+# The length of the frames cached audio is replayed in
+CACHED_FRAME_MILLISECONDS = 100
+
+
+# Wraps a TTS to serve text it has synthesized before from `tts_cache`, without calling the wrapped
+# TTS. This covers the text the agent is given whole, like the first message of a session
+# (`VoicePipelineAgent.say`). Replies streamed from the LLM are synthesized as their text arrives,
+# before the whole text is known, so they're passed to the wrapped TTS as they are.
+#
+# Audio is cached as the PCM the wrapped TTS produces, so the key includes its sample rate and
+# number of channels.
+class CachingTTS(tts.TTS):
+    def __init__(
+        self,
+        wrapped: tts.TTS,
+        voice_settings: VoiceSettings,
+        cache: TTSCache = tts_cache,
+    ):
+        super().__init__(
+            capabilities=wrapped.capabilities,
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self._voice_settings = voice_settings
+        self._cache = cache
+
+    @property
+    def audio_format(self) -> str:
+        return f"pcm_{self.sample_rate}_{self.num_channels}"
+
+    def synthesize(self, text: str) -> "CachingChunkedStream":
+        return CachingChunkedStream(self, text)
+
+    def stream(self) -> tts.SynthesizeStream:
+        return self._wrapped.stream()
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+
+class CachingChunkedStream(tts.ChunkedStream):
+    def __init__(self, caching_tts: CachingTTS, text: str):
+        self._tts = caching_tts
+        self._text = text
+        super().__init__()
+
+    async def _main_task(self) -> None:
+        caching_tts = self._tts
+        key = tts_cache_key(
+            caching_tts._voice_settings, self._text, caching_tts.audio_format
+        )
+        try:
+            cached = await caching_tts._cache.get(key)
+        except Exception as e:
+            # The cache is an optimization, so a broken cache must never stop the agent speaking
+            logger.error(e, exc_info=True)
+            cached = None
+
+        if cached is not None:
+            self._send_cached_audio(cached)
+            return
+
+        pcm: List[bytes] = []
+        async for audio in caching_tts._wrapped.synthesize(self._text):
+            pcm.append(bytes(audio.frame.data))
+            self._event_ch.send_nowait(audio)
+
+        try:
+            await caching_tts._cache.set(key, b"".join(pcm))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    def _send_cached_audio(self, pcm: bytes) -> None:
+        sample_rate = self._tts.sample_rate
+        num_channels = self._tts.num_channels
+        # 16 bit samples
+        bytes_per_frame = (
+            sample_rate * CACHED_FRAME_MILLISECONDS // 1000 * num_channels * 2
+        )
+        request_id = utils.shortuuid()
+        for start in range(0, len(pcm), bytes_per_frame):
+            data = pcm[start : start + bytes_per_frame]
+            self._event_ch.send_nowait(
+                tts.SynthesizedAudio(
+                    request_id=request_id,
+                    segment_id=request_id,
+                    frame=rtc.AudioFrame(
+                        data=data,
+                        sample_rate=sample_rate,
+                        num_channels=num_channels,
+                        samples_per_channel=len(data) // (num_channels * 2),
+                    ),
+                )
+            )
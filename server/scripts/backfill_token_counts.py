@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+import asyncpg
+from dotenv import load_dotenv
+
+from server.api.constants import LLM
+from server.api.tokenizers import fetch_encoding
+from server.api.utils import count_tokens_for_message
+
+load_dotenv()
+
+BATCH_SIZE = 1000
+
+
+# Fills in `token_count` and `token_encoding` for chat messages that were written before token
+# counts were stored, or that were counted with a different encoding than the current one. Safe to
+# re-run; each batch only selects rows that still need a count.
+#
+# Usage: python -m server.scripts.backfill_token_counts
+async def backfill_token_counts():
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise Exception("DATABASE_URL environment variable not set")
+
+    encoding = fetch_encoding(LLM)
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+
+    num_updated = 0
+    try:
+        while True:
+            rows = await conn.fetch(
+                """
+                SELECT id, role, content
+                FROM chat_messages
+                WHERE token_count IS NULL OR token_encoding IS DISTINCT FROM $1
+                LIMIT $2
+                """,
+                encoding.name,
+                BATCH_SIZE,
+            )
+            if len(rows) == 0:
+                break
+
+            ids = [row["id"] for row in rows]
+            token_counts = [
+                count_tokens_for_message(
+                    {"role": row["role"], "content": row["content"]}, encoding
+                )
+                for row in rows
+            ]
+
+            await conn.execute(
+                """
+                UPDATE chat_messages
+                SET token_count = data.token_count, token_encoding = $3
+                FROM unnest($1::text[], $2::int[]) AS data(id, token_count)
+                WHERE chat_messages.id = data.id
+                """,
+                ids,
+                token_counts,
+                encoding.name,
+            )
+
+            num_updated += len(rows)
+            print(f"Backfilled token counts for {num_updated} messages")
+    finally:
+        await conn.close()
+
+    print(f"Done. Backfilled token counts for {num_updated} messages")
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_token_counts())
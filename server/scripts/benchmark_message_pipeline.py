@@ -0,0 +1,135 @@
+import copy
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from server.api.constants import LLM
+from server.api.utils import add_system_prompts, get_final_messages_by_token_limit
+
+# Measures the memory allocated per turn by the message pipeline in `generate_response` (adding the
+# system prompts, truncating to the token limit and taking the last 2048 messages) with the previous
+# deep-copying implementation and with the `MessageView` implementation.
+#
+# Usage: python -m server.scripts.benchmark_message_pipeline
+
+NUM_MESSAGES = [500, 2000, 8000]
+NUM_MEMORIES = 25
+
+
+# Counts one token per word. The benchmark measures copying rather than tokenization, and the token
+# counts are cached after the warm-up turn either way, so a real tiktoken encoding isn't needed.
+class WordEncoding:
+    name = "benchmark-words"
+
+    def encode_ordinary(self, text: str) -> List[str]:
+        return text.split()
+
+    def encode_ordinary_batch(self, texts: List[str]) -> List[List[str]]:
+        return [text.split() for text in texts]
+
+
+def build_messages(num_messages: int) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"This is message number {i} in a fairly long conversation. "
+            * 3,
+        }
+        for i in range(num_messages)
+    ]
+
+
+def build_memories() -> List[Dict[str, Any]]:
+    return [
+        {
+            "memory": f"User mentioned fact number {i}",
+            "updated_at": None,
+            "created_at": None,
+        }
+        for i in range(NUM_MEMORIES)
+    ]
+
+
+def deep_copy_pipeline(messages, memories, encoding):
+    # The implementation before `MessageView`: both steps deep-copy the full chat history
+    messages_with_system_prompts = copy.deepcopy(
+        add_system_prompts(
+            messages=messages,
+            ai_first_name="Charlotte",
+            user_first_name="Sam",
+            user_gender="male",
+            timezone="America/New_York",
+            memories=memories,
+            preferences=[],
+        ).to_list()
+    )
+    truncated_messages = copy.deepcopy(
+        get_final_messages_by_token_limit(
+            messages=messages_with_system_prompts,
+            model=LLM,
+            encoding=encoding,
+            token_limit=125000,
+        )
+    )
+    return truncated_messages[-2048:]
+
+
+def view_pipeline(messages, memories, encoding):
+    messages_with_system_prompts = add_system_prompts(
+        messages=messages,
+        ai_first_name="Charlotte",
+        user_first_name="Sam",
+        user_gender="male",
+        timezone="America/New_York",
+        memories=memories,
+        preferences=[],
+    )
+    truncated_messages = get_final_messages_by_token_limit(
+        messages=messages_with_system_prompts,
+        model=LLM,
+        encoding=encoding,
+        token_limit=125000,
+    )
+    return truncated_messages[-2048:].to_list()
+
+
+def measure(pipeline: Callable, messages, memories, encoding) -> Dict[str, int]:
+    # Warm up the token count cache so only the pipeline's own allocations are measured
+    pipeline(messages, memories, encoding)
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    result = pipeline(messages, memories, encoding)
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = snapshot_after.compare_to(snapshot_before, "filename")
+    return {
+        "retained_blocks": sum(max(stat.count_diff, 0) for stat in stats),
+        "peak_bytes": peak,
+        "num_messages_sent": len(result),
+    }
+
+
+def main():
+    encoding = WordEncoding()
+    memories = build_memories()
+    for num_messages in NUM_MESSAGES:
+        messages = build_messages(num_messages)
+        deep_copy_stats = measure(deep_copy_pipeline, messages, memories, encoding)
+        view_stats = measure(view_pipeline, messages, memories, encoding)
+        assert deep_copy_stats["num_messages_sent"] == view_stats["num_messages_sent"]
+
+        print(f"{num_messages} messages:")
+        print(
+            f"  deepcopy:     peak {deep_copy_stats['peak_bytes'] / 1024:10.1f} KiB, "
+            f"{deep_copy_stats['retained_blocks']} blocks retained"
+        )
+        print(
+            f"  MessageView:  peak {view_stats['peak_bytes'] / 1024:10.1f} KiB, "
+            f"{view_stats['retained_blocks']} blocks retained"
+        )
+
+
+if __name__ == "__main__":
+    main()
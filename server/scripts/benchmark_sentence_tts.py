@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from typing import AsyncIterator, Tuple
+
+import httpx
+import uvicorn
+from aiohttp import web
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from server.api.audio import stream_speech
+from server.api.audio_messages import audio_message_response, start_audio_message
+from server.api.constants import LLM, SUPABASE_AUDIO_MESSAGES_BUCKET_NAME
+from server.api.llm import fetch_openai
+from server.api.multipart import MULTIPART_MIXED, new_boundary, stream_multipart
+from server.api.utils import iterate_stream_content
+from server.livekit_worker.voices import CharlotteSettings
+
+# Compares how long the client of /api/chat waits for the first audio of an audio message, and for
+# the whole response, measured from the HTTP response of a local server:
+#   sequential  the whole reply is written, then synthesized, as the audio branch did at first
+#   text-first  the reply is synthesized sentence by sentence as it streams, but the response
+#               starts with its text, so it waits for the whole reply
+#   pipelined   the response starts with the audio ID and the text comes last
+#               (`audio_message_response`), so the first audio is sent as soon as it's synthesized
+#
+# The LLM, ElevenLabs and storage are a local fake server. The LLM streams `--sentences` sentences of
+# `--words` words, `--word-delay` seconds apart. Text-to-speech starts streaming audio after
+# `--tts-latency` seconds and takes `--tts-delay-per-character` seconds per character, so it's
+# slower for longer text, like the real API.
+#
+# Usage:
+#   python -m server.scripts.benchmark_sentence_tts --replies 20 --sentences 5 --words 12
+
+MESSAGES = [{"role": "user", "content": "How was your day?"}]
+# The size of each fake audio chunk, about 0.1 seconds of 128 kbps MP3
+AUDIO_CHUNK_SIZE = 1600
+
+
+class FakeServer:
+    def __init__(
+        self,
+        num_sentences: int,
+        words_per_sentence: int,
+        word_delay: float,
+        tts_latency: float,
+        tts_delay_per_character: float,
+    ):
+        self.num_sentences = num_sentences
+        self.words_per_sentence = words_per_sentence
+        self.word_delay = word_delay
+        self.tts_latency = tts_latency
+        self.tts_delay_per_character = tts_delay_per_character
+        self.num_replies = 0
+
+    def chunk(self, content=None, finish_reason=None) -> bytes:
+        data = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": LLM,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {} if content is None else {"content": content},
+                    "finish_reason": finish_reason,
+                }
+            ],
+        }
+        return f"data: {json.dumps(data)}\n\n".encode()
+
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        # Every reply is different, so none of its audio is in the TTS cache
+        self.num_replies += 1
+        for sentence in range(self.num_sentences):
+            for word in range(self.words_per_sentence):
+                await asyncio.sleep(self.word_delay)
+                end = "." if word == self.words_per_sentence - 1 else ""
+                content = f"reply{self.num_replies}" if word == 0 else f"word{word}"
+                await response.write(self.chunk(content=f"{content}{end} "))
+        await response.write(self.chunk(finish_reason="stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def handle_speech(self, request: web.Request) -> web.StreamResponse:
+        text = (await request.json())["text"]
+        await asyncio.sleep(self.tts_latency)
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        await response.prepare(request)
+        # Audio is streamed in a few chunks over the time it takes to synthesize the text
+        num_chunks = max(1, len(text) // 20)
+        for _ in range(num_chunks):
+            await asyncio.sleep(len(text) * self.tts_delay_per_character / num_chunks)
+            await response.write(b"\xff" * AUDIO_CHUNK_SIZE)
+        await response.write_eof()
+        return response
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"Key": request.match_info["path"]})
+
+    async def start(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_completions)
+        app.router.add_post("/v1/text-to-speech/{voice_id}/stream", self.handle_speech)
+        app.router.add_post(
+            f"/storage/v1/object/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{{path}}",
+            self.handle_upload,
+        )
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+        os.environ["OPENAI_API_KEY"] = "fake"
+        os.environ["ELEVEN_LABS_BASE_URL"] = f"http://127.0.0.1:{port}"
+        os.environ["ELEVEN_LABS_API_KEY"] = "fake"
+        os.environ["EXPO_PUBLIC_SUPABASE_URL"] = f"http://127.0.0.1:{port}"
+        os.environ["SUPABASE_SECRET_KEY"] = "fake"
+        return runner
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    async def stream_reply() -> AsyncIterator[str]:
+        stream = await fetch_openai().chat.completions.create(
+            messages=MESSAGES, model=LLM, stream=True
+        )
+        async for content in iterate_stream_content(stream):
+            yield content
+
+    def stream_text_first(text: str, audio: AsyncIterator[bytes]) -> StreamingResponse:
+        boundary = new_boundary()
+        return StreamingResponse(
+            stream_multipart(
+                [
+                    (
+                        {"Content-Type": "application/json"},
+                        json.dumps({"text": text}).encode(),
+                    ),
+                    ({"Content-Type": "audio/mpeg"}, audio),
+                ],
+                boundary,
+            ),
+            media_type=f"{MULTIPART_MIXED}; boundary={boundary}",
+        )
+
+    @app.post("/sequential")
+    async def sequential():
+        text = "".join([content async for content in stream_reply()])
+        return stream_text_first(text, stream_speech(text, CharlotteSettings))
+
+    @app.post("/text-first")
+    async def text_first():
+        speech, _, reply_done = start_audio_message(
+            stream_reply(), str(uuid.uuid4()), CharlotteSettings
+        )
+        return stream_text_first(await reply_done, speech)
+
+    @app.post("/pipelined")
+    async def pipelined():
+        audio_id = str(uuid.uuid4())
+        speech, upload, reply_done = start_audio_message(
+            stream_reply(), audio_id, CharlotteSettings
+        )
+        return await audio_message_response(
+            audio_id, speech, upload, reply_done, accept=MULTIPART_MIXED
+        )
+
+    return app
+
+
+# Times a request from when it's sent to when the first byte of the audio part arrives, and to the
+# end of the response
+async def time_request(client: httpx.AsyncClient, path: str) -> Tuple[float, float]:
+    start_time = time.perf_counter()
+    first_audio_time = None
+    body = b""
+    async with client.stream("POST", path) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            body += chunk
+            audio_headers = body.find(b"Content-Type: audio/mpeg")
+            if first_audio_time is None and audio_headers != -1:
+                audio_start = body.find(b"\r\n\r\n", audio_headers)
+                if audio_start != -1 and len(body) > audio_start + 4:
+                    first_audio_time = time.perf_counter() - start_time
+    return first_audio_time, time.perf_counter() - start_time
+
+
+async def measure(client: httpx.AsyncClient, path: str, num_replies: int):
+    times = await asyncio.gather(
+        *(time_request(client, path) for _ in range(num_replies))
+    )
+    first_audio_times = [first_audio_time for first_audio_time, _ in times]
+    total_times = [total_time for _, total_time in times]
+
+    print(
+        f"{path[1:]:10} first audio p50 {statistics.median(first_audio_times):5.2f}s  "
+        f"max {max(first_audio_times):5.2f}s  "
+        f"total p50 {statistics.median(total_times):5.2f}s  max {max(total_times):5.2f}s"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replies", type=int, default=20)
+    parser.add_argument("--sentences", type=int, default=5)
+    parser.add_argument("--words", type=int, default=12)
+    parser.add_argument("--word-delay", type=float, default=0.03)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--tts-delay-per-character", type=float, default=0.004)
+    args = parser.parse_args()
+
+    fake_server = FakeServer(
+        args.sentences,
+        args.words,
+        args.word_delay,
+        args.tts_latency,
+        args.tts_delay_per_character,
+    )
+    runner = await fake_server.start()
+    server = uvicorn.Server(
+        uvicorn.Config(
+            build_app(), host="127.0.0.1", port=0, lifespan="off", log_level="warning"
+        )
+    )
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=None
+        ) as client:
+            for path in ["/sequential", "/text-first", "/pipelined"]:
+                await measure(client, path, args.replies)
+    finally:
+        server.should_exit = True
+        await serving
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, List
+
+from dotenv import load_dotenv
+from prisma import Prisma, enums, types
+
+from server.api.chat_turns import ChatTurn
+from server.api.database import create_prisma
+from server.api.persistence import save_chat_turns
+
+load_dotenv()
+
+# Compares the latency of saving chat turns with the previous three statements in a transaction
+# (two `chatmessages.create` calls and a `chats.update`) and with `save_chat_turns`, which writes
+# one statement per batch of turns. Run it against a local database: the messages it writes are
+# deleted when it finishes.
+#
+# Usage:
+#   python -m server.scripts.benchmark_turn_writes --chat-id <chat id> --iterations 100 \
+#     --batch-size 20
+
+CONTENT_PREFIX = "benchmark-turn-writes"
+
+
+def build_turn(chat_id: str) -> ChatTurn:
+    return ChatTurn(
+        chat_id=chat_id,
+        user_message=f"{CONTENT_PREFIX} How was your day?",
+        agent_message=f"{CONTENT_PREFIX} It was great, thanks for asking!",
+        user_message_timestamp=datetime.now(),
+        agent_message_timestamp=datetime.now(),
+    )
+
+
+async def save_turn_in_transaction(prisma: Prisma, turn: ChatTurn):
+    async with prisma.tx() as transaction:
+        await transaction.chatmessages.create(
+            data=types.ChatMessagesCreateInput(
+                chatId=turn.chat_id,
+                role=enums.OpenAIRole.user,
+                content=turn.user_message,
+                created=turn.user_message_timestamp,
+                displayType="text",
+            )
+        )
+        await transaction.chatmessages.create(
+            data=types.ChatMessagesCreateInput(
+                chatId=turn.chat_id,
+                role=enums.OpenAIRole.assistant,
+                content=turn.agent_message,
+                created=turn.agent_message_timestamp,
+                displayType="text",
+            )
+        )
+        await transaction.chats.update(
+            where={"id": turn.chat_id},
+            data=types.ChatsUpdateInput(lastMessageTime=datetime.now()),
+        )
+
+
+async def measure(
+    name: str, write: Callable[[], Awaitable[None]], iterations: int, num_turns: int
+):
+    latencies: List[float] = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        await write()
+        latencies.append(time.perf_counter() - start_time)
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:28} p50 {quantiles[49] * 1000:7.2f}ms  p95 {quantiles[94] * 1000:7.2f}ms  "
+        f"{quantiles[49] * 1000 / num_turns:7.2f}ms per turn"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat-id", required=True)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+
+    prisma = create_prisma()
+    await prisma.connect()
+    try:
+        batch = [build_turn(args.chat_id) for _ in range(args.batch_size)]
+
+        async def transaction_batch():
+            for turn in batch:
+                await save_turn_in_transaction(prisma, turn)
+
+        await measure(
+            "transaction, 1 turn",
+            lambda: save_turn_in_transaction(prisma, build_turn(args.chat_id)),
+            args.iterations,
+            1,
+        )
+        await measure(
+            "single statement, 1 turn",
+            lambda: save_chat_turns(prisma, [build_turn(args.chat_id)]),
+            args.iterations,
+            1,
+        )
+        await measure(
+            f"transaction, {args.batch_size} turns",
+            transaction_batch,
+            args.iterations,
+            args.batch_size,
+        )
+        await measure(
+            f"single statement, {args.batch_size} turns",
+            lambda: save_chat_turns(prisma, batch),
+            args.iterations,
+            args.batch_size,
+        )
+    finally:
+        await prisma.chatmessages.delete_many(
+            where={"content": {"startswith": CONTENT_PREFIX}}
+        )
+        await prisma.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
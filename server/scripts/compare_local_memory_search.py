@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from mem0 import AsyncMemoryClient
+
+from server.api.mem0 import MEMORY_SEARCH_TOP_K, search_local_memories
+from server.api.memory_index import MemoryIndex
+
+load_dotenv()
+
+DEFAULT_MIN_SCORES = [0, 2, 4, 6, 8, 10]
+
+
+# Compares the local BM25 memory search with mem0's search on recorded queries, to choose
+# `LOCAL_MEMORY_SEARCH_MIN_SCORE`. For each threshold it reports how many queries would be answered
+# locally and the recall of mem0's results among the local results, both for the queries answered
+# locally and overall (counting fallbacks to mem0 as full recall).
+#
+# Record queries first (one query per line in the queries file; the search queries logged by
+# `search_memories` work well):
+#   python -m server.scripts.compare_local_memory_search record --user-id <id> \
+#     --queries queries.txt --output recorded.jsonl
+#
+# Then compare:
+#   python -m server.scripts.compare_local_memory_search compare recorded.jsonl
+async def record(user_id: str, queries_path: str, output_path: str):
+    mem0 = AsyncMemoryClient(api_key=os.environ.get("MEM0_API_KEY"))
+    memories = await mem0.get_all(filters={"user_id": user_id}, version="v2")
+
+    with open(queries_path) as queries_file:
+        queries = [line.strip() for line in queries_file if line.strip()]
+
+    with open(output_path, "a") as output_file:
+        for query in queries:
+            results = await mem0.search(
+                query=query,
+                top_k=MEMORY_SEARCH_TOP_K,
+                rerank=True,
+                filters={"user_id": user_id},
+                version="v2",
+            )
+            output_file.write(
+                json.dumps(
+                    {
+                        "user_id": user_id,
+                        "query": query,
+                        "memories": memories,
+                        "results": results,
+                    }
+                )
+                + "\n"
+            )
+    print(f"Recorded {len(queries)} queries for user {user_id}")
+
+
+def recall(local_results: List[Dict[str, Any]], remote_results: List[Dict[str, Any]]):
+    remote_ids = {memory["id"] for memory in remote_results}
+    if not remote_ids:
+        return 1.0
+    local_ids = {memory["id"] for memory in local_results}
+    return len(remote_ids & local_ids) / len(remote_ids)
+
+
+def compare(recorded_path: str, min_scores: List[float]):
+    with open(recorded_path) as recorded_file:
+        cases = [json.loads(line) for line in recorded_file if line.strip()]
+
+    # Build each user's index once, like the server does
+    indexes: Dict[str, MemoryIndex] = {}
+    for case in cases:
+        if case["user_id"] not in indexes:
+            indexes[case["user_id"]] = MemoryIndex(case["memories"])
+
+    print(f"{len(cases)} queries, {len(indexes)} users")
+    for min_score in min_scores:
+        local_recalls = []
+        overall_recalls = []
+        latencies = []
+        for case in cases:
+            start_time = time.perf_counter()
+            local_results = search_local_memories(
+                indexes[case["user_id"]], case["query"], min_score=min_score
+            )
+            latencies.append(time.perf_counter() - start_time)
+
+            if local_results is None:
+                overall_recalls.append(1.0)
+                continue
+            case_recall = recall(local_results, case["results"])
+            local_recalls.append(case_recall)
+            overall_recalls.append(case_recall)
+
+        print(
+            f"min score {min_score:5.1f}: "
+            f"{len(local_recalls) / len(cases):6.1%} answered locally, "
+            f"local recall {statistics.mean(local_recalls) if local_recalls else 0:6.1%}, "
+            f"overall recall {statistics.mean(overall_recalls):6.1%}, "
+            f"p50 latency {statistics.median(latencies) * 1000:.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("--user-id", required=True)
+    record_parser.add_argument("--queries", required=True)
+    record_parser.add_argument("--output", required=True)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("recorded")
+    compare_parser.add_argument(
+        "--min-scores", type=float, nargs="+", default=DEFAULT_MIN_SCORES
+    )
+
+    args = parser.parse_args()
+    if args.command == "record":
+        asyncio.run(record(args.user_id, args.queries, args.output))
+    else:
+        compare(args.recorded, args.min_scores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Awaitable, Callable, List
+
+from aiohttp import web
+from openai import OpenAI
+from starlette.concurrency import iterate_in_threadpool
+
+import server.agent.index
+from server.api.constants import LLM
+from server.api.routes.chat import stream_and_update_chat
+from server.api.utils import TurnContext
+
+# Compares how many chat streams the API can serve at once with the async pipeline
+# (`stream_and_update_chat` on `AsyncOpenAI`) and with the previous design, a synchronous generator
+# on the sync `OpenAI` client that Starlette iterates in its threadpool (40 threads by default).
+#
+# The LLM is a local fake OpenAI server that streams `--chunks` chunks, `--chunk-delay` seconds
+# apart, and records the largest number of streams it served at once. Memory retrieval is replaced
+# with empty results because it isn't part of what's being measured.
+#
+# Usage:
+#   python -m server.scripts.load_test_chat_stream --streams 200 --chunks 20 --chunk-delay 0.05
+
+MESSAGES = [{"role": "user", "content": "How was your day?"}]
+
+
+class FakeOpenAIServer:
+    def __init__(self, num_chunks: int, chunk_delay: float):
+        self.num_chunks = num_chunks
+        self.chunk_delay = chunk_delay
+        self.open_streams = 0
+        self.peak_open_streams = 0
+
+    def chunk(self, content=None, finish_reason=None) -> bytes:
+        data = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": LLM,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {} if content is None else {"content": content},
+                    "finish_reason": finish_reason,
+                }
+            ],
+        }
+        return f"data: {json.dumps(data)}\n\n".encode()
+
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        self.open_streams += 1
+        self.peak_open_streams = max(self.peak_open_streams, self.open_streams)
+        try:
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for i in range(self.num_chunks):
+                await asyncio.sleep(self.chunk_delay)
+                await response.write(self.chunk(content=f"word{i} "))
+            await response.write(self.chunk(finish_reason="stop"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            self.open_streams -= 1
+
+    async def start(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle_completions)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+        os.environ["OPENAI_API_KEY"] = "fake"
+        return runner
+
+
+async def no_memories(*args, **kwargs) -> List:
+    return []
+
+
+async def async_pipeline_stream():
+    stream = stream_and_update_chat(
+        turn=TurnContext(MESSAGES, model=LLM),
+        chat_id="load-test",
+        user_id="load-test",
+        chat_type="text",
+        timezone="UTC",
+        ai_first_name="Sam",
+        user_first_name="Alex",
+        user_gender="other",
+        audio_messages_enabled=False,
+        skip_final_processing=True,
+    )
+    async for _ in stream:
+        pass
+
+
+def sync_stream():
+    client = OpenAI()
+    yield from client.chat.completions.create(messages=MESSAGES, model=LLM, stream=True)
+
+
+async def threadpool_stream():
+    async for _ in iterate_in_threadpool(sync_stream()):
+        pass
+
+
+async def measure(
+    fake_server: FakeOpenAIServer,
+    name: str,
+    stream: Callable[[], Awaitable[None]],
+    num_streams: int,
+):
+    fake_server.peak_open_streams = 0
+    durations = []
+
+    async def timed_stream():
+        start_time = time.perf_counter()
+        await stream()
+        durations.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(timed_stream() for _ in range(num_streams)))
+    elapsed = time.perf_counter() - start_time
+
+    quantiles = statistics.quantiles(durations, n=100)
+    print(
+        f"{name:10} {elapsed:6.2f}s total  p50 {quantiles[49]:6.2f}s  "
+        f"p95 {quantiles[94]:6.2f}s  peak concurrent streams {fake_server.peak_open_streams}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server.agent.index.search_memories = no_memories
+    server.agent.index.fetch_all_memories_within_budget = no_memories
+
+    fake_server = FakeOpenAIServer(args.chunks, args.chunk_delay)
+    runner = await fake_server.start()
+    try:
+        await measure(fake_server, "threadpool", threadpool_stream, args.streams)
+        await measure(fake_server, "async", async_pipeline_stream, args.streams)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
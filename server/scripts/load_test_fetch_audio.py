@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import httpx
+from aiohttp import web
+from fastapi import FastAPI
+from fastapi.responses import Response
+
+from server.api import audio_files
+from server.api.audio_files import audio_file_response
+from server.api.cache import DiskLRUCache
+from server.api.constants import SUPABASE_AUDIO_MESSAGES_BUCKET_NAME
+
+# Replays audio messages through /api/fetchAudio's serving logic and compares:
+#   storage   the previous design, which downloaded the audio from storage on every request with
+#             the synchronous Supabase client (blocking the event loop) and proxied it
+#   cached    the local LRU disk cache
+#   redirect  the signed storage URL redirect mode, where the API serves no audio bytes
+#
+# Storage is a local fake server, on its own thread, that answers after `--storage-latency`
+# seconds. Each of `--messages` audio messages is played `--replays` times, `--concurrency` at
+# once, and a third of the plays are seeks (`Range` requests). The authorization and ownership
+# check are left out because they're the same in every mode.
+#
+# Usage:
+#   python -m server.scripts.load_test_fetch_audio --messages 50 --replays 20 --concurrency 50
+
+
+class FakeStorageServer:
+    def __init__(self, audio_size: int, latency: float):
+        self.audio = os.urandom(audio_size)
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+
+    async def handle_download(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.bytes_sent += len(self.audio)
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self.audio, content_type="audio/mpeg")
+
+    async def handle_sign(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        path = request.match_info["path"]
+        return web.json_response(
+            {
+                "signedURL": f"/object/sign/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{path}?token=fake"
+            }
+        )
+
+    # Serves on a thread with its own event loop, so the blocking download of the old design
+    # doesn't block the fake server too
+    def start(self) -> str:
+        started = threading.Event()
+        address: Dict[str, int] = {}
+
+        async def serve():
+            app = web.Application()
+            bucket = SUPABASE_AUDIO_MESSAGES_BUCKET_NAME
+            app.router.add_get(
+                f"/storage/v1/object/{bucket}/{{path}}", self.handle_download
+            )
+            app.router.add_post(
+                f"/storage/v1/object/sign/{bucket}/{{path}}", self.handle_sign
+            )
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            address["port"] = runner.addresses[0][1]
+            started.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+        started.wait()
+        return f"http://127.0.0.1:{address['port']}"
+
+
+def build_app(supabase_url: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/storage")
+    async def storage(audioId: str):
+        audio = httpx.get(
+            f"{supabase_url}/storage/v1/object/{SUPABASE_AUDIO_MESSAGES_BUCKET_NAME}/{audioId}.mp3"
+        ).content
+        return Response(content=audio, media_type="audio/mpeg")
+
+    @app.get("/cached")
+    async def cached(audioId: str):
+        return await audio_file_response(audioId)
+
+    @app.get("/redirect")
+    async def redirect(audioId: str):
+        return await audio_file_response(audioId)
+
+    return app
+
+
+async def measure(
+    storage: FakeStorageServer,
+    client: httpx.AsyncClient,
+    mode: str,
+    num_messages: int,
+    num_replays: int,
+    concurrency: int,
+):
+    audio_files.AUDIO_SIGNED_URL_REDIRECTS_ENABLED = mode == "redirect"
+    storage.requests = 0
+    storage.bytes_sent = 0
+    durations: List[float] = []
+    bytes_served = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def play(i: int):
+        nonlocal bytes_served
+        headers = {"Range": "bytes=20000-"} if i % 3 == 0 else {}
+        async with slots:
+            start_time = time.perf_counter()
+            response = await client.get(
+                f"/{mode}",
+                params={"audioId": f"{mode}-{i % num_messages}"},
+                headers=headers,
+            )
+            durations.append(time.perf_counter() - start_time)
+        assert response.status_code in (200, 206, 307), response.status_code
+        bytes_served += len(response.content)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(play(i) for i in range(num_messages * num_replays)))
+    elapsed = time.perf_counter() - start_time
+
+    quantiles = statistics.quantiles(durations, n=100)
+    print(
+        f"{mode:8} {len(durations) / elapsed:7.0f} req/s  p50 {quantiles[49] * 1000:7.1f}ms  "
+        f"p95 {quantiles[94] * 1000:7.1f}ms  storage requests {storage.requests:5}  "
+        f"MB from storage {storage.bytes_sent / 1e6:7.1f}  MB served {bytes_served / 1e6:7.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--replays", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--audio-size", type=int, default=480_000)
+    parser.add_argument("--storage-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    storage = FakeStorageServer(args.audio_size, args.storage_latency)
+    supabase_url = storage.start()
+    os.environ["EXPO_PUBLIC_SUPABASE_URL"] = supabase_url
+    os.environ["SUPABASE_SECRET_KEY"] = "fake"
+
+    with tempfile.TemporaryDirectory() as directory:
+        audio_files.audio_cache = DiskLRUCache(
+            directory, audio_files.AUDIO_CACHE_MAX_BYTES, suffix=".mp3"
+        )
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=build_app(supabase_url)),
+            base_url="http://api",
+            timeout=None,
+        ) as client:
+            for mode in ["storage", "cached", "redirect"]:
+                await measure(
+                    storage,
+                    client,
+                    mode,
+                    args.messages,
+                    args.replays,
+                    args.concurrency,
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
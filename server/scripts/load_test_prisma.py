@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from dotenv import load_dotenv
+from prisma import Prisma
+
+from server.api.database import create_prisma
+
+load_dotenv()
+
+
+# Compares the database latency of a chat request when every request connects its own Prisma
+# client (the previous behavior of the chat routes) with sharing one client connected at startup.
+# Each simulated request runs the queries `handle_chat_data` runs before generating a response, or
+# `SELECT 1` if no chat is given.
+#
+# Usage:
+#   python -m server.scripts.load_test_prisma --requests 200 --concurrency 20 \
+#     [--chat-id <chat id> --user-id <user id>]
+async def run_queries(prisma: Prisma, chat_id: Optional[str], user_id: Optional[str]):
+    if chat_id is None:
+        await prisma.query_raw("SELECT 1")
+        return
+    await asyncio.gather(
+        prisma.chats.find_unique(where={"id": chat_id}, include={"messages": True}),
+        prisma.settings.find_unique(where={"id": user_id}),
+    )
+
+
+async def measure(
+    request: Callable[[], Awaitable[None]], num_requests: int, concurrency: int
+) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed_request():
+        async with semaphore:
+            start_time = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start_time)
+
+    await asyncio.gather(*(timed_request() for _ in range(num_requests)))
+    return latencies
+
+
+def report(name: str, latencies: List[float], elapsed: float):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:12} p50 {quantiles[49] * 1000:8.1f}ms  p95 {quantiles[94] * 1000:8.1f}ms  "
+        f"p99 {quantiles[98] * 1000:8.1f}ms  {len(latencies) / elapsed:7.1f} req/s"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chat-id")
+    parser.add_argument("--user-id")
+    args = parser.parse_args()
+
+    async def per_request_client():
+        prisma = create_prisma()
+        await prisma.connect()
+        try:
+            await run_queries(prisma, args.chat_id, args.user_id)
+        finally:
+            await prisma.disconnect()
+
+    shared_prisma = create_prisma()
+    await shared_prisma.connect()
+
+    async def shared_client():
+        await run_queries(shared_prisma, args.chat_id, args.user_id)
+
+    try:
+        for name, request in [
+            ("per request", per_request_client),
+            ("shared", shared_client),
+        ]:
+            start_time = time.perf_counter()
+            latencies = await measure(request, args.requests, args.concurrency)
+            report(name, latencies, time.perf_counter() - start_time)
+    finally:
+        await shared_prisma.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
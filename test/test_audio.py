@@ -0,0 +1,120 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+
+import pytest
+
+from server.api.audio import synthesize_sentences, tee_chunks
+
+
+async def generate_chunks(chunks, error=None):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+    if error is not None:
+        raise error
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_every_stream_gets_every_chunk():
+    async def run():
+        first, second = tee_chunks(generate_chunks([b"a", b"b", b"c"]))
+        return await asyncio.gather(collect(first), collect(second))
+
+    assert asyncio.run(run()) == [[b"a", b"b", b"c"], [b"a", b"b", b"c"]]
+
+
+def test_a_stream_that_stops_reading_doesnt_hold_back_the_others():
+    async def run():
+        response, upload = tee_chunks(generate_chunks([b"a", b"b", b"c"]))
+        # The client disconnects after the first chunk
+        async for chunk in response:
+            break
+        return await collect(upload)
+
+    assert asyncio.run(run()) == [b"a", b"b", b"c"]
+
+
+def test_source_errors_are_raised_in_every_stream():
+    async def run():
+        first, second = tee_chunks(
+            generate_chunks([b"a"], error=RuntimeError("synthesis failed"))
+        )
+        results = await asyncio.gather(
+            collect(first), collect(second), return_exceptions=True
+        )
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_sentences_are_synthesized_concurrently_and_stitched_in_order():
+    running = 0
+    max_running = 0
+    previous_texts = []
+
+    async def synthesize(text, previous_text):
+        nonlocal running, max_running
+        previous_texts.append(previous_text)
+        running += 1
+        max_running = max(max_running, running)
+        # Later sentences finish first
+        await asyncio.sleep(0.01 * (5 - int(text)))
+        running -= 1
+        yield f"<{text}a>".encode()
+        yield f"<{text}b>".encode()
+
+    async def sentences():
+        for n in range(5):
+            yield str(n)
+
+    async def run():
+        return await collect(synthesize_sentences(sentences(), synthesize, 2))
+
+    assert asyncio.run(run()) == [
+        f"<{n}{part}>".encode() for n in range(5) for part in "ab"
+    ]
+    assert max_running == 2
+    assert previous_texts[:2] == [None, "0"]
+
+
+def test_first_audio_doesnt_wait_for_later_sentences():
+    later_sentence_written = asyncio.Event()
+
+    async def synthesize(text, previous_text):
+        yield text.encode()
+
+    async def sentences():
+        yield "first"
+        await later_sentence_written.wait()
+        yield "second"
+
+    async def run():
+        audio = synthesize_sentences(sentences(), synthesize)
+        first = await audio.__anext__()
+        later_sentence_written.set()
+        return [first] + await collect(audio)
+
+    assert asyncio.run(run()) == [b"first", b"second"]
+
+
+def test_synthesis_errors_are_raised():
+    async def synthesize(text, previous_text):
+        raise RuntimeError("synthesis failed")
+        yield b""
+
+    async def sentences():
+        yield "first"
+
+    async def run():
+        return await collect(synthesize_sentences(sentences(), synthesize))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
@@ -0,0 +1,129 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+from typing import Optional
+
+import pytest
+from fastapi import FastAPI, Header
+from fastapi.testclient import TestClient
+
+from server.api import audio_files
+from server.api.cache import DiskLRUCache
+
+AUDIO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    downloads = []
+
+    async def download_audio(path):
+        downloads.append(path)
+        await asyncio.sleep(0.01)
+        return AUDIO
+
+    monkeypatch.setattr(
+        audio_files, "audio_cache", DiskLRUCache(str(tmp_path), 10**6, ".mp3")
+    )
+    monkeypatch.setattr(audio_files, "download_audio", download_audio)
+    return downloads
+
+
+@pytest.fixture
+def client(downloads):
+    app = FastAPI()
+
+    @app.get("/audio")
+    async def audio(audioId: str, if_none_match: Optional[str] = Header(None)):
+        return await audio_files.audio_file_response(audioId, if_none_match)
+
+    return TestClient(app)
+
+
+def test_disk_cache_evicts_least_recently_used_by_size(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=250, suffix=".mp3")
+    cache.set("a", b"a" * 100)
+    cache.set("b", b"b" * 100)
+    assert cache.get("a") is not None
+    cache.set("c", b"c" * 100)
+
+    assert cache.get("b") is None
+    assert cache.read("a") == b"a" * 100
+    assert sorted(os.listdir(tmp_path)) == ["a.mp3", "c.mp3"]
+
+    # The index is rebuilt from the directory
+    restarted = DiskLRUCache(str(tmp_path), max_bytes=250, suffix=".mp3")
+    assert restarted.stats()["bytes"] == 200
+    assert restarted.read("c") == b"c" * 100
+
+
+def test_disk_cache_rejects_paths_as_keys(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes=100)
+    for key in ["", "../secrets", ".hidden", "a/b"]:
+        with pytest.raises(ValueError):
+            cache.get(key)
+
+
+def test_replays_are_served_from_the_cache(client, downloads):
+    first = client.get("/audio", params={"audioId": "a1"})
+    replay = client.get("/audio", params={"audioId": "a1"})
+
+    assert first.content == replay.content == AUDIO
+    assert first.headers["content-type"] == "audio/mpeg"
+    assert first.headers["etag"] == '"a1"'
+    assert downloads == ["a1.mp3"]
+
+
+def test_supports_conditional_and_range_requests(client):
+    etag = client.get("/audio", params={"audioId": "a1"}).headers["etag"]
+
+    not_modified = client.get(
+        "/audio", params={"audioId": "a1"}, headers={"If-None-Match": f"W/{etag}"}
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    partial = client.get(
+        "/audio", params={"audioId": "a1"}, headers={"Range": "bytes=100-199"}
+    )
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 100-199/{len(AUDIO)}"
+    assert partial.content == AUDIO[100:200]
+
+    stale = client.get(
+        "/audio",
+        params={"audioId": "a1"},
+        headers={"Range": "bytes=100-199", "If-Range": '"other"'},
+    )
+    assert stale.status_code == 200
+    assert stale.content == AUDIO
+
+
+def test_concurrent_misses_share_one_download(downloads):
+    async def run():
+        return await asyncio.gather(
+            *(audio_files.fetch_cached_audio("a1") for _ in range(10))
+        )
+
+    assert len(set(asyncio.run(run()))) == 1
+    assert downloads == ["a1.mp3"]
+
+
+def test_redirects_to_signed_urls_when_enabled(client, downloads, monkeypatch):
+    async def create_signed_audio_url(path, expires_in):
+        return f"https://storage.example.com/{path}?expires_in={expires_in}"
+
+    monkeypatch.setattr(audio_files, "AUDIO_SIGNED_URL_REDIRECTS_ENABLED", True)
+    monkeypatch.setattr(audio_files, "create_signed_audio_url", create_signed_audio_url)
+    monkeypatch.setattr(audio_files, "signed_urls", audio_files.LRUCache(10))
+
+    response = client.get("/audio", params={"audioId": "a1"}, follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"].startswith("https://storage.example.com/a1.mp3")
+    assert downloads == []
+
+    replay = client.get("/audio", params={"audioId": "a1"}, follow_redirects=False)
+    assert replay.headers["location"] == response.headers["location"]
@@ -0,0 +1,118 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import base64
+import json
+from email.parser import BytesParser
+
+import pytest
+
+from server.api import audio_messages
+from server.api.audio_messages import audio_message_response, start_audio_message
+from server.livekit_worker.voices import CharlotteSettings
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    uploads = {}
+
+    async def stream_speech(text, voice_settings, previous_text=None):
+        yield f"<{text}>".encode("utf-8")
+
+    async def upload(audio_id, chunks):
+        uploads[audio_id] = b"".join([chunk async for chunk in chunks])
+
+    monkeypatch.setattr(audio_messages, "stream_speech", stream_speech)
+    monkeypatch.setattr(
+        audio_messages,
+        "start_audio_upload",
+        lambda audio_id, chunks: asyncio.create_task(upload(audio_id, chunks)),
+    )
+    return uploads
+
+
+def parse_parts(boundary, body):
+    message = BytesParser().parsebytes(
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode() + body
+    )
+    return message.get_payload()
+
+
+def test_streamed_audio_starts_before_the_reply_is_written(uploads):
+    rest_of_reply = asyncio.Event()
+
+    async def reply():
+        yield "Hello there, nice to see you. "
+        await rest_of_reply.wait()
+        yield "How are you?"
+
+    async def run():
+        speech, upload, reply_done = start_audio_message(
+            reply(), "a1", CharlotteSettings
+        )
+        response = await audio_message_response(
+            "a1", speech, upload, reply_done, accept="multipart/mixed"
+        )
+        assert not reply_done.done()
+
+        body = response.body_iterator
+        chunks = []
+        while b"<Hello there, nice to see you.>" not in b"".join(chunks):
+            chunks.append(await asyncio.wait_for(body.__anext__(), 1))
+        assert not reply_done.done()
+
+        rest_of_reply.set()
+        chunks.extend([chunk async for chunk in body])
+        await upload
+        boundary = response.media_type.split("boundary=")[1]
+        return boundary, b"".join(chunks)
+
+    boundary, body = asyncio.run(run())
+    id_part, audio_part, text_part = parse_parts(boundary, body)
+    assert json.loads(id_part.get_payload(decode=True)) == {"audioId": "a1"}
+    assert audio_part.get_content_type() == "audio/mpeg"
+    audio = b"<Hello there, nice to see you.><How are you?>"
+    assert audio_part.get_payload(decode=True) == audio
+    assert json.loads(text_part.get_payload(decode=True)) == {
+        "text": "Hello there, nice to see you. How are you?"
+    }
+    assert uploads["a1"] == audio
+
+
+def test_json_audio_messages_have_the_whole_reply(uploads):
+    async def reply():
+        yield "Hello there. "
+        yield "How are you?"
+
+    async def run():
+        speech, upload, reply_done = start_audio_message(
+            reply(), "a1", CharlotteSettings
+        )
+        response = await audio_message_response("a1", speech, upload, reply_done)
+        return json.loads(response.body)
+
+    assert asyncio.run(run()) == {
+        "text": "Hello there. How are you?",
+        "audioId": "a1",
+        "audioBase64": base64.b64encode(b"<Hello there. How are you?>").decode(),
+    }
+
+
+def test_reply_errors_are_set_on_the_reply_future(uploads):
+    async def reply():
+        yield "Hello there. "
+        raise RuntimeError("LLM failed")
+
+    async def run():
+        speech, upload, reply_done = start_audio_message(
+            reply(), "a1", CharlotteSettings
+        )
+        with pytest.raises(RuntimeError):
+            await upload
+        return reply_done
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run()).result()
@@ -0,0 +1,98 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from server.api.chat_turns import (
+    CHAT_MESSAGE_COLUMNS,
+    ChatTurn,
+    build_save_chat_turns_query,
+    format_timestamp,
+)
+from server.api.utils import count_tokens_for_message
+from test_token_limit import WordEncoding
+
+NOW = datetime(2025, 1, 2, 12, 0, 0)
+
+
+def build_turn(i, audio_id=None):
+    return ChatTurn(
+        chat_id=f"chat-{i % 2}",
+        user_message=f"user message {i}",
+        agent_message=f"a longer agent message {i}",
+        user_message_timestamp=NOW + timedelta(seconds=i),
+        agent_message_timestamp=NOW + timedelta(seconds=i, milliseconds=500),
+        audio_messages_enabled=audio_id is not None,
+        audio_id=audio_id,
+    )
+
+
+def rows_of(parameters):
+    num_columns = len(CHAT_MESSAGE_COLUMNS)
+    rows = parameters[:-1]
+    assert len(rows) % num_columns == 0
+    return [
+        dict(zip(CHAT_MESSAGE_COLUMNS, rows[i : i + num_columns]))
+        for i in range(0, len(rows), num_columns)
+    ]
+
+
+def test_one_statement_inserts_every_message_and_bumps_the_chat():
+    encoding = WordEncoding()
+    turns = [build_turn(0), build_turn(1, audio_id="audio-1")]
+    query, parameters = build_save_chat_turns_query(turns, encoding, now=NOW)
+
+    # Every parameter is bound exactly where it's used
+    placeholders = sorted({int(n) for n in re.findall(r"\$(\d+)", query)})
+    assert placeholders == list(range(1, len(parameters) + 1))
+    assert query.count("INSERT INTO") == 1 and query.count("UPDATE") == 1
+
+    rows = rows_of(parameters)
+    assert [(row["chat_id"], row["role"]) for row in rows] == [
+        ("chat-0", "user"),
+        ("chat-0", "assistant"),
+        ("chat-1", "user"),
+        ("chat-1", "assistant"),
+    ]
+    assert [row["display_type"] for row in rows] == ["text", "text", "text", "audio"]
+    assert rows[3]["audio_id"] == "audio-1"
+    assert len({row["id"] for row in rows}) == 4
+    assert rows[0]["created"] == "2025-01-02T12:00:00"
+    assert parameters[-1] == "2025-01-02T12:00:00"
+
+    # Token counts match the ones the chat history is truncated with
+    assert rows[1]["token_count"] == count_tokens_for_message(
+        {"role": "assistant", "content": "a longer agent message 0"}, WordEncoding()
+    )
+    assert {row["token_encoding"] for row in rows} == {"words"}
+
+
+def test_retried_turns_keep_their_message_ids():
+    turn = build_turn(0)
+    _, first_parameters = build_save_chat_turns_query([turn], WordEncoding())
+    query, retry_parameters = build_save_chat_turns_query([turn], WordEncoding())
+    assert [row["id"] for row in rows_of(first_parameters)] == [
+        turn.user_message_id,
+        turn.agent_message_id,
+    ]
+    assert [row["id"] for row in rows_of(retry_parameters)] == [
+        turn.user_message_id,
+        turn.agent_message_id,
+    ]
+    assert 'ON CONFLICT ("id") DO NOTHING' in query
+
+
+def test_timestamps_are_stored_as_utc():
+    aware = datetime(2025, 1, 2, 7, 0, 0, tzinfo=timezone(timedelta(hours=-5)))
+    assert format_timestamp(aware) == "2025-01-02T12:00:00"
+    assert format_timestamp(NOW) == "2025-01-02T12:00:00"
+
+
+def test_requires_a_turn():
+    with pytest.raises(ValueError):
+        build_save_chat_turns_query([], WordEncoding())
@@ -0,0 +1,211 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from server.api.jobs import JobQueue
+
+
+def build_queue(tmp_path, handlers, **kwargs):
+    return JobQueue(
+        handlers,
+        path=str(tmp_path / "jobs.sqlite3"),
+        name="test",
+        **{"retry_backoff_seconds": 0.01, "poll_seconds": 0.01, **kwargs},
+    )
+
+
+async def wait_until(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError
+
+
+def test_runs_jobs_with_bounded_concurrency(tmp_path):
+    running = 0
+    max_running = 0
+    completed = []
+
+    async def handle(payload):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        completed.append(payload["n"])
+
+    async def run():
+        queue = build_queue(tmp_path, {"work": handle}, concurrency=3)
+        for n in range(10):
+            queue.enqueue("work", {"n": n})
+        await queue.drain(timeout=5)
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert sorted(completed) == list(range(10))
+    assert max_running == 3
+    assert stats["completed"] == 10
+    assert stats["queue_depth"] == 0
+    assert stats["time_to_completion"]["count"] == 10
+
+
+def test_retries_failed_jobs_until_max_attempts(tmp_path):
+    attempts = {"flaky": 0, "broken": 0}
+
+    async def flaky(payload):
+        attempts["flaky"] += 1
+        if attempts["flaky"] < 3:
+            raise RuntimeError("try again")
+
+    async def broken(payload):
+        attempts["broken"] += 1
+        raise RuntimeError("always fails")
+
+    async def run():
+        queue = build_queue(
+            tmp_path, {"flaky": flaky, "broken": broken}, max_attempts=4
+        )
+        queue.enqueue("flaky", {})
+        queue.enqueue("broken", {})
+        await queue.drain(timeout=5)
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert attempts == {"flaky": 3, "broken": 4}
+    assert stats["completed"] == 1 and stats["failed"] == 1
+    assert stats["retried"] == 5
+    assert stats["queue_depth"] == 0
+
+
+def test_jobs_survive_a_restart(tmp_path):
+    completed = []
+
+    async def slow(payload):
+        await asyncio.sleep(10)
+
+    async def fast(payload):
+        completed.append(payload["n"])
+
+    # Jobs enqueued without an event loop, and a job cancelled when the drain times out, are run by
+    # the next process
+    queue = build_queue(tmp_path, {"work": slow})
+    queue.enqueue("work", {"n": 1})
+
+    async def shut_down():
+        queue.start()
+        await queue.drain(timeout=0.1)
+        return queue.stats()
+
+    stats = asyncio.run(shut_down())
+    assert stats["queue_depth"] == 1 and stats["completed"] == 0
+
+    async def restart():
+        next_queue = build_queue(tmp_path, {"work": fast})
+        next_queue.start()
+        await wait_until(lambda: completed)
+        await next_queue.drain(timeout=5)
+        return next_queue.stats()
+
+    stats = asyncio.run(restart())
+    assert completed == [1]
+    assert stats["queue_depth"] == 0
+
+
+def test_rejects_unknown_kinds(tmp_path):
+    queue = build_queue(tmp_path, {})
+    with pytest.raises(ValueError):
+        queue.enqueue("work", {})
+
+
+def test_drain_only_waits_for_this_process_jobs_that_are_due(tmp_path):
+    other_queue = build_queue(tmp_path, {"work": None})
+    other_queue.enqueue("work", {"n": 1})
+    queue = build_queue(tmp_path, {"work": None})
+    queue.enqueue("work", {"n": 2})
+    assert queue._count_pending(time.time()) == 1
+
+    # Postponed like a retry
+    queue._connection().execute(
+        "UPDATE jobs SET available_at = ? WHERE enqueued_by = ?",
+        (time.time() + 60, queue._owner),
+    )
+    assert queue._count_pending(time.time() + 5) == 0
+    assert queue._count_pending(time.time() + 120) == 1
+
+
+def test_drain_doesnt_wait_for_retries_due_after_it(tmp_path):
+    async def flaky(payload):
+        raise RuntimeError("try again")
+
+    async def run():
+        queue = build_queue(tmp_path, {"flaky": flaky}, retry_backoff_seconds=60)
+        queue.enqueue("flaky", {})
+        await wait_until(lambda: queue.stats()["retried"] == 1)
+        start = time.monotonic()
+        await queue.drain(timeout=5)
+        return time.monotonic() - start, queue.stats()
+
+    elapsed, stats = asyncio.run(run())
+    assert elapsed < 1
+    assert stats["queue_depth"] == 1
+
+
+def test_dispatcher_survives_claim_errors(tmp_path, monkeypatch):
+    completed = []
+
+    async def handle(payload):
+        completed.append(payload["n"])
+
+    async def run():
+        queue = build_queue(tmp_path, {"work": handle}, concurrency=1)
+        claim = queue._claim
+        failures = [sqlite3.OperationalError("database is locked")] * 3
+
+        def flaky_claim():
+            if failures:
+                raise failures.pop()
+            return claim()
+
+        monkeypatch.setattr(queue, "_claim", flaky_claim)
+        queue.enqueue("work", {"n": 1})
+        await wait_until(lambda: completed)
+        queue.enqueue("work", {"n": 2})
+        await queue.drain(timeout=5)
+
+    asyncio.run(run())
+    assert completed == [1, 2]
+
+
+def test_jobs_with_the_same_batch_key_run_together(tmp_path):
+    batches = []
+
+    async def handle_batch(payloads):
+        batches.append([payload["n"] for payload in payloads])
+
+    async def run():
+        queue = build_queue(
+            tmp_path, {}, batch_handlers={"work": handle_batch}, max_batch_size=3
+        )
+        queue.enqueue("work", {"n": 1}, batch_key="user-1", delay_seconds=0.2)
+        # Joins the window of the first job rather than starting its own
+        queue.enqueue("work", {"n": 2}, batch_key="user-1", delay_seconds=60)
+        queue.enqueue("work", {"n": 3}, batch_key="user-2", delay_seconds=0.2)
+        queue.enqueue("work", {"n": 4})
+        for n in range(5, 9):
+            queue.enqueue("work", {"n": n}, batch_key="user-3")
+        await queue.drain(timeout=5)
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert sorted(batches) == [[1, 2], [3], [4], [5, 6, 7], [8]]
+    assert stats["completed"] == 8
+    assert stats["batched"] == 3
+    assert stats["queue_depth"] == 0
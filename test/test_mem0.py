@@ -0,0 +1,275 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from server.api import mem0, utils
+from server.api.cache import LRUCache
+from server.api.constants import LLM
+from server.api.jobs import JobQueue
+from server.api.mem0 import Mem0ClientManager
+from server.api.utils import TurnContext, merge_message_windows
+from test_token_limit import WordEncoding
+
+
+def fake_client():
+    return SimpleNamespace(
+        sync_client=SimpleNamespace(
+            host="https://mem0.example.com", client=SimpleNamespace(headers={})
+        ),
+        async_client=None,
+    )
+
+
+def test_client_is_constructed_once_and_shared_within_a_loop():
+    num_connects = []
+
+    def connect():
+        num_connects.append(1)
+        return fake_client()
+
+    manager = Mem0ClientManager(connect=connect)
+
+    async def fetch_twice():
+        return await manager.fetch(timeout=1), await manager.fetch(timeout=1)
+
+    first, second = asyncio.run(fetch_twice())
+    third, _ = asyncio.run(fetch_twice())
+
+    assert first is second
+    # Each event loop gets its own connection pool, but the client isn't constructed again
+    assert third is not first
+    assert third.async_client is not first.async_client
+    assert len(num_connects) == 1
+
+
+def test_failed_connections_are_retried_with_backoff():
+    results = [None, fake_client()]
+
+    def connect():
+        return results.pop(0)
+
+    manager = Mem0ClientManager(connect=connect)
+
+    async def fetch():
+        return await manager.fetch(timeout=1)
+
+    assert asyncio.run(fetch()) is None
+    # The next attempt waits for the backoff instead of reconnecting on every call
+    assert asyncio.run(fetch()) is None
+    assert len(results) == 1
+
+    manager._next_attempt_time = 0
+    assert asyncio.run(fetch()) is not None
+    assert results == []
+    assert manager._backoff_seconds == Mem0ClientManager.INITIAL_BACKOFF_SECONDS
+
+
+class FakeMem0:
+    def __init__(self, memories):
+        self.memories = memories
+        self.get_all_calls = []
+
+    async def get_all(self, filters, version):
+        self.get_all_calls.append(filters)
+        return list(self.memories)
+
+    async def add(self, **kwargs):
+        return [
+            {"id": "memory-1", "event": "DELETE"},
+            {"id": "memory-3", "event": "ADD"},
+        ]
+
+
+@pytest.fixture
+def fake_mem0(monkeypatch):
+    client = FakeMem0(
+        [
+            {"id": "memory-1", "memory": "Has a dog"},
+            {"id": "memory-2", "memory": "Prefers emojis"},
+        ]
+    )
+
+    async def fetch_mem0():
+        return client
+
+    monkeypatch.setattr(mem0, "fetch_mem0", fetch_mem0)
+    monkeypatch.setattr(mem0, "memory_cache", LRUCache(10))
+    return client
+
+
+def test_memories_are_cached_until_a_memory_is_added(fake_mem0):
+    first = asyncio.run(mem0.fetch_all_memories("user-1"))
+    second = asyncio.run(mem0.fetch_all_memories("user-1"))
+
+    assert first == second == fake_mem0.memories
+    assert fake_mem0.get_all_calls == [{"user_id": "user-1"}]
+
+    asyncio.run(mem0.call_add_memory([], "user-1", "", []))
+    fake_mem0.memories = [{"id": "memory-3", "memory": "Lives in Paris"}]
+    third = asyncio.run(mem0.fetch_all_memories("user-1"))
+
+    # Only memories updated since the last sync are fetched, and deleted memories are dropped
+    assert "AND" in fake_mem0.get_all_calls[-1]
+    assert [memory["id"] for memory in third] == ["memory-2", "memory-3"]
+
+
+def test_expired_entries_are_refreshed(fake_mem0, monkeypatch):
+    asyncio.run(mem0.fetch_all_memories("user-1"))
+    monkeypatch.setattr(mem0, "MEMORY_CACHE_TTL_SECONDS", 0)
+    asyncio.run(mem0.fetch_all_memories("user-1"))
+    assert len(fake_mem0.get_all_calls) == 2
+
+    monkeypatch.setattr(mem0, "MEMORY_CACHE_FULL_REFRESH_SECONDS", 0)
+    asyncio.run(mem0.fetch_all_memories("user-1"))
+    assert fake_mem0.get_all_calls[-1] == {"user_id": "user-1"}
+
+
+class SlowSearchMem0:
+    def __init__(self, delays):
+        self.delays = delays
+        self.num_searches = 0
+
+    async def search(self, query, **kwargs):
+        delay = self.delays[self.num_searches]
+        self.num_searches += 1
+        await asyncio.sleep(delay)
+        return [{"id": f"search-{self.num_searches}", "memory": query}]
+
+
+@pytest.fixture
+def search_budget(monkeypatch):
+    monkeypatch.setattr(mem0, "MEMORY_RETRIEVAL_BUDGET_SECONDS", 0.2)
+    monkeypatch.setattr(mem0, "MEMORY_SEARCH_HEDGE_SECONDS", 0.05)
+    monkeypatch.setattr(mem0, "search_cache", LRUCache(10))
+
+    def use(client):
+        async def fetch_mem0():
+            return client
+
+        monkeypatch.setattr(mem0, "fetch_mem0", fetch_mem0)
+
+    return use
+
+
+def test_slow_searches_are_hedged(search_budget):
+    client = SlowSearchMem0(delays=[1, 0])
+    search_budget(client)
+
+    memories = asyncio.run(mem0.call_search_memories("dogs", "user-1"))
+
+    assert client.num_searches == 2
+    assert memories == [{"id": "search-2", "memory": "dogs"}]
+
+
+def test_searches_that_miss_the_budget_use_the_last_results(search_budget):
+    client = SlowSearchMem0(delays=[0, 0.5, 0.5])
+    search_budget(client)
+
+    assert asyncio.run(mem0.call_search_memories("dogs", "user-1")) == [
+        {"id": "search-1", "memory": "dogs"}
+    ]
+    assert asyncio.run(mem0.call_search_memories("cats", "user-1")) == [
+        {"id": "search-1", "memory": "dogs"}
+    ]
+
+    # The late searches keep running in the background and update the cache when they return
+    time.sleep(0.6)
+    assert mem0.search_cache.get("user-1")[0]["memory"] == "cats"
+    assert mem0.fetch_latency_histogram("mem0.search").snapshot()["count"] >= 3
+
+
+def test_failed_writes_are_raised_for_callers_that_retry(fake_mem0, monkeypatch):
+    async def add(**kwargs):
+        raise RuntimeError("mem0 is down")
+
+    monkeypatch.setattr(fake_mem0, "add", add)
+    # Logged and dropped by default
+    asyncio.run(mem0.call_add_memory([], "user-1", "", []))
+    with pytest.raises(RuntimeError):
+        asyncio.run(mem0.call_add_memory([], "user-1", "", [], raise_errors=True))
+
+    async def fetch_mem0():
+        return None
+
+    monkeypatch.setattr(mem0, "fetch_mem0", fetch_mem0)
+    asyncio.run(mem0.call_add_memory([], "user-1", "", []))
+    with pytest.raises(RuntimeError):
+        asyncio.run(mem0.call_add_memory([], "user-1", "", [], raise_errors=True))
+
+
+def message(role, content):
+    return {"role": role, "content": content}
+
+
+CONVERSATION = [
+    message("user" if i % 2 == 0 else "assistant", f"message {i}") for i in range(12)
+]
+
+
+def test_overlapping_windows_are_merged():
+    assert merge_message_windows(CONVERSATION[0:4], CONVERSATION[2:6]) == (
+        CONVERSATION[0:6]
+    )
+    assert merge_message_windows(CONVERSATION[0:4], CONVERSATION[6:8]) == (
+        CONVERSATION[0:4] + CONVERSATION[6:8]
+    )
+
+
+def test_close_turns_are_added_in_one_call(fake_mem0, monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "fetch_encoding", lambda model: WordEncoding())
+    monkeypatch.setattr(utils, "_message_token_cache", LRUCache(0))
+    calls = []
+
+    async def add(**kwargs):
+        calls.append(kwargs)
+        return []
+
+    monkeypatch.setattr(fake_mem0, "add", add)
+
+    # The same as `run_add_memories_jobs` in server/api/routes/chat.py
+    async def add_memories_jobs(payloads):
+        await utils.add_memory_windows(
+            [
+                TurnContext(payload["messages"], model=LLM).memory_window(
+                    payload["agent_response"]
+                )
+                for payload in payloads
+            ],
+            user_id=payloads[0]["user_id"],
+        )
+
+    async def run():
+        queue = JobQueue(
+            {},
+            batch_handlers={"add_memories": add_memories_jobs},
+            path=str(tmp_path / "jobs.sqlite3"),
+            poll_seconds=0.01,
+        )
+        for end in [4, 6]:
+            queue.enqueue(
+                "add_memories",
+                {
+                    "messages": CONVERSATION[: end - 1],
+                    "agent_response": CONVERSATION[end - 1]["content"],
+                    "user_id": "user-1",
+                },
+                batch_key="user-1",
+                delay_seconds=0.2,
+            )
+        await queue.drain(timeout=5)
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert len(calls) == 1
+    assert calls[0]["user_id"] == "user-1"
+    # The windows of both turns, with the messages they share sent once
+    assert calls[0]["messages"] == CONVERSATION[:6]
+    assert stats["completed"] == 2
+    assert stats["batched"] == 1
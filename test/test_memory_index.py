@@ -0,0 +1,102 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from server.api import mem0
+from server.api.cache import LRUCache
+from server.api.memory_index import MemoryIndex, tokenize
+
+MEMORIES = [
+    {"id": "1", "memory": "User has two dogs named Rex and Bella", "categories": None},
+    {"id": "2", "memory": "User works as a nurse in Boston", "categories": None},
+    {"id": "3", "memory": "User's aunt is a fan of Ottolenghi", "categories": None},
+    {"id": "4", "memory": "User enjoys hiking on weekends", "categories": None},
+]
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert tokenize("The user has two dogs and many puppies") == [
+        "two",
+        "dog",
+        "many",
+        "puppy",
+    ]
+
+
+def test_search_ranks_matching_memories_first():
+    index = MemoryIndex(MEMORIES)
+    results = index.search("What should I get my aunt? She loves Ottolenghi", top_k=2)
+    assert [memory["id"] for memory, _ in results] == ["3"]
+
+    results = index.search("Walking the dog before my nursing shift", top_k=25)
+    assert [memory["id"] for memory, _ in results] == ["1"]
+
+
+def test_small_indexes_return_every_memory():
+    index = MemoryIndex(MEMORIES)
+    results = mem0.search_local_memories(index, "my dog", top_k=25)
+    assert [memory["id"] for memory in results] == ["1", "2", "3", "4"]
+    assert results[0]["score"] > 0 and results[1]["score"] == 0
+
+
+def test_low_confidence_searches_fall_back_to_mem0(monkeypatch):
+    memories = [
+        {"id": str(i), "memory": f"User visited city number {i}", "categories": None}
+        for i in range(40)
+    ] + MEMORIES
+    monkeypatch.setattr(mem0, "memory_cache", LRUCache(10))
+    monkeypatch.setattr(mem0, "memory_index_cache", LRUCache(10))
+    mem0.memory_cache.set(
+        "user-1",
+        mem0.CachedMemories(
+            memories={memory["id"]: memory for memory in memories},
+            synced_at=datetime.now(timezone.utc),
+            fetched_at=time.monotonic(),
+            fully_fetched_at=time.monotonic(),
+        ),
+    )
+
+    remote_queries = []
+
+    async def search_remotely(message_content, user_id):
+        remote_queries.append(message_content)
+        return []
+
+    monkeypatch.setattr(mem0, "_search_and_cache", search_remotely)
+
+    results = asyncio.run(
+        mem0.call_search_memories("My aunt loves Ottolenghi", "user-1")
+    )
+    assert results[0]["id"] == "3"
+    assert remote_queries == []
+
+    asyncio.run(mem0.call_search_memories("How was your day?", "user-1"))
+    assert remote_queries == ["How was your day?"]
+
+    # The index is reused until the user's memories change
+    index = mem0.fetch_memory_index("user-1")
+    assert mem0.fetch_memory_index("user-1") is index
+    mem0.invalidate_cached_memories("user-1")
+    assert mem0.fetch_memory_index("user-1") is None
+
+
+def test_expired_memories_arent_searched_locally(monkeypatch):
+    monkeypatch.setattr(mem0, "memory_cache", LRUCache(10))
+    monkeypatch.setattr(mem0, "memory_index_cache", LRUCache(10))
+    fetched_at = time.monotonic() - mem0.MEMORY_CACHE_TTL_SECONDS - 1
+    mem0.memory_cache.set(
+        "user-1",
+        mem0.CachedMemories(
+            memories={memory["id"]: memory for memory in MEMORIES},
+            synced_at=datetime.now(timezone.utc),
+            fetched_at=fetched_at,
+            fully_fetched_at=fetched_at,
+        ),
+    )
+
+    assert mem0.fetch_memory_index("user-1") is None
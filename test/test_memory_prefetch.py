@@ -0,0 +1,99 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+
+import pytest
+
+from server.api import memory_prefetch, utils
+from server.api.cache import LRUCache
+from server.api.client_messages import ClientMessage, build_chat_history
+from test_token_limit import WordEncoding
+
+CONTEXT = ["Hi!", "Hey, how are you?", "Good, thanks."]
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    queries = []
+
+    async def call_search_memories(message_content, user_id):
+        queries.append(message_content)
+        await asyncio.sleep(0.05)
+        return [{"id": "1", "memory": message_content}]
+
+    monkeypatch.setattr(memory_prefetch, "call_search_memories", call_search_memories)
+    monkeypatch.setattr(memory_prefetch, "_prefetches", LRUCache(10))
+    return queries
+
+
+def test_prefetch_is_reused_for_a_similar_message(searches):
+    num_started = memory_prefetch.fetch_prefetch_stats()["started"]
+    memory_prefetch.start_prefetch("user-1", CONTEXT + ["Any ideas"])
+    memory_prefetch.start_prefetch(
+        "user-1", CONTEXT + ["Any ideas for my aunt's birthday"]
+    )
+    # Interim text that barely changes the query keeps the running prefetch
+    memory_prefetch.start_prefetch(
+        "user-1", CONTEXT + ["Any ideas for my aunt's birthday?"]
+    )
+    assert memory_prefetch.fetch_prefetch_stats()["started"] - num_started == 2
+
+    memories = asyncio.run(
+        memory_prefetch.fetch_prefetched_memories(
+            "user-1", CONTEXT + ["Any ideas for my aunt's birthday gift?"]
+        )
+    )
+    assert memories == [
+        {"id": "1", "memory": "\n".join(CONTEXT + ["Any ideas for my aunt's birthday"])}
+    ]
+    # Each prefetch is only used once
+    assert memory_prefetch.take_prefetch("user-1", CONTEXT + ["anything"]) is None
+
+
+def test_prefetch_for_a_different_message_is_cancelled(searches):
+    memory_prefetch.start_prefetch("user-1", CONTEXT + ["Tell me about Rome"])
+    prefetch = memory_prefetch._prefetches.get("user-1")
+
+    memories = asyncio.run(
+        memory_prefetch.fetch_prefetched_memories(
+            "user-1", CONTEXT + ["What should I cook tonight?"]
+        )
+    )
+    assert memories is None
+    assert prefetch.future.cancelled() or prefetch.future.done()
+
+
+def test_prefetch_for_a_different_context_is_not_reused(searches):
+    memory_prefetch.start_prefetch("user-1", CONTEXT + ["Tell me about Rome"])
+    assert (
+        memory_prefetch.take_prefetch(
+            "user-1", ["Hello", "Hi", "Where to?", "Tell me about Rome"]
+        )
+        is None
+    )
+
+
+def test_prefetch_from_typing_is_reused_for_the_chat_request(searches, monkeypatch):
+    monkeypatch.setattr(utils, "fetch_encoding", lambda model: WordEncoding())
+    monkeypatch.setattr(utils, "_message_token_cache", LRUCache(0))
+
+    def chat_history(draft):
+        roles = ["user", "assistant", "user", "user"]
+        return build_chat_history(
+            [
+                ClientMessage(id=str(i), role=role, content=content, created="")
+                for i, (role, content) in enumerate(zip(roles, CONTEXT + [draft]))
+            ]
+        )
+
+    # What /api/chat/typing and /api/chat search with
+    utils.prefetch_memories(
+        chat_history("Any ideas for my aunt's birthday"), "user-1", "model"
+    )
+    final = utils.TurnContext(
+        chat_history("Any ideas for my aunt's birthday gift?"), "model"
+    )
+    assert memory_prefetch.take_prefetch("user-1", final.search_query_contents)
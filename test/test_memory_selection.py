@@ -0,0 +1,55 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from server.api.utils import (
+    MEMORY_PROMPT_OVERHEAD_TOKENS,
+    fetch_memory_selection_stats,
+    record_memory_selection,
+    select_memories,
+)
+from test_token_limit import WordEncoding
+
+
+def memory(id, text, score):
+    return {"id": id, "memory": text, "score": score}
+
+
+def test_memories_are_ordered_by_score_and_deduplicated():
+    selection = select_memories(
+        memories=[
+            memory("1", "User has a dog named Rex", 0.4),
+            memory("2", "User lives in Boston", 0.9),
+            memory("3", "User's dog is named Rex", 0.3),
+            memory("4", "User prefers the assistant to use emojis", 0.8),
+            memory("5", "", 1.0),
+        ],
+        preferences=[memory("6", "User prefers the assistant to use emojis", None)],
+        encoding=WordEncoding(),
+    )
+
+    assert [memory["id"] for memory in selection.memories] == ["2", "1"]
+    assert selection.num_duplicates == 2
+    assert selection.num_tokens == 4 + 6 + 2 * MEMORY_PROMPT_OVERHEAD_TOKENS
+
+
+def test_memories_are_selected_within_the_token_budget():
+    selection = select_memories(
+        memories=[
+            memory("1", "User " + "really " * 50 + "likes long walks", 0.9),
+            memory("2", "User lives in Boston", 0.5),
+            memory("3", "User works as a nurse", 0.4),
+        ],
+        preferences=[],
+        encoding=WordEncoding(),
+        token_budget=2 * MEMORY_PROMPT_OVERHEAD_TOKENS + 10,
+    )
+
+    # The long memory doesn't fit, but the shorter, lower-scored ones do
+    assert [memory["id"] for memory in selection.memories] == ["2", "3"]
+    assert selection.num_over_budget == 1
+
+    turns = fetch_memory_selection_stats()["turns"]
+    record_memory_selection(selection)
+    assert fetch_memory_selection_stats()["turns"] == turns + 1
@@ -0,0 +1,103 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from server.api.messages import MessageView
+from server.api.utils import add_system_prompts, fetch_prompt_cache_stats
+
+
+def build_messages(num_messages):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+        for i in range(num_messages)
+    ]
+
+
+def test_view_matches_list_operations():
+    messages = build_messages(10)
+    expected = list(messages)
+    expected.append({"role": "system", "content": "appended"})
+    expected.insert(7, {"role": "system", "content": "inserted"})
+
+    view = (
+        MessageView(messages)
+        .with_appended({"role": "system", "content": "appended"})
+        .with_inserted(7, {"role": "system", "content": "inserted"})
+    )
+
+    assert view.to_list() == expected
+    assert len(view) == len(expected)
+    for index in range(-len(expected), len(expected)):
+        assert view[index] == expected[index]
+    for start in range(-13, 13):
+        for stop in [None, -1, 0, 3, 8, 12]:
+            assert view[start:stop].to_list() == expected[start:stop]
+    assert view[::2].to_list() == expected[::2]
+
+
+def test_view_does_not_copy_or_modify_messages():
+    messages = build_messages(5)
+    view = MessageView(messages).with_inserted(0, {"role": "system", "content": "a"})
+
+    assert len(messages) == 5
+    assert view[1] is messages[0]
+    assert view[-3:].to_list()[-1] is messages[-1]
+
+
+def test_add_system_prompts_inserts_memories_three_messages_from_the_end():
+    messages = build_messages(6)
+    memories = [
+        {"memory": "Likes tea", "updated_at": None, "created_at": None},
+    ]
+    view = add_system_prompts(
+        messages=messages,
+        ai_first_name="Charlotte",
+        user_first_name="Sam",
+        user_gender="male",
+        timezone="America/New_York",
+        memories=memories,
+        preferences=[],
+    )
+    result = view.to_list()
+
+    assert len(result) == 8
+    assert result[-1]["role"] == "system"
+    assert result[4]["role"] == "system"
+    assert "Likes tea" in result[4]["content"]
+    assert result[:4] == messages[:4]
+    assert result[5:7] == messages[4:]
+
+
+def test_add_system_prompts_reuses_cached_prompts():
+    memories = [
+        {
+            "id": "memory-1",
+            "memory": "Has a dog named Rex",
+            "updated_at": "2024-10-01T10:00:00+00:00",
+            "created_at": None,
+        },
+    ]
+    preferences = [{"id": "preference-1", "memory": "Prefers short answers"}]
+    kwargs = dict(
+        ai_first_name="Charlotte",
+        user_first_name="Sam",
+        user_gender="male",
+        timezone="America/New_York",
+        memories=memories,
+        preferences=preferences,
+    )
+    stats_before = fetch_prompt_cache_stats()
+
+    first = add_system_prompts(messages=build_messages(6), **kwargs).to_list()
+    second = add_system_prompts(messages=build_messages(7), **kwargs).to_list()
+
+    assert first[-1]["content"] is second[-1]["content"]
+    assert "Prefers short answers" in second[-1]["content"]
+    assert fetch_prompt_cache_stats()["hits"] == stats_before["hits"] + 2
+
+    renamed = add_system_prompts(
+        messages=build_messages(6), **{**kwargs, "ai_first_name": "Mark"}
+    ).to_list()
+    assert "Mark" in renamed[-1]["content"]
+    assert renamed[4]["content"] is first[4]["content"]
@@ -0,0 +1,79 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+from email.parser import BytesParser
+
+import pytest
+
+from server.api.multipart import accepts_media_type, stream_multipart
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, False),
+        ("*/*", False),
+        ("application/json", False),
+        ("multipart/mixed", True),
+        ("application/json;q=0.5, Multipart/Mixed", True),
+        ("multipart/*;q=0.2", True),
+        ("multipart/mixed;q=0, application/json", False),
+        ("multipart/mixed;q=oops", False),
+    ],
+)
+def test_accepts_media_type(accept, expected):
+    assert accepts_media_type(accept, "multipart/mixed") == expected
+
+
+def test_streams_parts_without_copying_chunks():
+    audio_chunks = [b"\xff\xfb" * 100, b"\r\n--not-a-boundary\r\n", b"\x00" * 50]
+
+    async def audio():
+        for chunk in audio_chunks:
+            yield chunk
+
+    async def run():
+        return [
+            chunk
+            async for chunk in stream_multipart(
+                [
+                    ({"Content-Type": "application/json"}, b'{"text": "Hi"}'),
+                    ({"Content-Type": "audio/mpeg", "Content-ID": "<a1>"}, audio()),
+                ],
+                "b0undary",
+            )
+        ]
+
+    chunks = asyncio.run(run())
+    for audio_chunk in audio_chunks:
+        assert any(chunk is audio_chunk for chunk in chunks)
+
+    message = BytesParser().parsebytes(
+        b'Content-Type: multipart/mixed; boundary="b0undary"\r\n\r\n' + b"".join(chunks)
+    )
+    json_part, audio_part = message.get_payload()
+    assert json_part.get_content_type() == "application/json"
+    assert json_part.get_payload(decode=True) == b'{"text": "Hi"}'
+    assert audio_part["Content-ID"] == "<a1>"
+    assert audio_part.get_payload(decode=True) == b"".join(audio_chunks)
+
+
+def test_cut_short_bodies_have_no_closing_boundary():
+    async def failing_audio():
+        yield b"audio"
+        raise RuntimeError("synthesis failed")
+
+    chunks = []
+
+    async def run():
+        async for chunk in stream_multipart(
+            [({"Content-Type": "audio/mpeg"}, failing_audio())], "b0undary"
+        ):
+            chunks.append(chunk)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert b"--b0undary--" not in b"".join(chunks)
@@ -0,0 +1,52 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+
+from server.api.sentences import SentenceSegmenter, segment_sentences
+
+REPLY = (
+    "Hi! I talked to Dr. Smith about it today. It costs 3.50 a month, which is "
+    'cheap. She said "try it first." Want to?'
+)
+
+
+def segment_in_pieces(text, piece_size, min_characters=20):
+    segmenter = SentenceSegmenter(min_characters)
+    sentences = []
+    for i in range(0, len(text), piece_size):
+        sentences += segmenter.push(text[i : i + piece_size])
+    return sentences + segmenter.flush()
+
+
+def test_splits_sentences_however_the_text_arrives():
+    expected = [
+        "Hi! I talked to Dr. Smith about it today.",
+        "It costs 3.50 a month, which is cheap.",
+        'She said "try it first."',
+        "Want to?",
+    ]
+    for piece_size in [1, 2, 3, 7, len(REPLY)]:
+        assert segment_in_pieces(REPLY, piece_size) == expected
+
+
+def test_sentences_are_returned_as_soon_as_they_end():
+    segmenter = SentenceSegmenter(min_characters=0)
+    assert segmenter.push("The first sentence.") == []
+    assert segmenter.push(" The second") == ["The first sentence."]
+    assert segmenter.push(" one\nA new line") == ["The second one"]
+    assert segmenter.flush() == ["A new line"]
+    assert segmenter.flush() == []
+
+
+def test_segments_async_streams():
+    async def pieces():
+        for word in REPLY.split(" "):
+            yield word + " "
+
+    async def run():
+        return [sentence async for sentence in segment_sentences(pieces())]
+
+    assert len(asyncio.run(run())) == 4
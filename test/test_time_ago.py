@@ -5,7 +5,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 
 from datetime import datetime
 
-from server.api.utils import time_ago
+from server.api.utils import time_ago, time_ago_batch
 
 # Define the timezone to be used in tests
 time_zone = 'America/New_York'
@@ -198,3 +198,17 @@ def test_boundary_of_this_morning():
     current_time = datetime.fromisoformat('2023-10-01T16:00:00+00:00')
     result = time_ago(current_time, previous_time, time_zone)
     assert result == 'This afternoon'
+
+def test_batch_matches_individual_calls():
+    # Current time: October 2nd, 11:00 AM EDT (October 2nd, 15:00 PM UTC)
+    current_time = datetime.fromisoformat('2023-10-02T15:00:00+00:00')
+    previous_times = [
+        datetime.fromisoformat('2023-10-02T13:00:00+00:00'),
+        datetime.fromisoformat('2023-10-01T23:00:00+00:00'),
+        datetime.fromisoformat('2023-09-25T15:00:00+00:00'),
+        datetime.fromisoformat('2023-06-01T15:00:00+00:00'),
+        datetime.fromisoformat('2020-06-01T15:00:00+00:00'),
+    ]
+    result = time_ago_batch(current_time, previous_times, time_zone)
+    assert result == [time_ago(current_time, previous_time, time_zone) for previous_time in previous_times]
+    assert result == ['This morning', 'Yesterday evening', 'One week ago', 'Four months ago', '3 years ago']
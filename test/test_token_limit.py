@@ -0,0 +1,166 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from server.api.constants import LLM
+from server.api.utils import (
+    MessageTokenIndex,
+    count_tokens_for_message,
+    estimate_tokens_for_messages,
+    fetch_token_estimate_stats,
+    get_final_messages_by_token_limit,
+    seed_message_token_count,
+    upper_bound_tokens_for_message,
+)
+
+
+class WordEncoding:
+    # Stand-in for a tiktoken encoding that counts one token per word and records every call
+    def __init__(self, name="words"):
+        self.name = name
+        self.encoded = []
+
+    def encode_ordinary(self, text):
+        self.encoded.append(text)
+        return text.split()
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+
+def build_messages(num_messages):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(["word"] * (i % 7 + 1)) + f" message-{i}",
+        }
+        for i in range(num_messages)
+    ]
+
+
+def brute_force_start_index(messages, encoding, token_limit):
+    for start_index in range(len(messages) + 1):
+        if (
+            estimate_tokens_for_messages(messages[start_index:], encoding)
+            <= token_limit
+        ):
+            return start_index
+    return len(messages)
+
+
+def test_matches_brute_force_for_small_and_large_limits():
+    messages = build_messages(300)
+    encoding = WordEncoding()
+    for token_limit in [0, 3, 10, 150, 999, 1000, 1001, 2500, 100000]:
+        expected = messages[brute_force_start_index(messages, encoding, token_limit) :]
+        result = get_final_messages_by_token_limit(
+            messages=messages, model=LLM, encoding=encoding, token_limit=token_limit
+        )
+        assert result == expected
+
+
+def test_only_counts_messages_up_to_the_cut_point():
+    messages = build_messages(1000)
+    encoding = WordEncoding(name="words-uncached")
+    index = MessageTokenIndex(messages, encoding)
+    num_messages = index.num_messages_within_limit(150)
+
+    assert 0 < num_messages < len(messages)
+    # Messages are counted in chunks that double in size, so at most twice the kept messages (and
+    # at least one chunk) are encoded, with two texts (role and content) per message
+    num_counted = len(encoding.encoded) // 2
+    assert (
+        num_messages
+        < num_counted
+        <= max(2 * (num_messages + 1), MessageTokenIndex.MIN_CHUNK_SIZE)
+    )
+
+
+def test_message_counts_are_reused_across_calls():
+    messages = build_messages(200)
+    encoding = WordEncoding(name="words-reused")
+    estimate_tokens_for_messages(messages, encoding)
+    num_encoded = len(encoding.encoded)
+    for token_limit in [150, 1000, 2500]:
+        get_final_messages_by_token_limit(
+            messages=messages, model=LLM, encoding=encoding, token_limit=token_limit
+        )
+    assert len(encoding.encoded) == num_encoded
+
+
+def test_skips_exact_counting_when_far_under_the_limit():
+    messages = build_messages(200)
+    encoding = WordEncoding(name="words-fast-path")
+    stats_before = fetch_token_estimate_stats()
+
+    result = get_final_messages_by_token_limit(
+        messages=messages, model=LLM, encoding=encoding, token_limit=100000
+    )
+
+    assert result == messages
+    assert encoding.encoded == []
+    stats_after = fetch_token_estimate_stats()
+    assert stats_after["fast_path"] == stats_before["fast_path"] + 1
+    assert stats_after["exact_path"] == stats_before["exact_path"]
+
+
+def test_upper_bound_is_never_below_the_exact_count():
+    encoding = WordEncoding()
+    for content in ["", "a", "a b c", "héllo wörld", "日本語 テキスト", "x" * 500]:
+        message = {"role": "user", "content": content, "name": "Sam"}
+        assert upper_bound_tokens_for_message(message) >= count_tokens_for_message(
+            message, encoding
+        )
+
+
+def test_tokens_for_last_matches_estimate():
+    messages = build_messages(50)
+    encoding = WordEncoding()
+    index = MessageTokenIndex(messages, encoding)
+    for num_messages in [0, 1, 10, 50, 60]:
+        expected = estimate_tokens_for_messages(
+            messages[-num_messages:] if num_messages else [], encoding
+        )
+        assert index.tokens_for_last(num_messages) == expected
+
+
+def test_stored_token_counts_skip_encoding():
+    messages = build_messages(20)
+    encoding = WordEncoding(name="words-stored")
+    for message in messages:
+        assert seed_message_token_count(
+            role=message["role"],
+            content=message["content"],
+            token_count=3 + 1 + len(message["content"].split()),
+            token_encoding="words-stored",
+            encoding=encoding,
+        )
+
+    for token_limit in [50, 150]:
+        get_final_messages_by_token_limit(
+            messages=messages, model=LLM, encoding=encoding, token_limit=token_limit
+        )
+    assert encoding.encoded == []
+
+
+def test_stored_token_counts_from_another_encoding_are_ignored():
+    encoding = WordEncoding(name="words-current")
+    assert not seed_message_token_count(
+        role="user",
+        content="hello there",
+        token_count=1,
+        token_encoding="words-old",
+        encoding=encoding,
+    )
+    assert not seed_message_token_count(
+        role="user",
+        content="hello there",
+        token_count=None,
+        token_encoding="words-current",
+        encoding=encoding,
+    )
+    assert (
+        count_tokens_for_message({"role": "user", "content": "hello there"}, encoding)
+        == 6
+    )
@@ -0,0 +1,63 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import tiktoken
+
+from server.api import tokenizers
+from server.api.constants import LLM
+
+
+class FakeEncoding:
+    def __init__(self, name):
+        self.name = name
+        self.num_batch_calls = 0
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts):
+        self.num_batch_calls += 1
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def loaded_encodings(monkeypatch):
+    loaded = []
+
+    def get_encoding(name):
+        loaded.append(name)
+        return FakeEncoding(name)
+
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(tokenizers, "_encodings", {})
+    return loaded
+
+
+def test_uses_the_encoding_of_the_model(loaded_encodings):
+    assert tokenizers.fetch_encoding(LLM).name == "o200k_base"
+    assert tokenizers.fetch_encoding("inflection_3_pi").name == "cl100k_base"
+
+
+def test_loads_each_encoding_once(loaded_encodings):
+    tokenizers.prewarm_encodings()
+    encoding = tokenizers.fetch_encoding(LLM)
+    assert tokenizers.fetch_encoding(LLM) is encoding
+    assert loaded_encodings == ["o200k_base"]
+
+
+def test_unknown_model_raises(loaded_encodings):
+    with pytest.raises(ValueError):
+        tokenizers.fetch_encoding("unknown-model")
+
+
+def test_count_tokens_batch():
+    encoding = FakeEncoding("words")
+    assert tokenizers.count_tokens_batch(["a b", "c"], encoding) == [2, 1]
+    assert encoding.num_batch_calls == 0
+
+    texts = ["one two three"] * tokenizers.MIN_BATCH_SIZE
+    assert tokenizers.count_tokens_batch(texts, encoding) == [3] * len(texts)
+    assert encoding.num_batch_calls == 1
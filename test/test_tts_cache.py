@@ -0,0 +1,208 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+
+import pytest
+from livekit import rtc
+from livekit.agents import tts
+
+from server.api import audio
+from server.api.tts_cache import TTSCache, tts_cache_key
+from server.livekit_worker.tts import CachingTTS
+from server.livekit_worker.voices import CharlotteSettings, VoiceSettingMapping
+
+OTHER_SETTINGS = next(
+    settings
+    for settings in VoiceSettingMapping.values()
+    if settings.voice_id != CharlotteSettings.voice_id
+)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TTSCache(str(tmp_path), max_bytes=10**6, memory_max_bytes=10**4)
+
+
+def test_keys_cover_the_voice_text_and_format():
+    key = tts_cache_key(CharlotteSettings, "Hi there!", "mp3_44100_128")
+    assert key == tts_cache_key(CharlotteSettings, "  Hi \n there! ", "mp3_44100_128")
+    assert key != tts_cache_key(CharlotteSettings, "hi there!", "mp3_44100_128")
+    assert key != tts_cache_key(OTHER_SETTINGS, "Hi there!", "mp3_44100_128")
+    assert key != tts_cache_key(
+        CharlotteSettings.model_copy(update={"model": "other"}),
+        "Hi there!",
+        "mp3_44100_128",
+    )
+    assert key != tts_cache_key(CharlotteSettings, "Hi there!", "pcm_22050_1")
+
+
+def test_audio_is_kept_in_memory_and_on_disk(cache, tmp_path):
+    async def run():
+        await cache.set("small", b"a" * 100)
+        # Larger than the memory tier, so only kept on disk
+        await cache.set("large", b"b" * 20000)
+        assert await cache.get("small") == b"a" * 100
+        assert await cache.get("large") == b"b" * 20000
+
+        # A new process only has the disk tier
+        restarted = TTSCache(str(tmp_path), max_bytes=10**6, memory_max_bytes=10**4)
+        assert await restarted.get("small") == b"a" * 100
+        assert restarted.memory.get("small") == b"a" * 100
+        assert await restarted.get("missing") is None
+
+    asyncio.run(run())
+    assert cache.stats()["memory"]["bytes"] == 100
+
+
+class FakeTextToSpeech:
+    def __init__(self):
+        self.calls = []
+
+    async def convert_as_stream(self, voice_id, text, **kwargs):
+        self.calls.append(text)
+        for word in text.split():
+            yield word.encode()
+
+
+def test_audio_messages_are_synthesized_once(cache, monkeypatch):
+    text_to_speech = FakeTextToSpeech()
+    monkeypatch.setattr(audio, "tts_cache", cache)
+    monkeypatch.setattr(
+        audio,
+        "fetch_elevenlabs",
+        lambda: type("FakeElevenLabs", (), {"text_to_speech": text_to_speech}),
+    )
+
+    async def speak(text):
+        return b"".join(
+            [chunk async for chunk in audio.stream_speech(text, CharlotteSettings)]
+        )
+
+    async def run():
+        # Audio that isn't read to the end isn't cached
+        partial = audio.stream_speech("Stopped early", CharlotteSettings)
+        await partial.__anext__()
+        await partial.aclose()
+
+        return [await speak("Sounds good!"), await speak("Sounds  good!")]
+
+    assert asyncio.run(run()) == [b"Soundsgood!", b"Soundsgood!"]
+    assert text_to_speech.calls == ["Stopped early", "Sounds good!"]
+    assert asyncio.run(speak("Stopped early")) == b"Stoppedearly"
+
+
+def test_stock_sentences_are_reused_anywhere_in_a_reply(cache, monkeypatch):
+    text_to_speech = FakeTextToSpeech()
+    monkeypatch.setattr(audio, "tts_cache", cache)
+    monkeypatch.setattr(
+        audio,
+        "fetch_elevenlabs",
+        lambda: type("FakeElevenLabs", (), {"text_to_speech": text_to_speech}),
+    )
+
+    async def speak_reply(sentences):
+        async def reply():
+            for sentence in sentences:
+                yield sentence
+
+        return b"".join(
+            [
+                chunk
+                async for chunk in audio.synthesize_sentences(
+                    reply(),
+                    synthesize=lambda text, previous_text: audio.stream_speech(
+                        text, CharlotteSettings, previous_text=previous_text
+                    ),
+                )
+            ]
+        )
+
+    async def run():
+        await speak_reply(["That's a great question.", "Let me think about it."])
+        return await speak_reply(["Let me think about it.", "Maybe tomorrow."])
+
+    assert asyncio.run(run()) == b"Letmethinkaboutit.Maybetomorrow."
+    assert text_to_speech.calls == [
+        "That's a great question.",
+        "Let me think about it.",
+        "Maybe tomorrow.",
+    ]
+
+
+class BrokenCache:
+    async def get(self, key):
+        raise OSError("disk failed")
+
+    async def set(self, key, audio):
+        raise OSError("disk full")
+
+
+def test_audio_messages_are_synthesized_when_the_cache_fails(monkeypatch):
+    monkeypatch.setattr(audio, "tts_cache", BrokenCache())
+    monkeypatch.setattr(
+        audio,
+        "fetch_elevenlabs",
+        lambda: type("FakeElevenLabs", (), {"text_to_speech": FakeTextToSpeech()}),
+    )
+
+    async def run():
+        return [
+            chunk
+            async for chunk in audio.stream_speech("Sounds good!", CharlotteSettings)
+        ]
+
+    assert asyncio.run(run()) == [b"Sounds", b"good!"]
+
+
+class FakeTTS(tts.TTS):
+    def __init__(self):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=16000,
+            num_channels=1,
+        )
+        self.calls = []
+
+    def synthesize(self, text):
+        self.calls.append(text)
+        return FakeChunkedStream()
+
+
+class FakeChunkedStream(tts.ChunkedStream):
+    async def _main_task(self):
+        for i in range(3):
+            self._event_ch.send_nowait(
+                tts.SynthesizedAudio(
+                    request_id="r",
+                    segment_id="s",
+                    frame=rtc.AudioFrame(
+                        data=bytes([i]) * 2400,
+                        sample_rate=16000,
+                        num_channels=1,
+                        samples_per_channel=1200,
+                    ),
+                )
+            )
+
+
+def test_the_agent_replays_cached_speech(cache):
+    wrapped = FakeTTS()
+    caching_tts = CachingTTS(wrapped, CharlotteSettings, cache=cache)
+
+    async def say(text):
+        frames = [audio.frame async for audio in caching_tts.synthesize(text)]
+        return b"".join(bytes(frame.data) for frame in frames), frames
+
+    async def run():
+        return await say("Hey, great to meet you!"), await say(
+            "Hey, great to meet you!"
+        )
+
+    (first, _), (replay, replay_frames) = asyncio.run(run())
+    assert replay == first
+    assert wrapped.calls == ["Hey, great to meet you!"]
+    # Replayed in 100ms frames
+    assert [frame.samples_per_channel for frame in replay_frames] == [1600, 1600, 400]
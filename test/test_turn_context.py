@@ -0,0 +1,86 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from collections import Counter
+
+import pytest
+
+from server.api import utils
+from server.api.cache import LRUCache
+from server.api.constants import LLM
+from server.api.utils import TurnContext, add_system_prompts
+from test_token_limit import WordEncoding, build_messages
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    encoding = WordEncoding()
+    monkeypatch.setattr(utils, "fetch_encoding", lambda model: encoding)
+    # Disable the process-wide token count cache so only the turn's own counts are reused
+    monkeypatch.setattr(utils, "_message_token_cache", LRUCache(0))
+    return encoding
+
+
+def test_each_message_is_counted_at_most_once_per_turn(encoding):
+    messages = build_messages(200)
+    turn = TurnContext(messages, model=LLM)
+
+    search_query_window = turn.search_query_window
+    messages_with_system_prompts = add_system_prompts(
+        messages=turn.messages,
+        ai_first_name="Charlotte",
+        user_first_name="Sam",
+        user_gender="male",
+        timezone="America/New_York",
+        memories=[],
+        preferences=[],
+    )
+    truncated_messages = turn.truncate(messages_with_system_prompts, token_limit=600)
+    memory_window = turn.memory_window("Sounds good!")
+
+    encoded_texts = Counter(encoding.encoded)
+    assert all(
+        encoded_texts[message["content"]] <= 1 for message in messages
+    ), encoded_texts.most_common(3)
+
+    # The windows match the separate truncations the turn used to do
+    assert list(search_query_window) == list(
+        utils.get_final_messages_by_token_limit(
+            messages, model=LLM, encoding=encoding, token_limit=150
+        )
+    )
+    assert list(memory_window)[-1] == {"role": "assistant", "content": "Sounds good!"}
+    assert list(truncated_messages) == list(
+        utils.get_final_messages_by_token_limit(
+            messages_with_system_prompts.to_list(),
+            model=LLM,
+            encoding=encoding,
+            token_limit=600,
+        )
+    )
+
+
+def test_short_histories_use_at_least_four_messages(encoding):
+    turn = TurnContext(build_messages(6), model=LLM)
+    assert turn.search_query_contents == [
+        message["content"] for message in build_messages(6)[-4:]
+    ]
+
+
+def test_messages_are_normalized_without_copying(encoding):
+    plain_message = {"role": "user", "content": "Hi"}
+    turn = TurnContext(
+        [
+            plain_message,
+            {"role": "user", "content": [{"type": "text", "text": "Hello"}]},
+            {"role": "assistant", "content": "Hey", "id": "message-1"},
+        ],
+        model=LLM,
+    )
+    assert turn.messages[0] is plain_message
+    assert turn.messages[1:] == [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hey"},
+    ]